@@ -0,0 +1,116 @@
+"""
+Async access to a configured cache.
+
+Django's async cache methods (aget, aget_many, ...) fall back to running the
+sync backend on a thread, which is what django_redis does. For django_redis
+caches AsyncCache talks to the same Redis through redis.asyncio instead,
+with the backend's connection OPTIONS, reusing its key and value encoding so
+sync and async code read each other's entries. Any other backend goes through
+Django's async API.
+"""
+import asyncio
+import weakref
+
+from django.conf import settings
+from django.core.cache import caches
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+# django_redis OPTIONS that carry over to redis.asyncio, as its arguments;
+# CONNECTION_POOL_KWARGS carry over as they are
+CONNECTION_OPTIONS = {
+    'USERNAME': 'username',
+    'PASSWORD': 'password',
+    'SOCKET_TIMEOUT': 'socket_timeout',
+    'SOCKET_CONNECT_TIMEOUT': 'socket_connect_timeout',
+}
+
+
+async def _closing(connection):
+    """
+    Holds `connection` until its event loop shuts down: asyncio.run (which
+    asgiref's async_to_sync uses too) closes the loop's async generators
+    before the loop, running this one's cleanup on it.
+    """
+    try:
+        yield
+    finally:
+        await connection.aclose()
+
+
+class AsyncCache:
+    def __init__(self, alias='default'):
+        self.alias = alias
+        # redis.asyncio connections belong to the event loop that opened them;
+        # each is kept with the generator that closes it (see _closing)
+        self._connections = weakref.WeakKeyDictionary()
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def _connect(self):
+        """A redis.asyncio client configured like the django_redis one."""
+        config = settings.CACHES[self.alias]
+        # The first server is the primary; django_redis writes there too
+        location = config['LOCATION']
+        if isinstance(location, str):
+            location = location.split(',')
+        options = config.get('OPTIONS', {})
+        kwargs = {
+            argument: options[option] for option, argument in CONNECTION_OPTIONS.items() if options.get(option)
+        }
+        kwargs.update(options.get('CONNECTION_POOL_KWARGS', {}))
+        return aioredis.from_url(location[0], **kwargs)
+
+    async def _redis(self):
+        """(redis.asyncio client, django_redis client), or None for other backends."""
+        backend = self.backend
+        if aioredis is None or not type(backend).__module__.startswith('django_redis'):
+            return None
+        client = backend.client
+        loop = asyncio.get_running_loop()
+        if loop not in self._connections:
+            connection = self._connect()
+            closer = _closing(connection)
+            self._connections[loop] = connection, closer
+            await closer.__anext__()
+        return self._connections[loop][0], client
+
+    async def get(self, key, default=None):
+        redis = await self._redis()
+        if redis is None:
+            return await self.backend.aget(key, default)
+        connection, client = redis
+        value = await connection.get(client.make_key(key))
+        return default if value is None else client.decode(value)
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        redis = await self._redis()
+        if redis is None:
+            return await self.backend.aget_many(keys)
+        if not keys:
+            return {}
+        connection, client = redis
+        values = await connection.mget([client.make_key(key) for key in keys])
+        return {key: client.decode(value) for key, value in zip(keys, values) if value is not None}
+
+    async def set_many(self, mapping, timeout):
+        redis = await self._redis()
+        if redis is None:
+            await self.backend.aset_many(mapping, timeout=timeout)
+            return
+        if not mapping:
+            return
+        connection, client = redis
+        async with connection.pipeline(transaction=False) as pipe:
+            for key, value in mapping.items():
+                pipe.set(client.make_key(key), client.encode(value), ex=int(timeout))
+            await pipe.execute()
+
+
+cache = AsyncCache()
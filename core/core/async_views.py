@@ -0,0 +1,124 @@
+"""
+Async counterpart of DRF's APIView for read-only JSON endpoints.
+
+DRF views are sync only, so under ASGI every request to one is handed to the
+thread executor. AsyncAPIView keeps the APIView contract the read views rely
+on: JWT authentication with the SIMPLE_JWT settings, `permission_classes`,
+DRF's error bodies (including Http404) and a rendered DRF Response, while the
+handlers are coroutines that can await the async ORM and cache.
+"""
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.response import Response
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from users.authentication import ClaimsJWTAuthentication, auser_state
+
+from .instrumentation import InstrumentedJSONRenderer
+from .metrics import record_auth_lookup
+
+
+class AsyncJWTAuthentication(ClaimsJWTAuthentication):
+    """ClaimsJWTAuthentication with its lookups done through the async ORM and cache."""
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        if self.is_stateless(validated_token):
+            user_id = self.user_id(validated_token)
+            state = await auser_state(user_id)
+            self.check_state(state)
+            return self.claims_user(user_id, validated_token, state)
+
+        # Same checks as JWTAuthentication.get_user
+        record_auth_lookup('user_db')
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        try:
+            user = await self.user_model.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+
+        if jwt_settings.CHECK_REVOKE_TOKEN and \
+                validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed("The user's password has been changed.", code='password_changed')
+
+        return user
+
+
+class AsyncAPIView(View):
+    permission_classes = []
+    authentication = AsyncJWTAuthentication()
+    renderer = InstrumentedJSONRenderer()
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Token authenticated, like APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.user = await self.authenticate(request)
+            self.check_permissions(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except Http404 as exc:
+            return self.handle_exception(exceptions.NotFound(*exc.args))
+        except exceptions.APIException as exc:
+            return self.handle_exception(exc)
+
+    async def authenticate(self, request):
+        # Set by APIClient.force_authenticate() in tests, as DRF's Request honours it
+        force_user = getattr(request, '_force_auth_user', None)
+        if force_user is not None:
+            return force_user
+        result = await self.authentication.aauthenticate(request)
+        return result[0] if result else AnonymousUser()
+
+    async def http_method_not_allowed(self, request, *args, **kwargs):
+        raise exceptions.MethodNotAllowed(request.method)
+
+    def check_permissions(self, request):
+        for permission_class in self.permission_classes:
+            if not permission_class().has_permission(request, self):
+                if not request.user.is_authenticated:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied()
+
+    def handle_exception(self, exc):
+        headers = {}
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            headers['WWW-Authenticate'] = self.authentication.authenticate_header(None)
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        return self.respond(data, status=exc.status_code, headers=headers)
+
+    def respond(self, data, status=status.HTTP_200_OK, headers=None):
+        return self.render(Response(data, status=status, headers=headers))
+
+    def render(self, response):
+        """Render a DRF Response as JSON here, on the event loop."""
+        response.accepted_renderer = self.renderer
+        response.accepted_media_type = self.renderer.media_type
+        response.renderer_context = {'view': self}
+        return response.render()
@@ -0,0 +1,136 @@
+"""
+Channel layers for server-push events.
+
+Subscribers join named groups ("user:12", "ride:7") and read events from an
+asyncio queue on their own event loop; publishers call group_send() from any
+thread. RedisChannelLayer carries events between processes, so an event
+published by one web worker or by the advance_ride_lifecycle command reaches
+the event streams held open by every worker. InMemoryChannelLayer only
+reaches subscribers in the same process; it is the local stand-in, picked
+like the cache invalidation bus (core.tiered_cache.default_bus) when the
+cache is not Redis.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.utils.functional import SimpleLazyObject
+
+from .tiered_cache import RedisInvalidationBus, uses_redis
+
+# Events a slow subscriber may have queued before it is told to resync
+SUBSCRIBER_QUEUE_SIZE = 100
+RESYNC = {'type': 'resync'}
+LAYER_CHANNEL = 'channel-layer'
+
+
+class Subscription:
+    def __init__(self, layer, groups, loop):
+        self.layer = layer
+        self.groups = tuple(groups)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, event):
+        # Runs on self.loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client fell behind: drop the backlog and have it refetch instead
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self, timeout=None):
+        """The next event; raises asyncio.TimeoutError after `timeout` seconds."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.layer.unsubscribe(self)
+
+
+class InMemoryChannelLayer:
+    def __init__(self):
+        self._groups = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, groups, loop=None):
+        subscription = Subscription(self, groups, loop or asyncio.get_running_loop())
+        with self._lock:
+            for group in subscription.groups:
+                self._groups[group].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for group in subscription.groups:
+                members = self._groups.get(group)
+                if members is not None:
+                    members.discard(subscription)
+                    if not members:
+                        del self._groups[group]
+
+    def group_send(self, group, event):
+        self.group_send_many([(group, event)])
+
+    def group_send_many(self, messages):
+        """Deliver [(group, event)] to every current member of each group."""
+        with self._lock:
+            deliveries = [(subscription, event) for group, event in messages
+                          for subscription in self._groups.get(group, ())]
+        for subscription, event in deliveries:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The subscriber's event loop is gone
+                self.unsubscribe(subscription)
+
+    def resync_all(self):
+        """Tell every subscriber to refetch, after events may have been lost."""
+        with self._lock:
+            subscriptions = {subscription for members in self._groups.values() for subscription in members}
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, RESYNC)
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+
+class RedisChannelLayer(InMemoryChannelLayer):
+    """
+    Events over Redis pub/sub, through the same plumbing as cache
+    invalidations: every process publishes to one Redis channel and delivers
+    what the others published to its own subscribers. A process listens once
+    it has a subscriber, so a command that only publishes holds no
+    connection open. Messages sent while a listener was disconnected are
+    lost, so its subscribers are told to resync.
+    """
+
+    def __init__(self, alias='default', channel=LAYER_CHANNEL, bus=None):
+        super().__init__()
+        self.bus = bus or RedisInvalidationBus(alias, channel)
+        self._listening = False
+
+    def subscribe(self, groups, loop=None):
+        subscription = super().subscribe(groups, loop)
+        with self._lock:
+            listen, self._listening = not self._listening, True
+        if listen:
+            self.bus.subscribe(super().group_send_many, on_reconnect=self.resync_all)
+        return subscription
+
+    def group_send_many(self, messages):
+        messages = list(messages)
+        # The bus does not echo a process's own messages back to it
+        super().group_send_many(messages)
+        self.bus.publish(messages)
+
+
+def default_layer(alias='default'):
+    if uses_redis(alias):
+        return RedisChannelLayer(alias)
+    return InMemoryChannelLayer()
+
+
+# Resolved on first use, once the cache settings are loaded
+channel_layer = SimpleLazyObject(default_layer)
@@ -0,0 +1,161 @@
+"""
+Read replicas with read-your-writes stickiness.
+
+ReplicaRoutingMiddleware decides per request where reads go. GET/HEAD/OPTIONS
+requests read from one replica from settings.DATABASE_REPLICAS, chosen at
+random per request; everything else, and all code outside a request
+(management commands, the archive job), stays on the primary. Writes always
+go to the primary.
+
+A user who wrote is pinned to the primary for PRIMARY_STICKINESS_SECONDS
+(kept in the shared cache, so it holds across workers), which covers the
+replica lag: their next listing can't be missing the join request they just
+made. Within a request, reads after a write and reads inside a transaction
+also go to the primary.
+
+Reads whose results go into the shared cache always use the primary: a value
+filled from a lagging replica would be served to everyone until invalidated,
+and the invalidation for the write it missed has already gone past.
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+from .async_cache import cache as async_cache
+
+_current = ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    def __init__(self, replica):
+        # Alias reads go to, None for the primary
+        self.replica = replica
+        self.wrote = False
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def primary_pin_key(user_id):
+    return f"primary_pin:{user_id}"
+
+
+def token_user_id(request):
+    """The user id of a valid bearer token on `request`, without loading the user."""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    if header is None:
+        return None
+    try:
+        raw_token = authentication.get_raw_token(header)
+        if raw_token is None:
+            return None
+        return authentication.get_validated_token(raw_token)[api_settings.USER_ID_CLAIM]
+    except (AuthenticationFailed, KeyError):
+        return None
+
+
+def read_from_primary():
+    """Send the rest of the current request's reads to the primary."""
+    state = _current.get()
+    if state is not None:
+        state.replica = None
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is None or state.replica is None or state.wrote:
+            return DEFAULT_DB_ALIAS
+        # A transaction on the primary must read its own uncommitted rows
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db not in replicas()
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def pinned_user_id(request, state, user_id):
+        """The user to pin to the primary after the request, if it wrote."""
+        if not state.wrote:
+            return None
+        if user_id is None:
+            user = getattr(request, 'user', None)
+            user_id = user.id if user is not None and user.is_authenticated else None
+        return user_id
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not replicas():
+            return self.get_response(request)
+
+        user_id = token_user_id(request)
+        replica = None
+        if request.method in SAFE_METHODS and not (user_id and cache.get(primary_pin_key(user_id))):
+            replica = random.choice(replicas())
+
+        state = RoutingState(replica)
+        token = _current.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        pinned = self.pinned_user_id(request, state, user_id)
+        if pinned is not None:
+            cache.set(primary_pin_key(pinned), 1, timeout=settings.PRIMARY_STICKINESS_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        if not replicas():
+            return await self.get_response(request)
+
+        user_id = token_user_id(request)
+        replica = None
+        if request.method in SAFE_METHODS and not (user_id and await async_cache.get(primary_pin_key(user_id))):
+            replica = random.choice(replicas())
+
+        state = RoutingState(replica)
+        token = _current.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        pinned = self.pinned_user_id(request, state, user_id)
+        if pinned is not None:
+            await async_cache.set_many({primary_pin_key(pinned): 1}, timeout=settings.PRIMARY_STICKINESS_SECONDS)
+        return response
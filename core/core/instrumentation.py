@@ -0,0 +1,155 @@
+"""
+Per-request performance instrumentation.
+
+QueryMetricsMiddleware counts the queries and DB time of each request through
+a connection execute wrapper, and collects cache hits/misses (and how many
+hits the in-process tier served) and serialization time reported by the code that does that work. The numbers go
+into X-* response headers when DEBUG is on and into one structured log line
+per request otherwise, and are added to the process metrics served on
+/metrics (see core.metrics). The middleware runs natively under both WSGI and
+ASGI, so it does not force async views back onto a thread.
+"""
+import json
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.renderers import JSONRenderer
+
+from . import metrics as process_metrics
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_local_hits = 0
+        self.serialization_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+
+def current_metrics():
+    """The metrics of the request being handled, or None outside a request."""
+    return _current.get()
+
+
+def record_cache(hits=0, misses=0, local_hits=0, cache=None):
+    """`cache` names the cache (e.g. 'upcoming_rides') for the per-cache hit ratio in core.metrics."""
+    if cache is not None:
+        process_metrics.record_cache_lookups(cache, hits, misses)
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+        metrics.cache_local_hits += local_hits
+
+
+@contextmanager
+def measure_serialization():
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.serialization_time += time.perf_counter() - start
+
+
+class InstrumentedJSONRenderer(JSONRenderer):
+    """JSONRenderer that reports its encoding time as serialization."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with measure_serialization():
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+def _wrap_connections(stack, metrics):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(metrics))
+
+
+class QueryMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                _wrap_connections(stack, metrics)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        # Connections are per thread, and the async ORM runs queries on the
+        # request's sync thread, so the wrappers are installed there
+        stack = ExitStack()
+        await sync_to_async(_wrap_connections)(stack, metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current.reset(token)
+        return self.report(request, response, metrics, time.perf_counter() - start)
+
+    def report(self, request, response, metrics, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        fields = {
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2),
+            'queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 2),
+            'cache_hits': metrics.cache_hits,
+            'cache_misses': metrics.cache_misses,
+            'cache_local_hits': metrics.cache_local_hits,
+            'serialization_ms': round(metrics.serialization_time * 1000, 2),
+        }
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = fields['queries']
+            response['X-DB-Time-Ms'] = fields['db_ms']
+            response['X-Cache-Hits'] = fields['cache_hits']
+            response['X-Cache-Misses'] = fields['cache_misses']
+            response['X-Cache-Local-Hits'] = fields['cache_local_hits']
+            response['X-Serialization-Ms'] = fields['serialization_ms']
+            response['X-Response-Time-Ms'] = fields['duration_ms']
+        else:
+            logger.info(json.dumps(fields))
+        process_metrics.observe_request(fields, elapsed)
+        return response
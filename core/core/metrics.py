@@ -0,0 +1,238 @@
+"""
+Process metrics in the Prometheus text format, aggregated across workers.
+
+Each worker process keeps its counters and histograms in memory and writes
+them to METRICS_DIR/run-<process group>/<pid>.json at most every
+FLUSH_INTERVAL seconds (and at exit). GET /metrics flushes the serving
+process, then sums the files of all processes of the server, so a scrape
+sees the whole server whichever worker answers it. The workers a server
+starts share its process group, so each server run has its own directory.
+Files of exited workers are kept, like counters in any Prometheus client,
+so totals never go backwards while the server runs; the directories of runs
+that have no process left are removed by the first flush of a new process.
+
+/metrics is served to requests with settings.METRICS_TOKEN as their bearer
+token, and to staff sessions.
+
+Recorded:
+    http_requests_total, http_request_duration_seconds   per URL name (QueryMetricsMiddleware)
+    db_queries_total, db_query_duration_seconds_total     per URL name
+    serialization_duration_seconds_total                  per URL name
+    cache_requests_total                                  per cache (upcoming_rides, ride_fragment)
+    local_cache_events_total                              in-process tier (core.tiered_cache)
+    jwt_auth_lookups_total                                per lookup source (users.authentication)
+"""
+import atexit
+import hmac
+import json
+import os
+import shutil
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+FLUSH_INTERVAL = 1.0
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# name: (type, help)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by URL name, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Request latency by URL name and method.'),
+    'db_queries_total': ('counter', 'DB queries run by requests, by URL name.'),
+    'db_query_duration_seconds_total': ('counter', 'Time requests spent in DB queries, by URL name.'),
+    'serialization_duration_seconds_total': ('counter', 'Time requests spent serializing, by URL name.'),
+    'cache_requests_total': ('counter', 'Cache lookups by cache and result (hit or miss).'),
+    'local_cache_events_total': ('counter', 'Events of the in-process cache tier.'),
+    'jwt_auth_lookups_total': ('counter', 'Lookups made to authenticate JWT requests, by source.'),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def run_directory(directory):
+    """This server run's subdirectory of `directory`, named after its process group."""
+    return Path(directory) / f'run-{os.getpgrp()}'
+
+
+def prune_runs(directory):
+    """Remove the subdirectories of server runs that have no process left."""
+    for run in Path(directory).glob('run-*'):
+        try:
+            os.killpg(int(run.name.removeprefix('run-')), 0)
+        except ProcessLookupError:
+            shutil.rmtree(run, ignore_errors=True)
+        except (ValueError, PermissionError):
+            # Not a run directory, or a group of another user's processes
+            pass
+
+
+class Registry:
+    def __init__(self, directory=None, process_id=None):
+        # Both resolved at flush time: the settings may change, and workers fork
+        self.directory = directory
+        self.process_id = process_id
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        # (name, labels): [per-bucket counts (last one is +Inf), sum, count]
+        self._histograms = {}
+        self._collectors = []
+        self._last_flush = 0.0
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._counters[name, _label_key(labels)] += value
+
+    def observe(self, name, labels, value):
+        bucket = bisect_left(DURATION_BUCKETS, value)
+        with self._lock:
+            histogram = self._histograms.get((name, _label_key(labels)))
+            if histogram is None:
+                histogram = self._histograms[name, _label_key(labels)] = [[0] * (len(DURATION_BUCKETS) + 1), 0.0, 0]
+            histogram[0][bucket] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def add_collector(self, collect):
+        """`collect()` returns [(counter name, labels, value)] of running totals kept elsewhere."""
+        self._collectors.append(collect)
+        return collect
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, dict(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [
+                [name, dict(labels), list(buckets), total, count]
+                for (name, labels), (buckets, total, count) in self._histograms.items()
+            ]
+        for collect in self._collectors:
+            counters += [[name, labels, value] for name, labels, value in collect()]
+        return {'counters': counters, 'histograms': histograms}
+
+    def path(self):
+        return run_directory(self.directory or settings.METRICS_DIR) / f'{self.process_id or os.getpid()}.json'
+
+    def flush(self):
+        if not self._last_flush:
+            prune_runs(self.directory or settings.METRICS_DIR)
+        path = self.path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed, so readers never see a partial file
+        partial = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        partial.write_text(json.dumps(self.snapshot()))
+        os.replace(partial, path)
+        self._last_flush = time.monotonic()
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+
+registry = Registry()
+
+
+@atexit.register
+def _flush_at_exit():
+    # Only processes that served requests (and so flushed before) have metrics worth keeping
+    if registry._last_flush:
+        registry.flush()
+
+
+def observe_request(fields, elapsed):
+    """Record one request from QueryMetricsMiddleware's report fields."""
+    view = fields['view'] or 'unmatched'
+    registry.inc('http_requests_total', {'view': view, 'method': fields['method'], 'status': str(fields['status'])})
+    registry.observe('http_request_duration_seconds', {'view': view, 'method': fields['method']}, elapsed)
+    registry.inc('db_queries_total', {'view': view}, fields['queries'])
+    registry.inc('db_query_duration_seconds_total', {'view': view}, fields['db_ms'] / 1000)
+    registry.inc('serialization_duration_seconds_total', {'view': view}, fields['serialization_ms'] / 1000)
+    registry.maybe_flush()
+
+
+def record_cache_lookups(cache, hits=0, misses=0):
+    if hits:
+        registry.inc('cache_requests_total', {'cache': cache, 'result': 'hit'}, hits)
+    if misses:
+        registry.inc('cache_requests_total', {'cache': cache, 'result': 'miss'}, misses)
+
+
+def record_auth_lookup(source):
+    """`source`: where a JWT request's user (or user state) came from, e.g. 'state_cache'."""
+    registry.inc('jwt_auth_lookups_total', {'source': source})
+
+
+def collect(directory):
+    """The sum of the metrics files of all processes of this server run in `directory`."""
+    counters = defaultdict(float)
+    histograms = {}
+    for path in run_directory(directory).glob('*.json'):
+        try:
+            snapshot = json.loads(path.read_text())
+        except (OSError, ValueError):
+            # Removed or replaced while listing
+            continue
+        for name, labels, value in snapshot['counters']:
+            counters[name, _label_key(labels)] += value
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            merged = histograms.setdefault((name, _label_key(labels)), [[0] * len(buckets), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+    return counters, histograms
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def render(counters, histograms):
+    """Prometheus text exposition of collect()'s output."""
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {float(value)!r}')
+        else:
+            for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(DURATION_BUCKETS + (float('inf'),), buckets):
+                    cumulative += bucket
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{_labels(labels, le=le)} {float(cumulative)!r}')
+                lines.append(f'{name}_sum{_labels(labels)} {float(total)!r}')
+                lines.append(f'{name}_count{_labels(labels)} {float(count)!r}')
+    return '\n'.join(lines) + '\n'
+
+
+def _may_scrape(request):
+    token = settings.METRICS_TOKEN
+    header = request.headers.get('Authorization', '')
+    if token and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+        return True
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def metrics_view(request):
+    """GET /metrics for Prometheus."""
+    if not _may_scrape(request):
+        return HttpResponseForbidden()
+    registry.flush()
+    return HttpResponse(render(*collect(settings.METRICS_DIR)), content_type=CONTENT_TYPE)
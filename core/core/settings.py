@@ -51,11 +51,18 @@ INSTALLED_APPS = [
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
 ALLOWED_HOSTS = ['*']  # For development only
 
+# Keyset pagination cursors for the ride listings are returned in headers
+CORS_EXPOSE_HEADERS = ['X-Next-Cursor', 'X-Next-Cursor-Created', 'X-Next-Cursor-Accepted', 'ETag']
+
 AUTH_USER_MODEL = 'users.CustomUser'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.instrumentation.InstrumentedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
 }
 
@@ -64,6 +71,7 @@ from datetime import timedelta
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=20),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=100),
+    'TOKEN_REFRESH_SERIALIZER': 'users.authentication.ClaimsTokenRefreshSerializer',
 }
 
 CACHES = {
@@ -78,6 +86,8 @@ CACHES = {
 
 
 MIDDLEWARE = [
+    'core.instrumentation.QueryMetricsMiddleware',
+    'core.db_router.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -118,20 +128,62 @@ WSGI_APPLICATION = 'core.wsgi.application'
 #     }
 # }
 
+import atexit
 import dj_database_url
 import os 
+import shutil
+import sys
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
 
+def _ssl_require(url):
+    # SQLite takes no sslmode; lets a local setup run on SQLite files
+    return not (url or '').startswith('sqlite')
+
+
 DATABASES = {
     'default': dj_database_url.config(
         default=os.environ.get("DATABASE_URL"),
         conn_max_age=600,
-        ssl_require=True
+        ssl_require=_ssl_require(os.environ.get("DATABASE_URL"))
     )
 }
 
+# Read replicas, comma-separated, e.g. locally with two SQLite files:
+#   DATABASE_URL=sqlite:///primary.sqlite3 DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3
+# Safe-method requests read from them (see core.db_router); tests run them
+# as mirrors of the test database.
+DATABASE_REPLICAS = []
+for _index, _url in enumerate(filter(None, os.environ.get("DATABASE_REPLICA_URLS", "").split(','))):
+    DATABASES[f'replica_{_index + 1}'] = {
+        **dj_database_url.parse(_url, conn_max_age=600, ssl_require=_ssl_require(_url)),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{_index + 1}')
+
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter']
+
+# True under `manage.py test`
+TESTING = sys.argv[1:2] == ['test']
+
+# Where each worker process writes its metrics for /metrics to aggregate (see
+# core.metrics); every server run has its own subdirectory. A test run gets a
+# fresh directory, removed when it exits.
+if TESTING:
+    METRICS_DIR = tempfile.mkdtemp(prefix='ride-metrics-test-')
+    atexit.register(shutil.rmtree, METRICS_DIR, ignore_errors=True)
+else:
+    METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(tempfile.gettempdir(), 'ride-metrics'))
+
+# Bearer token Prometheus scrapes /metrics with; without one only staff can
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# How long a user's reads stay on the primary after they write; keep it above
+# the replica lag
+PRIMARY_STICKINESS_SECONDS = int(os.environ.get("PRIMARY_STICKINESS_SECONDS", 5))
+
 
 
 # Password validation
@@ -174,3 +226,19 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Per-request metrics from core.instrumentation are logged here when DEBUG is
+# off; `manage.py test` runs with DEBUG off, so tests only log warnings
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.instrumentation': {
+            'handlers': ['console'], 'level': 'WARNING' if TESTING else 'INFO', 'propagate': False,
+        },
+    },
+}
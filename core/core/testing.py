@@ -0,0 +1,106 @@
+"""
+Test helpers shared by the apps' test suites.
+"""
+import re
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver
+
+
+def url_names(urlpatterns):
+    names = set()
+    for pattern in urlpatterns:
+        if isinstance(pattern, URLResolver):
+            names |= url_names(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+_FULL_SCAN = {
+    # EXPLAIN QUERY PLAN: "SCAN t" reads every row; "SCAN t USING INDEX i" walks an index
+    'sqlite': re.compile(r'\bSCAN (\w+)$'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+
+
+def full_table_scans(sql):
+    """
+    The tables a SELECT reads in full, according to the database's query
+    plan. On PostgreSQL sequential scans are disabled first, so the tiny test
+    tables do not make the planner skip an index that exists.
+    """
+    pattern = _FULL_SCAN.get(connection.vendor)
+    if pattern is None or not sql.lstrip().upper().startswith('SELECT'):
+        return []
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + sql)
+        else:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        plan = [str(row[-1]) for row in cursor.fetchall()]
+
+    tables = set(connection.introspection.table_names())
+    return [
+        match.group(1) for line in plan
+        for match in [pattern.search(line.strip())]
+        if match and match.group(1) in tables
+    ]
+
+
+class QueryBudgetMixin:
+    """
+    Mixin for TestCase classes that pins a query budget on every named URL of
+    an app. Subclasses set `urlpatterns` (the app's urls.urlpatterns) and
+    `query_budgets` ({url name: max queries}); every named URL must have a
+    budget, so a new endpoint cannot ship without one.
+
+    Use assertWithinBudget() for a single request and assertQueriesDoNotScale()
+    to prove an endpoint's query count is independent of the data size. Both
+    also fail if any query the request ran reads a whole table.
+    """
+    urlpatterns = []
+    query_budgets = {}
+
+    def test_every_url_has_a_query_budget(self):
+        missing = url_names(self.urlpatterns) - set(self.query_budgets)
+        self.assertFalse(missing, f"URLs without a query budget: {sorted(missing)}")
+
+    def count_queries(self, make_request):
+        with CaptureQueriesContext(connection) as queries:
+            response = make_request()
+        self.assertLess(response.status_code, 400, getattr(response, 'data', response))
+        return len(queries), queries
+
+    def assertWithinBudget(self, url_name, make_request):
+        count, queries = self.count_queries(make_request)
+        budget = self.query_budgets[url_name]
+        self.assertLessEqual(
+            count, budget,
+            f"{url_name} ran {count} queries, budget is {budget}:\n"
+            + "\n".join(q['sql'] for q in queries.captured_queries)
+        )
+        self.assertNoFullTableScans(url_name, queries)
+        return count
+
+    def assertNoFullTableScans(self, url_name, queries):
+        scans = [
+            (table, q['sql']) for q in queries.captured_queries
+            for table in full_table_scans(q['sql'])
+        ]
+        self.assertFalse(scans, f"{url_name} reads whole tables:\n" + "\n".join(
+            f"{table}: {sql}" for table, sql in scans
+        ))
+
+    def assertQueriesDoNotScale(self, url_name, make_request, grow):
+        """
+        Run `make_request`, call `grow()` to add more rows of whatever the
+        endpoint lists, and run it again: both runs must stay within budget
+        and use the same number of queries.
+        """
+        before = self.assertWithinBudget(url_name, make_request)
+        grow()
+        after = self.assertWithinBudget(url_name, make_request)
+        self.assertEqual(before, after, f"{url_name} query count grows with N: {before} -> {after}")
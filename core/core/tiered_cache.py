@@ -0,0 +1,333 @@
+"""
+Two-tier cache: a bounded in-process LRU/TTL tier in front of a Django cache.
+
+Hot entries (the same few ride fragments, the upcoming page, version tokens)
+are served from the worker's memory without a network round trip. Every
+write and delete through TieredCache drops the key from the local tier of
+every worker: locally right away, elsewhere through an invalidation bus,
+Redis pub/sub when the backend is django_redis and an in-memory bus (this
+process only) otherwise. Fills (fill_many) of values computed after a miss
+are not published: no worker can hold a copy of a key that was missing.
+
+Two things keep a worker from serving a value that was overwritten:
+- A local fill is discarded if its key was invalidated while the value was
+  being read from the backend, so a read racing a delete cannot re-insert
+  the old value after the invalidation went past. Invalidations are tracked
+  per bucket of key hashes, so they only discard fills of nearby keys.
+- Entries live at most LOCAL_TTL seconds, which bounds staleness when a
+  pub/sub message is lost (Redis does not redeliver); after the subscriber
+  reconnects, the local tier is cleared.
+"""
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+from .async_cache import AsyncCache
+from .instrumentation import record_cache
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+LOCAL_MAX_ENTRIES = 10_000
+LOCAL_MAX_BYTES = 32 * 1024 * 1024
+LOCAL_TTL = 10
+LOCAL_GENERATION_BUCKETS = 4096
+BUS_CHANNEL = 'cache-invalidation'
+BUS_RECONNECT_DELAY = 1.0
+
+
+class LocalCache:
+    """
+    Thread-safe LRU with a per-entry TTL, bounded by entry count and by the
+    pickled size of the values.
+    """
+
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES, max_bytes=LOCAL_MAX_BYTES, ttl=LOCAL_TTL,
+                 buckets=LOCAL_GENERATION_BUCKETS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key: (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Bumped by the invalidations of the keys hashing to each bucket, and
+        # the epoch by clear(); fills that started before are discarded
+        self._generations = [0] * buckets
+        self._epoch = 0
+        self.counters = dict.fromkeys(
+            ('hits', 'misses', 'evictions', 'expirations', 'invalidations', 'discarded_fills'), 0
+        )
+
+    def get_many(self, keys):
+        """{key: value} of the live entries among `keys`."""
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] <= now:
+                    self._remove(key)
+                    self.counters['expirations'] += 1
+                    entry = None
+                if entry is None:
+                    self.counters['misses'] += 1
+                    continue
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                found[key] = entry[0]
+        return found
+
+    def _bucket(self, key):
+        return zlib.crc32(key.encode()) % len(self._generations)
+
+    def generations(self, keys):
+        """Token for fill(), taken before `keys` are read from the backend."""
+        with self._lock:
+            return self._epoch, {key: self._generations[self._bucket(key)] for key in keys}
+
+    def fill(self, values, generations):
+        """Store `values` read from the backend since `generations`, but not keys invalidated meanwhile."""
+        sized = [(key, value, len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))) for key, value in values.items()]
+        expires_at = time.monotonic() + self.ttl
+        epoch, started = generations
+        with self._lock:
+            for key, value, size in sized:
+                if epoch != self._epoch or started[key] != self._generations[self._bucket(key)]:
+                    self.counters['discarded_fills'] += 1
+                    continue
+                if size > self.max_bytes:
+                    continue
+                if key in self._entries:
+                    self._remove(key)
+                self._entries[key] = (value, expires_at, size)
+                self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.counters['evictions'] += 1
+
+    def invalidate(self, keys):
+        with self._lock:
+            for key in keys:
+                self._generations[self._bucket(key)] += 1
+                if key in self._entries:
+                    self._remove(key)
+                    self.counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'entries': len(self._entries), 'bytes': self._bytes}
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[2]
+
+
+class InMemoryInvalidationBus:
+    """Delivers invalidations to the subscribers in this process only."""
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, callback, on_reconnect=None):
+        self._subscribers.append(callback)
+
+    def publish(self, keys):
+        for callback in list(self._subscribers):
+            callback(keys)
+
+
+class RedisInvalidationBus:
+    """
+    Invalidations over Redis pub/sub. Each process listens on a daemon thread,
+    started on first subscribe and again after a fork; messages a process
+    published itself are skipped, it invalidated locally already.
+    """
+
+    def __init__(self, alias='default', channel=BUS_CHANNEL):
+        self.alias = alias
+        self.channel = channel
+        self.sender = uuid.uuid4().hex
+        self._callbacks = []
+        self._listener_pid = None
+        self._lock = threading.Lock()
+
+    def _client(self):
+        from django_redis import get_redis_connection
+        return get_redis_connection(self.alias)
+
+    def subscribe(self, callback, on_reconnect=None):
+        self._callbacks.append((callback, on_reconnect))
+        self._ensure_listener()
+
+    def publish(self, keys):
+        self._ensure_listener()
+        self._client().publish(self.channel, json.dumps({'sender': self.sender, 'keys': list(keys)}))
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener_pid == os.getpid() or not self._callbacks:
+                return
+            # A new process (first use, or forked from one that had a listener)
+            self._listener_pid = os.getpid()
+            self.sender = uuid.uuid4().hex
+            threading.Thread(target=self._listen, name='cache-invalidation', daemon=True).start()
+
+    def _listen(self):
+        first = True
+        while True:
+            try:
+                pubsub = self._client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                if not first:
+                    # Messages sent while disconnected are lost
+                    for _, on_reconnect in self._callbacks:
+                        if on_reconnect:
+                            on_reconnect()
+                first = False
+                for message in pubsub.listen():
+                    payload = json.loads(message['data'])
+                    if payload['sender'] != self.sender:
+                        for callback, _ in self._callbacks:
+                            callback(payload['keys'])
+            except Exception:
+                logger.exception('Cache invalidation listener failed; reconnecting')
+                time.sleep(BUS_RECONNECT_DELAY)
+
+
+def uses_redis(alias):
+    """Whether the cache `alias` is a django_redis backend, whose client can also do pub/sub."""
+    return type(caches[alias]).__module__.startswith('django_redis')
+
+
+def default_bus(alias):
+    if uses_redis(alias):
+        return RedisInvalidationBus(alias)
+    return InMemoryInvalidationBus()
+
+
+class TieredCache:
+    """
+    The Django cache API subset the ride caches use, with LocalCache in
+    front. Reads try the local tier first and fill it from the backend;
+    writes and deletes go to the backend and invalidate every worker's copy.
+    """
+
+    def __init__(self, alias='default', local=None, bus=None):
+        self.alias = alias
+        self.local = local or LocalCache()
+        self._bus = None
+        if bus is not None:
+            self._subscribe(bus)
+        self._async_backend = AsyncCache(alias)
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @property
+    def bus(self):
+        if self._bus is None:
+            self._subscribe(default_bus(self.alias))
+        return self._bus
+
+    def _subscribe(self, bus):
+        bus.subscribe(self.local.invalidate, on_reconnect=self.local.clear)
+        self._bus = bus
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = self.local.get_many(keys)
+        record_cache(local_hits=len(found))
+        missing = [key for key in keys if key not in found]
+        if missing:
+            generations = self.local.generations(missing)
+            fetched = self.backend.get_many(missing)
+            self.local.fill(fetched, generations)
+            found.update(fetched)
+        return found
+
+    async def aget(self, key, default=None):
+        return (await self.aget_many([key])).get(key, default)
+
+    async def aget_many(self, keys):
+        keys = list(keys)
+        found = self.local.get_many(keys)
+        record_cache(local_hits=len(found))
+        missing = [key for key in keys if key not in found]
+        if missing:
+            generations = self.local.generations(missing)
+            fetched = await self._async_backend.get_many(missing)
+            self.local.fill(fetched, generations)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout):
+        self.set_many({key: value}, timeout)
+
+    def set_many(self, mapping, timeout):
+        self.backend.set_many(mapping, timeout=timeout)
+        self.invalidate(list(mapping))
+
+    async def aset_many(self, mapping, timeout):
+        await self._async_backend.set_many(mapping, timeout=timeout)
+        self.local.invalidate(list(mapping))
+        await sync_to_async(self.bus.publish, thread_sensitive=False)(list(mapping))
+
+    def fill_many(self, mapping, timeout):
+        """
+        set_many() for values computed after a miss. No worker can hold these
+        keys, so nothing is published; the values go into the local tier.
+        """
+        generations = self.local.generations(mapping)
+        self.backend.set_many(mapping, timeout=timeout)
+        self.local.fill(mapping, generations)
+
+    async def afill_many(self, mapping, timeout):
+        generations = self.local.generations(mapping)
+        await self._async_backend.set_many(mapping, timeout=timeout)
+        self.local.fill(mapping, generations)
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        self.backend.delete_many(keys)
+        self.invalidate(keys)
+
+    def invalidate(self, keys):
+        """Drop `keys` from the local tier of every worker."""
+        self.local.invalidate(keys)
+        self.bus.publish(keys)
+
+    def clear_local(self):
+        self.local.clear()
+
+    def stats(self):
+        return self.local.stats()
+
+
+cache = TieredCache()
+
+
+@registry.add_collector
+def _local_cache_metrics():
+    stats = cache.stats()
+    return [('local_cache_events_total', {'event': event}, stats[event]) for event in cache.local.counters]
@@ -17,8 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls')),
     path('rides/', include('rides.urls')),
+    # Prometheus scrape endpoint
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -0,0 +1,87 @@
+"""
+Cold storage for finished rides.
+
+archive_rides() moves COMPLETED and ABORTED rides that departed more than
+`older_than` ago, with their join requests and participants, into the
+ArchivedRide tables. Rides are moved in batches: each batch is copied with
+bulk inserts from `.values()` rows and deleted from the hot tables in one
+transaction, so memory stays flat and a crash never loses or duplicates a
+ride.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import sync
+from .models import ArchivedRide, ArchivedRideJoinRequest, Ride, RideJoinRequest
+
+ARCHIVED_STATUSES = (Ride.RideStatus.COMPLETED, Ride.RideStatus.ABORTED)
+DEFAULT_ARCHIVE_AGE = timedelta(days=30)
+DEFAULT_BATCH_SIZE = 1000
+
+ARCHIVED_RIDE_FIELDS = (
+    'id', 'owner_id',
+    'pickup_latitude', 'pickup_longitude', 'destination_latitude', 'destination_longitude',
+    'total_seats', 'total_cost', 'cost_per_seat',
+    'status', 'departure_datetime', 'created_at',
+)
+ARCHIVED_REQUEST_FIELDS = ('id', 'ride_id', 'user_id', 'status', 'requested_at')
+
+
+def _m2m_columns(field):
+    return f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+
+
+def _archive_batch(ride_ids):
+    rides = ArchivedRide.objects.bulk_create([
+        ArchivedRide(**row) for row in Ride.objects.filter(id__in=ride_ids).values(*ARCHIVED_RIDE_FIELDS)
+    ])
+    requests = ArchivedRideJoinRequest.objects.bulk_create([
+        ArchivedRideJoinRequest(**row)
+        for row in RideJoinRequest.objects.filter(ride_id__in=ride_ids).values(*ARCHIVED_REQUEST_FIELDS)
+    ])
+
+    hot_ride, hot_user = _m2m_columns(Ride.participants.field)
+    cold_ride, cold_user = _m2m_columns(ArchivedRide.participants.field)
+    ArchivedRide.participants.through.objects.bulk_create([
+        ArchivedRide.participants.through(**{cold_ride: ride_id, cold_user: user_id})
+        for ride_id, user_id in Ride.participants.through.objects
+            .filter(**{f'{hot_ride}__in': ride_ids}).values_list(hot_ride, hot_user)
+    ])
+
+    # The rides leave their users' sync sets; record that from the rows in hand
+    ride_users = {ride.id: {ride.owner_id} for ride in rides}
+    for request in requests:
+        ride_users[request.ride_id].add(request.user_id)
+    sync.record_tombstones(
+        sync.ride_tombstones(ride_users.items())
+        + sync.join_request_tombstones((request.id, request.user_id) for request in requests)
+    )
+
+    # Cascades to the join requests and participants; post_delete drops the cached fragments
+    with sync.batch_removal():
+        Ride.objects.filter(id__in=ride_ids).delete()
+    return len(requests)
+
+
+def archive_rides(older_than=DEFAULT_ARCHIVE_AGE, batch_size=DEFAULT_BATCH_SIZE, now=None, progress=None):
+    """
+    Archive every finished ride that departed before `now - older_than`.
+    Returns {'rides': n, 'join_requests': n}.
+    """
+    cutoff = (now or timezone.now()) - older_than
+    archived = {'rides': 0, 'join_requests': 0}
+    while True:
+        with transaction.atomic():
+            ride_ids = list(
+                Ride.objects.filter(status__in=ARCHIVED_STATUSES, departure_datetime__lt=cutoff)
+                .order_by('departure_datetime')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ride_ids:
+                return archived
+            archived['join_requests'] += _archive_batch(ride_ids)
+            archived['rides'] += len(ride_ids)
+        if progress:
+            progress(archived)
@@ -0,0 +1,170 @@
+"""
+Async versions of the read-heavy ride views, routed in place of the sync ones
+(see urls.py). They share query construction with the sync views and produce
+identical responses; DB access goes through the async ORM, cache reads
+through the async methods of core.tiered_cache, and independent lookups
+are awaited together.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404, StreamingHttpResponse
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+
+from core.async_views import AsyncAPIView
+from core.channels import channel_layer
+
+from .cache import UPCOMING_PAGE_KEY, UPCOMING_PAGE_TIMEOUT, aget_or_rebuild, arender_rides
+from .conditional import alisting_etag, aride_etag, etag_matches, not_modified, with_etag
+from .events import ride_group, user_group
+from .pagination import akeyset_paginate, parse_limit
+from .serializers import RideJoinRequestSerializer, RideJoinRequestWithRideSerializer
+from .views import GetRideDetail, GetUpcomingRidesView, GetUserRides, MyRideJoinRequestsView, invalid_listing_params
+
+
+class AsyncGetUpcomingRidesView(AsyncAPIView):
+    async def get(self, request):
+        user = request.user if request.user.is_authenticated else None
+        params = request.GET
+
+        if GetUpcomingRidesView.is_nearby_search(params):
+            # Candidate scoring is numpy work over the cell rows; keep it off the event loop
+            try:
+                ordered_ids = await sync_to_async(GetUpcomingRidesView.nearby_ride_ids)(params)
+            except ValueError as exc:
+                return self.respond({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+            page = {'ride_ids': ordered_ids, 'next_cursor': None}
+        # Only the default first page is cached; filtered and deeper pages go to the DB
+        elif not params:
+            page = await aget_or_rebuild(
+                UPCOMING_PAGE_KEY, lambda: GetUpcomingRidesView.build_page({}, using=DEFAULT_DB_ALIAS),
+                UPCOMING_PAGE_TIMEOUT,
+            )
+        else:
+            try:
+                rides, next_cursor = await akeyset_paginate(
+                    GetUpcomingRidesView.page_queryset(params),
+                    ('departure_datetime', 'id'),
+                    cursor=params.get('cursor'),
+                    limit=parse_limit(params),
+                )
+            except ValueError:
+                return self.render(invalid_listing_params())
+            page = {'ride_ids': [ride.id for ride in rides], 'next_cursor': next_cursor}
+
+        etag = await alisting_etag(page, user)
+        if etag_matches(request, etag):
+            return self.render(not_modified(etag))
+
+        response = with_etag(self.respond(await arender_rides(page['ride_ids'], user)), etag)
+        if page['next_cursor']:
+            response['X-Next-Cursor'] = page['next_cursor']
+        return response
+
+
+class AsyncGetRideDetail(AsyncAPIView):
+    async def get(self, request, ride_id):
+        user = request.user if request.user.is_authenticated else None
+        etag = await aride_etag(ride_id, user)
+        if etag_matches(request, etag):
+            return self.render(not_modified(etag))
+
+        rendered = await arender_rides([ride_id], user)
+        if not rendered:
+            raise Http404
+        join_requests = None
+        if rendered[0]['is_user_owner']:
+            join_requests = RideJoinRequestSerializer(
+                [join_request async for join_request in GetRideDetail.join_requests_queryset(ride_id)], many=True
+            ).data
+        return with_etag(self.respond(GetRideDetail.build_detail(rendered[0], join_requests)), etag)
+
+
+class AsyncGetUserRides(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request):
+        user = request.user
+        try:
+            created, accepted = GetUserRides.ride_queries(user, request.GET)
+            (created_rides, created_next), (accepted_rides, accepted_next) = await asyncio.gather(
+                akeyset_paginate(*created), akeyset_paginate(*accepted)
+            )
+        except ValueError:
+            return self.render(invalid_listing_params())
+
+        rendered = await arender_rides([ride.id for ride in created_rides + accepted_rides], user)
+        return self.render(
+            GetUserRides.build_response(rendered, created_rides, created_next, accepted_rides, accepted_next)
+        )
+
+
+class AsyncMyRideJoinRequestsView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request):
+        try:
+            join_requests, next_cursor = await akeyset_paginate(
+                *MyRideJoinRequestsView.page_query(request.user, request.GET)
+            )
+        except ValueError:
+            return self.render(invalid_listing_params())
+
+        serializer = RideJoinRequestWithRideSerializer(join_requests, many=True, context={'request': request})
+        response = self.respond(serializer.data)
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return response
+
+
+class RideEventsView(AsyncAPIView):
+    """
+    Server-sent events for the signed-in user: their own join-request events,
+    plus seat and status changes of the rides listed in `?rides=1,2,3` (the
+    rides the client is showing). See rides.events for the event types. A
+    `resync` event means events were dropped and the client should refetch.
+    """
+    permission_classes = [IsAuthenticated]
+    HEARTBEAT_SECONDS = 15
+    MAX_RIDES = 200
+
+    async def get(self, request):
+        try:
+            ride_ids = [int(ride_id) for ride_id in request.GET.get('rides', '').split(',') if ride_id]
+        except ValueError:
+            ride_ids = None
+        if ride_ids is None or len(ride_ids) > self.MAX_RIDES:
+            return self.respond(
+                {'error': f'rides must be a comma-separated list of at most {self.MAX_RIDES} ride ids.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        groups = [user_group(request.user.id)] + [ride_group(ride_id) for ride_id in ride_ids]
+        response = StreamingHttpResponse(self.stream(groups), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, groups):
+        # Subscribed on first read, so a response that is never consumed holds nothing
+        subscription = channel_layer.subscribe(groups)
+        try:
+            yield self.format_event({'type': 'ready'})
+            while True:
+                try:
+                    event = await subscription.get(timeout=self.HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield self.format_event(event)
+        finally:
+            subscription.close()
+
+    @staticmethod
+    def format_event(event):
+        data = {key: value for key, value in event.items() if key != 'type'}
+        return f"event: {event['type']}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
@@ -0,0 +1,215 @@
+"""
+Bulk import of users and seed rides from JSON Lines, for onboarding a campus.
+
+One object per line, tagged by "type":
+
+    {"type": "user", "phone_number": "9000000001", "full_name": "A Student", "password": "..."}
+    {"type": "ride", "owner": "9000000001", "pickup_latitude": 12.97, "pickup_longitude": 77.59,
+     "destination_latitude": 12.93, "destination_longitude": 77.62, "total_seats": 4,
+     "total_cost": "400", "departure_datetime": "2025-03-10T09:00:00Z", "status": "UPCOMING"}
+
+The input is streamed in batches of `batch_size` lines. Each batch is
+validated with one serializer per row type and one query for the phone
+numbers it names, then written with bulk_create in one transaction; rows
+that fail validation are reported and skipped. Users are written before
+rides, so a ride's owner may come from the same batch or an earlier one.
+Rides get their derived fields from Ride.fill_derived_fields(), exactly as
+Ride.save() sets them.
+
+Password hashing dominates the cost of importing users; `hash_workers`
+spreads it over a process pool. With a checkpoint name, the number of input
+lines done is stored in an ImportProgress row in each batch's transaction,
+and a resumed run skips them; a crash loses the batch and its progress
+together, so no row is imported twice.
+"""
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+from users.serializers import UserImportSerializer
+
+from .cache import invalidate_rides
+from .models import ImportProgress, Ride
+from .serializers import RideCreateSerializer
+
+User = get_user_model()
+
+DEFAULT_BATCH_SIZE = 1000
+# A bad input can fail on every line; past this many only the count grows
+MAX_STORED_ERRORS = 1000
+
+
+def _init_hash_worker():
+    # Workers started with spawn/forkserver have not loaded the settings yet
+    django.setup()
+
+
+class PasswordHasher:
+    """make_password() for many passwords, in a process pool when `workers` > 1."""
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self.pool = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_hash_worker)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def hash_many(self, passwords):
+        if self.pool is None or len(passwords) < 2:
+            return [make_password(password) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self.pool.map(make_password, passwords, chunksize=chunksize))
+
+
+def read_batches(lines, batch_size, skip=0):
+    """Batches of [(line_number, line)] from `lines`, after the first `skip` lines."""
+    batch = []
+    for number, line in enumerate(lines, 1):
+        if number <= skip:
+            continue
+        batch.append((number, line))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _error_message(detail):
+    if isinstance(detail, dict):
+        return '; '.join(f'{field}: {_error_message(value)}' for field, value in detail.items())
+    if isinstance(detail, list):
+        return ' '.join(_error_message(value) for value in detail)
+    return str(detail)
+
+
+def _validate(serializer, rows, errors):
+    """[(line_number, record, validated_data)] for the rows `serializer` accepts."""
+    valid = []
+    for number, record in rows:
+        try:
+            valid.append((number, record, serializer.run_validation(record)))
+        except ValidationError as exc:
+            errors.append((number, _error_message(exc.detail)))
+    return valid
+
+
+def _import_users(rows, hasher, errors):
+    valid = _validate(UserImportSerializer(), rows, errors)
+    taken = set(User.objects.filter(
+        phone_number__in=[data['phone_number'] for _, _, data in valid]
+    ).values_list('phone_number', flat=True))
+
+    new = []
+    for number, _, data in valid:
+        if data['phone_number'] in taken:
+            errors.append((number, 'phone_number: a user with this phone number already exists.'))
+            continue
+        taken.add(data['phone_number'])
+        new.append(data)
+
+    passwords = hasher.hash_many([data.get('password') for data in new])
+    User.objects.bulk_create([
+        User(phone_number=data['phone_number'], full_name=data['full_name'], password=password)
+        for data, password in zip(new, passwords)
+    ])
+    return len(new)
+
+
+def _import_rides(rows, errors):
+    valid = _validate(RideCreateSerializer(), rows, errors)
+    owners = dict(User.objects.filter(
+        phone_number__in={str(record.get('owner')) for _, record, _ in valid}
+    ).values_list('phone_number', 'id'))
+
+    new = []
+    for number, record, data in valid:
+        owner_id = owners.get(str(record.get('owner')))
+        ride_status = record.get('status', Ride.RideStatus.UPCOMING)
+        if owner_id is None:
+            errors.append((number, 'owner: no user with this phone number.'))
+        elif ride_status not in Ride.RideStatus.values:
+            errors.append((number, f'status: "{ride_status}" is not a valid choice.'))
+        else:
+            ride = Ride(owner_id=owner_id, status=ride_status, **data)
+            ride.fill_derived_fields()
+            new.append(ride)
+
+    Ride.objects.bulk_create(new)
+    if new:
+        # New upcoming rides may belong on the cached first page
+        invalidate_rides([], listing=True)
+    return len(new)
+
+
+def import_batch(batch, hasher, checkpoint=None):
+    """
+    Import one batch of (line_number, line), recording its last line as done
+    under `checkpoint`; returns {'users', 'rides', 'errors'}.
+    """
+    users, rides, errors = [], [], []
+    for number, line in batch:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            errors.append((number, f'invalid JSON: {exc}'))
+            continue
+        kind = record.get('type') if isinstance(record, dict) else None
+        if kind == 'user':
+            users.append((number, record))
+        elif kind == 'ride':
+            rides.append((number, record))
+        else:
+            errors.append((number, 'type must be "user" or "ride".'))
+
+    with transaction.atomic():
+        imported_users = _import_users(users, hasher, errors)
+        imported_rides = _import_rides(rides, errors)
+        if checkpoint:
+            write_checkpoint(checkpoint, batch[-1][0])
+    return {'users': imported_users, 'rides': imported_rides, 'errors': sorted(errors)}
+
+
+def read_checkpoint(name):
+    """Input lines already imported under the checkpoint `name`; 0 if there is none."""
+    return ImportProgress.objects.filter(name=name).values_list('lines', flat=True).first() or 0
+
+
+def write_checkpoint(name, lines):
+    ImportProgress.objects.update_or_create(name=name, defaults={'lines': lines})
+
+
+def run_import(lines, batch_size=DEFAULT_BATCH_SIZE, hash_workers=0, checkpoint=None, resume=False,
+               progress=None):
+    """
+    Import the JSON Lines in `lines` (any iterable of str, e.g. an open file).
+    Returns {'lines', 'users', 'rides', 'errors': [(line_number, message)],
+    'error_count'}, `errors` holding the first MAX_STORED_ERRORS of them;
+    `progress` is called with the running totals after every batch.
+    """
+    skip = read_checkpoint(checkpoint) if checkpoint and resume else 0
+    totals = {'lines': skip, 'users': 0, 'rides': 0, 'errors': [], 'error_count': 0}
+    with PasswordHasher(hash_workers) as hasher:
+        for batch in read_batches(lines, batch_size, skip=skip):
+            result = import_batch(batch, hasher, checkpoint)
+            totals['lines'] = batch[-1][0]
+            totals['users'] += result['users']
+            totals['rides'] += result['rides']
+            totals['errors'] += result['errors'][:MAX_STORED_ERRORS - len(totals['errors'])]
+            totals['error_count'] += len(result['errors'])
+            if progress:
+                progress(totals)
+    return totals
@@ -0,0 +1,378 @@
+import asyncio
+import math
+import random
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from redis.exceptions import LockError
+
+from core.db_router import read_from_primary
+from core.instrumentation import measure_serialization, record_cache
+from core.tiered_cache import cache as tiered_cache, uses_redis
+
+from .models import Ride
+from .projections import auser_request_status, overlay_user_fields, render_ride_fragments, user_request_status
+
+# Entries are invalidated on write (see rides.signals), so the TTLs only bound
+# how long an entry survives a write path that bypasses the ORM signals.
+# Fragments and the upcoming page are stored with their generation token
+# (see generation_key), so a fill that raced an invalidation is never served.
+# Fragments, the upcoming page and version tokens are read through
+# core.tiered_cache, which keeps hot entries in worker memory; rebuild locks
+# go to the shared cache directly.
+RIDE_FRAGMENT_TIMEOUT = 60 * 60 * 24
+UPCOMING_PAGE_TIMEOUT = 60 * 60
+
+# How long an expired entry may still be served while one worker rebuilds it
+STALE_GRACE = 60 * 5
+# Upper bound on a rebuild; the lock frees itself if the holder dies
+REBUILD_LOCK_TIMEOUT = 30
+# Waiters with nothing stale to serve poll for the rebuilt value this long
+REBUILD_WAIT = 5.0
+REBUILD_POLL_INTERVAL = 0.05
+# XFetch beta: > 1 favours earlier refreshes
+EARLY_REFRESH_BETA = 1.0
+
+# Ids of the default first page of upcoming rides, shared by all users
+UPCOMING_PAGE_KEY = "upcoming_rides:first_page"
+
+
+def ride_fragment_key(ride_id):
+    return f"ride_fragment:{ride_id}"
+
+
+def generation_key(key):
+    """
+    Token of the current generation of the entry at `key`, dropped along with
+    the entry on invalidation and minted again by the next fill. A fill takes
+    the token before it reads the DB and stores it in the entry; readers only
+    accept an entry whose token is still current, so data read before an
+    invalidation cannot be cached past it.
+    """
+    return f"{key}:generation"
+
+
+# Version tokens for conditional GETs (see rides.conditional). A token is
+# dropped on every write that changes what it covers, and a missing token is
+# replaced by a new random one, so an evicted token can never match an old ETag.
+VERSION_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def ride_version_key(ride_id):
+    """Covers the ride, its participants and its join requests."""
+    return f"ride_version:{ride_id}"
+
+
+def user_requests_version_key(user_id):
+    """Covers the join requests made by the user."""
+    return f"user_requests_version:{user_id}"
+
+
+def invalidate_ride(ride_id, listing=False):
+    """
+    Drop the cached fragment and version token of a ride once the current
+    transaction commits. `listing` also drops the shared upcoming page, for
+    changes that can move the ride in or out of it (creation, deletion,
+    status or departure time).
+    """
+    invalidate_rides([ride_id], listing=listing)
+
+
+def invalidate_rides(ride_ids, listing=False):
+    """invalidate_ride() for many rides with one cache round trip, for set-based writes."""
+    keys = [
+        key for ride_id in ride_ids
+        for key in (ride_fragment_key(ride_id), generation_key(ride_fragment_key(ride_id)), ride_version_key(ride_id))
+    ]
+    if listing:
+        keys += [UPCOMING_PAGE_KEY, generation_key(UPCOMING_PAGE_KEY)]
+    if keys:
+        transaction.on_commit(lambda: tiered_cache.delete_many(keys))
+
+
+def invalidate_join_requests(changes):
+    """
+    Drop the version tokens of the rides and users in `changes`
+    [(ride_id, user_id)] once the current transaction commits. Cached
+    fragments hold no join-request data and are kept.
+    """
+    keys = {key for ride_id, user_id in changes
+            for key in (ride_version_key(ride_id), user_requests_version_key(user_id))}
+    if keys:
+        transaction.on_commit(lambda: tiered_cache.delete_many(list(keys)))
+
+
+def _fill_versions(keys, cached):
+    missing = {key: uuid.uuid4().hex for key in keys if key not in cached}
+    return {**cached, **missing}, missing
+
+
+def get_versions(keys):
+    """
+    {key: token} for version keys, minting tokens for the missing ones. A
+    minted token vouches for the data read after it, so the rest of the
+    request reads from the primary.
+    """
+    versions, missing = _fill_versions(keys, tiered_cache.get_many(keys))
+    if missing:
+        read_from_primary()
+        tiered_cache.fill_many(missing, timeout=VERSION_TIMEOUT)
+    return versions
+
+
+async def aget_versions(keys):
+    versions, missing = _fill_versions(keys, await tiered_cache.aget_many(keys))
+    if missing:
+        read_from_primary()
+        await tiered_cache.afill_many(missing, timeout=VERSION_TIMEOUT)
+    return versions
+
+
+def _current(cached, key):
+    """The entry at `key` in `cached` (read with its generation key), unless a later generation began."""
+    entry, generation = cached.get(key), cached.get(generation_key(key))
+    if entry is None or generation is None or entry.get('generation') != generation:
+        return None
+    return entry
+
+
+def _generations(keys, cached, timeout):
+    """{key: generation token} for entries about to be filled, minting the missing tokens."""
+    generations, missing = _fill_versions([generation_key(key) for key in keys], cached)
+    if missing:
+        tiered_cache.fill_many(missing, timeout=timeout)
+    return {key: generations[generation_key(key)] for key in keys}
+
+
+async def _agenerations(keys, cached, timeout):
+    generations, missing = _fill_versions([generation_key(key) for key in keys], cached)
+    if missing:
+        await tiered_cache.afill_many(missing, timeout=timeout)
+    return {key: generations[generation_key(key)] for key in keys}
+
+
+def _write(entries, cached, timeout):
+    """
+    Store `entries`. Only those replacing an entry in `cached` can be held
+    by other workers and are published; the rest are fills after a miss.
+    """
+    replaced = {key: entry for key, entry in entries.items() if key in cached}
+    if replaced:
+        tiered_cache.set_many(replaced, timeout=timeout)
+    if len(replaced) < len(entries):
+        tiered_cache.fill_many({key: entry for key, entry in entries.items() if key not in cached}, timeout=timeout)
+
+
+async def _awrite(entries, cached, timeout):
+    replaced = {key: entry for key, entry in entries.items() if key in cached}
+    if replaced:
+        await tiered_cache.aset_many(replaced, timeout=timeout)
+    if len(replaced) < len(entries):
+        await tiered_cache.afill_many(
+            {key: entry for key, entry in entries.items() if key not in cached}, timeout=timeout
+        )
+
+
+def _store(key, value, timeout, delta, generation, cached):
+    envelope = {'value': value, 'expires_at': time.time() + timeout, 'delta': delta, 'generation': generation}
+    _write({key: envelope}, cached, timeout + STALE_GRACE)
+
+
+def _rebuild(key, rebuild, timeout, cached):
+    # The token is taken before rebuild() reads anything
+    generation = _generations([key], cached, timeout + STALE_GRACE)[key]
+    start = time.time()
+    value = rebuild()
+    _store(key, value, timeout, time.time() - start, generation, cached)
+    return value
+
+
+def _cache_name(key):
+    # "upcoming_rides:first_page" is reported as upcoming_rides
+    return key.split(':', 1)[0]
+
+
+def _is_fresh(envelope, now):
+    if envelope is None:
+        return False
+    early = envelope['delta'] * EARLY_REFRESH_BETA * -math.log(1.0 - random.random())
+    return now + early < envelope['expires_at']
+
+
+class _LocalLock:
+    """
+    The rebuild lock for cache backends without an atomic compare-and-delete
+    (local memory, in tests). Such a cache is private to the process, so a
+    threading lock around taking and releasing makes both atomic.
+    """
+    _guard = threading.Lock()
+
+    def __init__(self, key, timeout):
+        self.key = key
+        self.timeout = timeout
+        # Tells this worker's lock from one taken after it expired
+        self.token = uuid.uuid4().hex
+
+    def acquire(self, blocking=False):
+        with self._guard:
+            return cache.add(self.key, self.token, timeout=self.timeout)
+
+    def release(self):
+        with self._guard:
+            if cache.get(self.key) == self.token:
+                cache.delete(self.key)
+
+
+def _rebuild_lock(key):
+    """
+    A lock on `key` that frees itself after REBUILD_LOCK_TIMEOUT. On Redis it
+    is redis-py's lock, released by a script that deletes the key only while
+    it still holds this worker's token, so an overrunning holder never frees
+    the lock of the worker that took it after it expired.
+    """
+    if uses_redis('default'):
+        return cache.lock(key, timeout=REBUILD_LOCK_TIMEOUT)
+    return _LocalLock(key, REBUILD_LOCK_TIMEOUT)
+
+
+def get_or_rebuild(key, rebuild, timeout):
+    """
+    Read-through cache with single-flight recomputation.
+
+    Entries are refreshed probabilistically ahead of expiry (XFetch, scaled by
+    how long the last rebuild took) and kept for STALE_GRACE past it. Only the
+    worker that wins the rebuild lock calls `rebuild`; everyone else gets
+    the stale value, or waits briefly for the winner if there is none.
+    """
+    cached = tiered_cache.get_many([key, generation_key(key)])
+    envelope = _current(cached, key)
+    now = time.time()
+    if _is_fresh(envelope, now):
+        record_cache(hits=1, cache=_cache_name(key))
+        return envelope['value']
+    record_cache(misses=1, cache=_cache_name(key))
+
+    lock = _rebuild_lock(f"{key}:lock")
+    if lock.acquire(blocking=False):
+        try:
+            return _rebuild(key, rebuild, timeout, cached)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                # Expired, and maybe taken by another worker: theirs now
+                pass
+
+    if envelope is not None:
+        return envelope['value']
+
+    deadline = now + REBUILD_WAIT
+    while time.time() < deadline:
+        time.sleep(REBUILD_POLL_INTERVAL)
+        envelope = _current(cache.get_many([key, generation_key(key)]), key)
+        if envelope is not None:
+            return envelope['value']
+
+    # The lock holder is taking too long; compute for this caller only
+    return rebuild()
+
+
+def get_ride_fragments(ride_ids):
+    """
+    Return {ride_id: fragment} for the given rides. Fragments are fetched from
+    the cache in one round-trip; only the misses are loaded from the DB, and
+    those are rendered and written back together.
+    """
+    keys = {ride_fragment_key(ride_id): ride_id for ride_id in ride_ids}
+    cached = tiered_cache.get_many([*keys, *map(generation_key, keys)])
+    fragments = _current_fragments(keys, cached)
+
+    missing = [ride_id for ride_id in ride_ids if ride_id not in fragments]
+    record_cache(hits=len(fragments), misses=len(missing), cache='ride_fragment')
+    if missing:
+        generations = _generations([ride_fragment_key(ride_id) for ride_id in missing], cached, RIDE_FRAGMENT_TIMEOUT)
+        rendered = render_ride_fragments(Ride.objects.using(DEFAULT_DB_ALIAS).filter(id__in=missing))
+        _write(_fragment_entries(rendered, generations), cached, RIDE_FRAGMENT_TIMEOUT)
+        fragments.update(rendered)
+
+    return fragments
+
+
+def _current_fragments(keys, cached):
+    """{ride_id: fragment} of the current entries among `keys` {fragment key: ride_id}."""
+    entries = {ride_id: _current(cached, key) for key, ride_id in keys.items()}
+    return {ride_id: entry['value'] for ride_id, entry in entries.items() if entry is not None}
+
+
+def _fragment_entries(rendered, generations):
+    return {
+        ride_fragment_key(ride_id): {'value': fragment, 'generation': generations[ride_fragment_key(ride_id)]}
+        for ride_id, fragment in rendered.items()
+    }
+
+
+def render_rides(ride_ids, user):
+    """
+    Render rides in `ride_ids` order exactly as RideSerializer would for `user`,
+    by overlaying the per-user fields on the shared fragments.
+    """
+    fragments = get_ride_fragments(ride_ids)
+    request_status = user_request_status(user, ride_ids)
+    with measure_serialization():
+        return [
+            overlay_user_fields(fragments[ride_id], user, request_status)
+            for ride_id in ride_ids if ride_id in fragments
+        ]
+
+
+# Async read path. Cache reads and the per-user DB lookup run concurrently;
+# rebuilds and fragment rendering stay sync and run on a thread.
+
+async def aget_or_rebuild(key, rebuild, timeout):
+    """
+    get_or_rebuild() for async callers. A fresh entry is served without
+    leaving the event loop; anything else takes the sync single-flight path.
+    """
+    envelope = _current(await tiered_cache.aget_many([key, generation_key(key)]), key)
+    if _is_fresh(envelope, time.time()):
+        record_cache(hits=1, cache=_cache_name(key))
+        return envelope['value']
+    return await sync_to_async(get_or_rebuild)(key, rebuild, timeout)
+
+
+async def aget_ride_fragments(ride_ids):
+    """get_ride_fragments() for async callers."""
+    keys = {ride_fragment_key(ride_id): ride_id for ride_id in ride_ids}
+    cached = await tiered_cache.aget_many([*keys, *map(generation_key, keys)])
+    fragments = _current_fragments(keys, cached)
+
+    missing = [ride_id for ride_id in ride_ids if ride_id not in fragments]
+    record_cache(hits=len(fragments), misses=len(missing), cache='ride_fragment')
+    if missing:
+        generations = await _agenerations(
+            [ride_fragment_key(ride_id) for ride_id in missing], cached, RIDE_FRAGMENT_TIMEOUT
+        )
+        rendered = await sync_to_async(render_ride_fragments)(
+            Ride.objects.using(DEFAULT_DB_ALIAS).filter(id__in=missing)
+        )
+        await _awrite(_fragment_entries(rendered, generations), cached, RIDE_FRAGMENT_TIMEOUT)
+        fragments.update(rendered)
+
+    return fragments
+
+
+async def arender_rides(ride_ids, user):
+    """render_rides() for async callers; fragments and request status are fetched concurrently."""
+    fragments, request_status = await asyncio.gather(
+        aget_ride_fragments(ride_ids),
+        auser_request_status(user, ride_ids),
+    )
+    with measure_serialization():
+        return [
+            overlay_user_fields(fragments[ride_id], user, request_status)
+            for ride_id in ride_ids if ride_id in fragments
+        ]
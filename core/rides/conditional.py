@@ -0,0 +1,76 @@
+"""
+Conditional GET for ride resources.
+
+ETags are hashes of the version tokens (rides.cache) of everything a response
+is built from, and of the viewer where the payload is per user. They are
+computed from the cache alone, before the serializer and, for the ride
+detail and the cached listing page, before any query runs; a matching
+If-None-Match gets an empty 304.
+"""
+import hashlib
+
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cache import aget_versions, get_versions, ride_version_key, user_requests_version_key
+
+
+def _etag(*parts):
+    return 'W/"%s"' % hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def _listing_keys(page, user):
+    keys = [ride_version_key(ride_id) for ride_id in page['ride_ids']]
+    if user is not None:
+        # requested / requested_status depend on the viewer's join requests
+        keys.append(user_requests_version_key(user.id))
+    return keys
+
+
+def _listing_etag(page, user, versions):
+    return _etag(
+        page['ride_ids'], page['next_cursor'], user.id if user else None,
+        [versions[key] for key in _listing_keys(page, user)],
+    )
+
+
+def listing_etag(page, user):
+    """ETag of a rendered ride listing page ({'ride_ids', 'next_cursor'}) for `user`."""
+    return _listing_etag(page, user, get_versions(_listing_keys(page, user)))
+
+
+async def alisting_etag(page, user):
+    return _listing_etag(page, user, await aget_versions(_listing_keys(page, user)))
+
+
+def ride_etag(ride_id, user):
+    """ETag of a ride's detail for `user`; the owner also sees the join requests."""
+    key = ride_version_key(ride_id)
+    return _etag(ride_id, user.id if user else None, get_versions([key])[key])
+
+
+async def aride_etag(ride_id, user):
+    key = ride_version_key(ride_id)
+    return _etag(ride_id, user.id if user else None, (await aget_versions([key]))[key])
+
+
+def etag_matches(request, etag):
+    """Weak comparison of `etag` against the request's If-None-Match."""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' in etags or etag.removeprefix('W/') in {tag.removeprefix('W/') for tag in etags}
+
+
+def with_etag(response, etag):
+    response['ETag'] = etag
+    # The payloads are per user
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def not_modified(etag):
+    return with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
@@ -0,0 +1,83 @@
+"""
+Denormalized per-ride counters.
+
+Ride.pending_request_count and Ride.accepted_count follow the ride's PENDING
+join requests and its participants. Every write that changes those updates
+the counters with F() expressions in its own transaction (reservations,
+lifecycle, the signal receivers), so list views show them without loading
+child rows. Writes that bypass those paths, such as raw SQL or a request
+status edited in the admin, can make them drift; reconcile_counters()
+recomputes them from the child rows.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Func, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .cache import invalidate_rides
+from .models import Ride, RideJoinRequest
+
+User = get_user_model()
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def decrement(field, by=1):
+    """
+    F() decrement of a counter that stops at zero, so a counter that already
+    drifted low cannot fail a write on the positive-integer check.
+    """
+    return Greatest(F(field) - by, 0)
+
+
+def _count(queryset):
+    """Correlated subquery counting the rows of `queryset`."""
+    counted = queryset.order_by().annotate(count=Func(F('pk'), function='COUNT')).values('count')
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+def actual_counts():
+    """Annotations with each ride's counters computed from the child rows."""
+    return {
+        'actual_pending': _count(RideJoinRequest.objects.filter(
+            ride=OuterRef('pk'), status=RideJoinRequest.RequestStatus.PENDING
+        )),
+        'actual_accepted': _count(User.objects.filter(rides_joined=OuterRef('pk'))),
+    }
+
+
+def reconcile_counters(batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Recompute the counters of every ride, `batch_size` rides per transaction,
+    and repair the ones that drifted. Each repair is a single UPDATE from the
+    child rows, so concurrent F() updates are not lost.
+    Returns {'checked': n, 'repaired': n}.
+    """
+    result = {'checked': 0, 'repaired': 0}
+    last_id = 0
+    while True:
+        ride_ids = list(
+            Ride.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ride_ids:
+            return result
+        last_id = ride_ids[-1]
+
+        with transaction.atomic():
+            drifted = list(
+                Ride.objects.filter(id__in=ride_ids).alias(**actual_counts())
+                .exclude(pending_request_count=F('actual_pending'), accepted_count=F('actual_accepted'))
+                .values_list('id', flat=True)
+            )
+            if drifted:
+                counts = actual_counts()
+                Ride.objects.filter(id__in=drifted).update(
+                    pending_request_count=counts['actual_pending'],
+                    accepted_count=counts['actual_accepted'],
+                )
+                invalidate_rides(drifted)
+
+        result['checked'] += len(ride_ids)
+        result['repaired'] += len(drifted)
+        if progress:
+            progress(result)
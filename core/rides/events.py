@@ -0,0 +1,63 @@
+"""
+Push events for ride and join-request changes.
+
+Events are published to core.channels groups once the writing transaction
+commits, and carry ids and the changed fields only, so a client updates what
+it shows in place or fetches just the rows named:
+
+    user:<id>   join_request.created  to the owner of the ride
+                join_request.status   to the user who made the request
+    ride:<id>   ride.seats            seats_available changed
+                ride.status           the ride started, finished, ...
+"""
+from django.db import transaction
+
+from core.channels import channel_layer
+
+
+def user_group(user_id):
+    return f"user:{user_id}"
+
+
+def ride_group(ride_id):
+    return f"ride:{ride_id}"
+
+
+def _publish(messages):
+    if messages:
+        transaction.on_commit(lambda: channel_layer.group_send_many(messages))
+
+
+def join_request_created(join_request, owner_id):
+    _publish([(user_group(owner_id), {
+        'type': 'join_request.created',
+        'ride_id': join_request.ride_id,
+        'request_id': join_request.id,
+        'user_id': join_request.user_id,
+    })])
+
+
+def join_request_status_changed(changes):
+    """`changes`: [(request_id, ride_id, user_id, status)]."""
+    _publish([
+        (user_group(user_id), {
+            'type': 'join_request.status',
+            'ride_id': ride_id,
+            'request_id': request_id,
+            'status': status,
+        })
+        for request_id, ride_id, user_id, status in changes
+    ])
+
+
+def seats_changed(ride_id, seats_available):
+    _publish([(ride_group(ride_id), {
+        'type': 'ride.seats', 'ride_id': ride_id, 'seats_available': seats_available,
+    })])
+
+
+def ride_status_changed(ride_ids, status):
+    _publish([
+        (ride_group(ride_id), {'type': 'ride.status', 'ride_id': ride_id, 'status': status})
+        for ride_id in ride_ids
+    ])
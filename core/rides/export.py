@@ -0,0 +1,165 @@
+"""
+Streaming ride and join-request exports for ops and campus partners.
+
+Each export reads the live table and then its archive (rides.archive), so a
+date range reaches back past the archiving cutoff; the `archived` column
+tells the two apart, and fields the archive does not keep are null. A row
+archived while the export runs can come out twice, once from each table.
+
+Rows are read with `.iterator(chunk_size=...)` (a server-side cursor on
+PostgreSQL) as tuples, and encoded one line at a time, so memory stays flat
+however many rows match and the first bytes go out before the query has
+been read to the end. Used by the export_rides command and by
+RideExportView under WSGI. Under ASGI the view streams astream_export(),
+which reads the rows in batches by id: ASGI servers read a sync iterator to
+the end before sending anything, WSGI servers do that to an async one.
+"""
+import csv
+from datetime import datetime, time, timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, Value
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ArchivedRide, ArchivedRideJoinRequest, Ride, RideJoinRequest
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FIELDS = (
+    'id', 'owner_id',
+    'pickup_latitude', 'pickup_longitude', 'destination_latitude', 'destination_longitude',
+    'total_seats', 'seats_available', 'pending_request_count', 'accepted_count',
+    'total_cost', 'cost_per_seat',
+    'status', 'departure_datetime', 'created_at', 'updated_at', 'archived',
+)
+JOIN_REQUEST_EXPORT_FIELDS = ('id', 'ride_id', 'user_id', 'status', 'requested_at', 'updated_at', 'archived')
+
+# kind: (fields, live model, archive model, statuses, departure lookup)
+EXPORTS = {
+    'rides': (EXPORT_FIELDS, Ride, ArchivedRide, Ride.RideStatus, 'departure_datetime'),
+    'join_requests': (
+        JOIN_REQUEST_EXPORT_FIELDS, RideJoinRequest, ArchivedRideJoinRequest,
+        RideJoinRequest.RequestStatus, 'ride__departure_datetime',
+    ),
+}
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def parse_bound(value, end=False):
+    """
+    A datetime for an ISO datetime or date; a date covers the whole day, so
+    `end` makes it the start of the next day. Raises ValueError.
+    """
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is not None:
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError(f'Invalid date: {value!r}')
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+
+
+def _rows(model, live_model, fields, archived):
+    """`fields` tuples of `model`; the live model's fields it lacks come out null."""
+    columns = {field.attname for field in model._meta.concrete_fields}
+    missing = {
+        name: Value(None, output_field=live_model._meta.get_field(name).clone())
+        for name in fields if name not in columns and name != 'archived'
+    }
+    return model.objects.annotate(archived=Value(archived), **missing).order_by('id').values_list(*fields)
+
+
+def export_querysets(kind='rides', departed_after=None, departed_before=None, statuses=None):
+    """
+    The `kind` rows ('rides' or 'join_requests') of rides departing in
+    [departed_after, departed_before) with one of `statuses` (of the rides, or
+    of the join requests), as tuples of export_fields(kind): a queryset for
+    the live table and one for the archive.
+    """
+    fields, live_model, archive_model, choices, departure = EXPORTS[kind]
+    filters = Q()
+    if departed_after is not None:
+        filters &= Q(**{f'{departure}__gte': departed_after})
+    if departed_before is not None:
+        filters &= Q(**{f'{departure}__lt': departed_before})
+    if statuses:
+        invalid = set(statuses) - set(choices.values)
+        if invalid:
+            raise ValueError(f"Invalid status: {', '.join(sorted(invalid))}")
+        filters &= Q(status__in=statuses)
+    return [
+        _rows(live_model, live_model, fields, False).filter(filters),
+        _rows(archive_model, live_model, fields, True).filter(filters),
+    ]
+
+
+def export_fields(kind):
+    return EXPORTS[kind][0]
+
+
+def iter_ndjson(rows, fields):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(fields, row))) + '\n'
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, fields, header=True):
+    writer = csv.writer(_Echo())
+    if header:
+        yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _lines(rows, kind, export_format, header):
+    if export_format == 'csv':
+        return iter_csv(rows, export_fields(kind), header=header)
+    return iter_ndjson(rows, export_fields(kind))
+
+
+def stream_export(querysets, kind, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """Lines of the export of `querysets` (from export_querysets(kind)) in `export_format`."""
+    yield from _lines((), kind, export_format, header=True)
+    for queryset in querysets:
+        yield from _lines(queryset.iterator(chunk_size=chunk_size), kind, export_format, header=False)
+
+
+async def astream_export(querysets, kind, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    stream_export() as an async iterator, for ASGI servers, which read a sync
+    iterator to the end before sending anything. Batches of `chunk_size` rows
+    are fetched through sync_to_async after the last id seen, and each goes
+    out as one chunk of lines.
+    """
+    fetch = sync_to_async(lambda rows: list(rows[:chunk_size]))
+    header = ''.join(_lines((), kind, export_format, header=True))
+    if header:
+        yield header
+    for queryset in querysets:
+        last_id = None
+        while True:
+            rows = await fetch(queryset if last_id is None else queryset.filter(id__gt=last_id))
+            if rows:
+                yield ''.join(_lines(rows, kind, export_format, header=False))
+            if len(rows) < chunk_size:
+                break
+            # Each export is ordered by id, its first field
+            last_id = rows[-1][0]
@@ -0,0 +1,41 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def _parse_datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'Invalid datetime: {value}')
+    return parsed
+
+
+def ride_filters(query_params, prefix=''):
+    """
+    Build a Q from the ride listing filters in `query_params`. `prefix` lets the
+    same filters apply through a relation, e.g. 'ride__' for join requests.
+    Raises ValueError on malformed values.
+    """
+    q = Q()
+
+    departure_after = query_params.get('departure_after')
+    if departure_after:
+        q &= Q(**{f'{prefix}departure_datetime__gte': _parse_datetime(departure_after)})
+
+    departure_before = query_params.get('departure_before')
+    if departure_before:
+        q &= Q(**{f'{prefix}departure_datetime__lte': _parse_datetime(departure_before)})
+
+    min_seats = query_params.get('min_seats')
+    if min_seats:
+        q &= Q(**{f'{prefix}seats_available__gte': int(min_seats)})
+
+    max_cost = query_params.get('max_cost')
+    if max_cost:
+        try:
+            q &= Q(**{f'{prefix}cost_per_seat__lte': Decimal(max_cost)})
+        except InvalidOperation:
+            raise ValueError(f'Invalid max_cost: {max_cost}')
+
+    return q
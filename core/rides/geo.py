@@ -0,0 +1,153 @@
+import math
+
+import numpy as np
+from django.db.models import Q
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+GEOHASH_PRECISION = 7
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_BASE32_INDEX = {c: i for i, c in enumerate(_BASE32)}
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bit, ch, even = 0, 0, True
+
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                ch |= 1 << (4 - bit)
+                lon_range[0] = mid
+            else:
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                ch |= 1 << (4 - bit)
+                lat_range[0] = mid
+            else:
+                lat_range[1] = mid
+        even = not even
+
+        if bit < 4:
+            bit += 1
+        else:
+            chars.append(_BASE32[ch])
+            bit, ch = 0, 0
+
+    return ''.join(chars)
+
+
+def _cell_size_degrees(precision):
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def decode_geohash(geohash):
+    """Return the (latitude, longitude) centre of a geohash cell."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for c in geohash:
+        value = _BASE32_INDEX[c]
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def precision_for_radius(radius_km, latitude):
+    """
+    Finest geohash precision whose cells are at least `radius_km` across,
+    so the 3x3 block around a point fully contains the search circle.
+    """
+    cos_lat = max(math.cos(math.radians(latitude)), 0.01)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_deg, lon_deg = _cell_size_degrees(precision)
+        height_km = lat_deg * KM_PER_DEGREE
+        width_km = lon_deg * KM_PER_DEGREE * cos_lat
+        if min(height_km, width_km) >= radius_km:
+            return precision
+    return 1
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """Geohash prefixes of the cell containing the point and its neighbours."""
+    precision = precision_for_radius(radius_km, latitude)
+    lat_deg, lon_deg = _cell_size_degrees(precision)
+    center_lat, center_lon = decode_geohash(encode_geohash(latitude, longitude, precision))
+
+    cells = set()
+    for dlat in (-lat_deg, 0, lat_deg):
+        lat = center_lat + dlat
+        if lat < -90 or lat > 90:
+            continue
+        for dlon in (-lon_deg, 0, lon_deg):
+            lon = (center_lon + dlon + 180) % 360 - 180
+            cells.add(encode_geohash(lat, lon, precision))
+    return sorted(cells)
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Vectorised great-circle distance from one point to arrays of points."""
+    lat1 = np.radians(latitude)
+    lon1 = np.radians(longitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon2 = np.radians(np.asarray(longitudes, dtype=np.float64))
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def parse_point(value):
+    """Parse a `lat,lon` query parameter, raising ValueError on bad input."""
+    lat_str, lon_str = value.split(',')
+    lat, lon = float(lat_str), float(lon_str)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError('Coordinates out of range')
+    return lat, lon
+
+
+def geohash_cell_filter(field, cells):
+    """
+    Q object matching rows whose `field` geohash lies in any of `cells`.
+    Uses a range per prefix rather than LIKE so a plain B-tree index applies.
+    """
+    q = Q()
+    for cell in cells:
+        upper = cell + _BASE32[-1] * (GEOHASH_PRECISION - len(cell))
+        q |= Q(**{f'{field}__gte': cell, f'{field}__lte': upper})
+    return q
+
+
+def rides_within(queryset, lat_field, lon_field, geohash_field, point, radius_km):
+    """
+    Return {ride_id: distance_km} for rides in `queryset` whose coordinates
+    lie within `radius_km` of `point`. Only the covering geohash cells are
+    read from the database; the exact cut is done with a vectorised haversine.
+    """
+    latitude, longitude = point
+    cells = covering_cells(latitude, longitude, radius_km)
+    rows = list(
+        queryset.filter(geohash_cell_filter(geohash_field, cells))
+        .values_list('id', lat_field, lon_field)
+    )
+    if not rows:
+        return {}
+
+    ids, lats, lons = zip(*rows)
+    distances = haversine_km(latitude, longitude, lats, lons)
+    mask = distances <= radius_km
+    return dict(zip(np.asarray(ids)[mask].tolist(), distances[mask].tolist()))
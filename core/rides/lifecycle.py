@@ -0,0 +1,81 @@
+"""
+Time-driven ride status transitions.
+
+Rides become ONGOING at their departure time and COMPLETED RIDE_DURATION
+later; PENDING join requests on a ride that has departed are rejected. Every
+transition is a set-based UPDATE over a batch of ids picked (and locked)
+through the status/departure indexes, so a run costs a few queries per batch
+however many rides it moves, and each batch commits on its own.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import events
+from .cache import invalidate_join_requests, invalidate_rides
+from .models import Ride, RideJoinRequest
+
+# There is no arrival time; a ride counts as finished this long after departure
+RIDE_DURATION = timedelta(hours=1)
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _advance(from_status, to_status, cutoff, batch_size, reject_pending):
+    moved = rejected = 0
+    while True:
+        with transaction.atomic():
+            # Locked, so a concurrent abort or edit either lands first and
+            # takes its ride out of the batch, or waits for the batch to commit
+            ride_ids = list(
+                Ride.objects.select_for_update()
+                .filter(status=from_status, departure_datetime__lte=cutoff)
+                .order_by('departure_datetime')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ride_ids:
+                return moved, rejected
+
+            moved += Ride.objects.filter(id__in=ride_ids).update(status=to_status, updated_at=timezone.now())
+            if reject_pending:
+                rejected += _reject_pending(ride_ids)
+            # The updates bypass post_save, so invalidate the cache here
+            invalidate_rides(ride_ids, listing=from_status == Ride.RideStatus.UPCOMING)
+            events.ride_status_changed(ride_ids, to_status)
+
+
+def _reject_pending(ride_ids):
+    pending = list(
+        RideJoinRequest.objects.select_for_update()
+        .filter(ride_id__in=ride_ids, status=RideJoinRequest.RequestStatus.PENDING)
+        .values_list('id', 'ride_id', 'user_id')
+    )
+    if not pending:
+        return 0
+    RideJoinRequest.objects.filter(id__in=[request_id for request_id, _, _ in pending])\
+        .update(status=RideJoinRequest.RequestStatus.REJECTED, updated_at=timezone.now())
+    # Every pending request of these rides is gone now
+    Ride.objects.filter(id__in={ride_id for _, ride_id, _ in pending})\
+        .update(pending_request_count=0, updated_at=timezone.now())
+    invalidate_join_requests([(ride_id, user_id) for _, ride_id, user_id in pending])
+    events.join_request_status_changed([
+        (request_id, ride_id, user_id, RideJoinRequest.RequestStatus.REJECTED)
+        for request_id, ride_id, user_id in pending
+    ])
+    return len(pending)
+
+
+def advance_ride_statuses(now=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Move every ride whose time has come to its next status. Returns
+    {'started': n, 'completed': n, 'rejected_requests': n}.
+    """
+    now = now or timezone.now()
+    started, rejected = _advance(
+        Ride.RideStatus.UPCOMING, Ride.RideStatus.ONGOING, now, batch_size, reject_pending=True,
+    )
+    completed, rejected_late = _advance(
+        Ride.RideStatus.ONGOING, Ride.RideStatus.COMPLETED, now - RIDE_DURATION, batch_size,
+        reject_pending=True,
+    )
+    return {'started': started, 'completed': completed, 'rejected_requests': rejected + rejected_late}
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.lifecycle import DEFAULT_BATCH_SIZE, advance_ride_statuses
+
+
+class Command(BaseCommand):
+    help = (
+        "Move rides UPCOMING -> ONGOING at departure and ONGOING -> COMPLETED once "
+        "finished, rejecting PENDING join requests on departed rides. Runs once, "
+        "or every --interval seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running and advance statuses every N seconds.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        while True:
+            counts = advance_ride_statuses(batch_size=options['batch_size'])
+            self.stdout.write(
+                f"{counts['started']} rides started, {counts['completed']} completed, "
+                f"{counts['rejected_requests']} pending requests rejected"
+            )
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.archive import DEFAULT_ARCHIVE_AGE, DEFAULT_BATCH_SIZE, archive_rides
+from rides.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = (
+        "Move COMPLETED and ABORTED rides older than --older-than-days, with their join "
+        "requests and participants, from the hot tables into the archive tables, then "
+        "prune expired sync tombstones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=float, default=DEFAULT_ARCHIVE_AGE.days)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if options['older_than_days'] < 0:
+            raise CommandError('--older-than-days cannot be negative')
+
+        def progress(archived):
+            self.stdout.write(f"\r{archived['rides']} rides archived", ending='')
+            self.stdout.flush()
+
+        archived = archive_rides(
+            older_than=timedelta(days=options['older_than_days']),
+            batch_size=options['batch_size'],
+            progress=progress,
+        )
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived['rides']} rides and {archived['join_requests']} join requests"
+        ))
+        self.stdout.write(f"Pruned {prune_tombstones()} expired sync tombstones")
@@ -0,0 +1,122 @@
+import asyncio
+import random
+import time
+
+import numpy as np
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncRequestFactory, RequestFactory
+from django.urls import reverse
+
+from rides.async_views import (
+    AsyncGetRideDetail, AsyncGetUpcomingRidesView, AsyncGetUserRides, AsyncMyRideJoinRequestsView,
+)
+from rides.management.commands.loadtest import LoadContext
+from rides.views import GetRideDetail, GetUpcomingRidesView, GetUserRides, MyRideJoinRequestsView
+from users.async_views import AsyncGetUserData
+from users.views import GetUserData
+
+
+def _user_get(url_name):
+    def request(ctx):
+        return reverse(url_name), (), ctx.user()
+    return request
+
+
+def _ride_details(ctx):
+    ride_id = ctx.ride()['id']
+    return reverse('ride-details', args=[ride_id]), (ride_id,), ctx.user()
+
+
+def _auth(ctx, user):
+    return {'Authorization': ctx.auth(user)['HTTP_AUTHORIZATION']}
+
+
+def _check(response):
+    if response.status_code != 200:
+        raise CommandError(f"Benchmark request failed with {response.status_code}: {response.content[:200]!r}")
+
+
+# url name: (sync view, async view, request builder returning (path, view args, user))
+VIEWS = {
+    'fetch-rides': (GetUpcomingRidesView, AsyncGetUpcomingRidesView, _user_get('fetch-rides')),
+    'ride-details': (GetRideDetail, AsyncGetRideDetail, _ride_details),
+    'user-rides': (GetUserRides, AsyncGetUserRides, _user_get('user-rides')),
+    'get-created-requests': (MyRideJoinRequestsView, AsyncMyRideJoinRequestsView, _user_get('get-created-requests')),
+    'get-user-data': (GetUserData, AsyncGetUserData, _user_get('get-user-data')),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests per second of one worker on the sync and the async version of each read view: "
+        "a sync worker handles one request at a time, an async worker keeps --concurrency "
+        "requests in flight on one event loop. Run generate_campus_data first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per view and path.')
+        parser.add_argument('--concurrency', type=int, default=32, help='In-flight requests on the async worker.')
+        parser.add_argument('--views', help='Comma-separated URL names; defaults to all.')
+        parser.add_argument('--prefix', default='syn', help='Phone prefix of the synthetic users.')
+        parser.add_argument('--sample', type=int, default=500, help='Users and rides sampled as request targets.')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        names = options['views'].split(',') if options['views'] else list(VIEWS)
+        unknown = set(names) - set(VIEWS)
+        if unknown:
+            raise CommandError(f"Unknown views: {sorted(unknown)}")
+
+        ctx = LoadContext(random.Random(options['seed']), options['prefix'], options['sample'])
+        self.stdout.write(f"{'view':<24}{'sync req/s':>12}{'async req/s':>13}{'speedup':>9}"
+                          f"{'sync p95 ms':>13}{'async p95 ms':>14}")
+
+        for name in names:
+            sync_view, async_view, build = VIEWS[name]
+            requests = [build(ctx) for _ in range(options['requests'])]
+
+            sync_rps, sync_latencies = self.run_sync(ctx, sync_view.as_view(), requests)
+            async_rps, async_latencies = asyncio.run(
+                self.run_async(ctx, async_view.as_view(), requests, options['concurrency'])
+            )
+            self.stdout.write(
+                f"{name:<24}{sync_rps:>12.1f}{async_rps:>13.1f}{async_rps / sync_rps:>8.2f}x"
+                f"{np.percentile(sync_latencies, 95):>13.1f}{np.percentile(async_latencies, 95):>14.1f}"
+            )
+
+    @staticmethod
+    def run_sync(ctx, view, requests):
+        factory = RequestFactory()
+        latencies = []
+        start = time.perf_counter()
+        for path, args, user in requests:
+            began = time.perf_counter()
+            response = view(factory.get(path, headers=_auth(ctx, user)), *args)
+            response.render()
+            latencies.append((time.perf_counter() - began) * 1000)
+            _check(response)
+            # CONN_MAX_AGE is 0, so both paths connect once per request
+            connections.close_all()
+        return len(requests) / (time.perf_counter() - start), latencies
+
+    @staticmethod
+    async def run_async(ctx, view, requests, concurrency):
+        factory = AsyncRequestFactory()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(path, args, user):
+            async with semaphore:
+                # Like the ASGI handler: each request gets its own sync thread for the ORM
+                async with ThreadSensitiveContext():
+                    began = time.perf_counter()
+                    response = await view(factory.get(path, headers=_auth(ctx, user)), *args)
+                    latencies.append((time.perf_counter() - began) * 1000)
+                    _check(response)
+                    await sync_to_async(connections.close_all)()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(*request) for request in requests))
+        return len(requests) / (time.perf_counter() - start), latencies
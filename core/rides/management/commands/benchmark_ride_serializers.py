@@ -0,0 +1,82 @@
+import random
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Prefetch
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from rides.models import Ride, RideJoinRequest
+from rides.projections import project_rides
+from rides.serializers import RideSerializer
+from rides.synthetic import generate_rides, generate_users
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare RideSerializer against the projection renderer on synthetic rides. "
+        "Runs inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,50000',
+                            help='Comma-separated ride counts to benchmark.')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        sizes = [int(size) for size in options['sizes'].split(',')]
+
+        with transaction.atomic():
+            viewer = self.populate(max(sizes))
+            request = APIRequestFactory().get('/')
+            request.user = viewer
+            ride_ids = list(Ride.objects.order_by('id').values_list('id', flat=True))
+
+            for size in sizes:
+                rides = Ride.objects.filter(id__lte=ride_ids[size - 1]).order_by('id')
+                drf_time, drf_peak, drf_json = self.measure(lambda: self.serialize_drf(rides, viewer, request))
+                fast_time, fast_peak, fast_json = self.measure(lambda: project_rides(rides, viewer))
+
+                self.stdout.write(
+                    f"{size:>6} rides | RideSerializer {drf_time * 1000:8.1f} ms, peak {drf_peak / 2**20:7.1f} MiB"
+                    f" | projection {fast_time * 1000:8.1f} ms, peak {fast_peak / 2**20:7.1f} MiB"
+                    f" | {drf_time / fast_time:4.1f}x faster"
+                    f" | identical JSON: {drf_json == fast_json}"
+                )
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def serialize_drf(rides, viewer, request):
+        rides = rides.select_related("owner")\
+            .prefetch_related("participants")\
+            .prefetch_related(Prefetch(
+                "join_requests", queryset=RideJoinRequest.objects.filter(user=viewer), to_attr="user_join_requests"
+            ))
+        return RideSerializer(rides, many=True, context={'request': request}).data
+
+    @staticmethod
+    def measure(render):
+        # Timed and traced in separate runs: tracemalloc slows allocation-heavy code
+        start = time.perf_counter()
+        data = render()
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        render()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return elapsed, peak, JSONRenderer().render(data)
+
+    def populate(self, count):
+        users = generate_users(max(count // 20, 10), random, prefix='bench')
+        generate_rides(users, count, random)
+        # The user with the most join requests exercises the per-user fields best
+        return User.objects.filter(id__in=[u.id for u in users])\
+            .annotate(requests=Count('ride_requests')).order_by('-requests').first()
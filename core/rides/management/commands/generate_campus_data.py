@@ -0,0 +1,60 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from rides.geo import parse_point
+from rides.synthetic import DEFAULT_CENTER, SYNTHETIC_PASSWORD, generate_rides, generate_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-generate a synthetic campus: users, rides clustered around campus hubs, "
+        "and join requests in every status. Synthetic users log in with "
+        f"password '{SYNTHETIC_PASSWORD}'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--rides', type=int, default=50000)
+        parser.add_argument('--requests-per-ride', type=float, default=3.0,
+                            help='Mean number of join requests per ride.')
+        parser.add_argument('--hubs', type=int, default=12, help='Number of pickup/drop-off hotspots.')
+        parser.add_argument('--center', default=','.join(map(str, DEFAULT_CENTER)),
+                            help='Campus centre as <lat>,<lon>.')
+        parser.add_argument('--prefix', default='syn', help='Phone number prefix of the generated users.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            center = parse_point(options['center'])
+        except ValueError:
+            raise CommandError('--center must be <lat>,<lon>')
+        if options['users'] < 2:
+            raise CommandError('--users must be at least 2')
+
+        rng = random.Random(options['seed'])
+        start = time.perf_counter()
+
+        with transaction.atomic():
+            users = generate_users(options['users'], rng, prefix=options['prefix'],
+                                   batch_size=options['batch_size'])
+            self.stdout.write(f"{len(users)} users")
+
+            def progress(done, total):
+                self.stdout.write(f"\r{done}/{total} rides", ending='')
+                self.stdout.flush()
+
+            requests = generate_rides(
+                users, options['rides'], rng, center=center, hubs=options['hubs'],
+                mean_requests=options['requests_per_ride'], batch_size=options['batch_size'],
+                progress=progress,
+            )
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(users)} users, {options['rides']} rides and {requests} join requests "
+            f"in {time.perf_counter() - start:.1f}s"
+        ))
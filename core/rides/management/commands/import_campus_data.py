@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.bulk_import import DEFAULT_BATCH_SIZE, run_import
+
+MAX_REPORTED_ERRORS = 50
+
+
+class Command(BaseCommand):
+    help = (
+        "Import users and seed rides from a JSON Lines file (see rides.bulk_import for the "
+        "format) with batched validation and bulk inserts. Progress is recorded in the "
+        "database with every batch; rerun with --resume to continue after a failure."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="JSON Lines file, or '-' for stdin")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--hash-workers', type=int, default=0,
+                            help='Processes for password hashing; 0 or 1 hashes in this process.')
+        parser.add_argument('--checkpoint', help='Name the progress is recorded under; the input path by default.')
+        parser.add_argument('--resume', action='store_true', help='Skip the lines the checkpoint has done.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if options['hash_workers'] < 0:
+            raise CommandError('--hash-workers cannot be negative')
+        stdin = options['input'] == '-'
+        checkpoint = options['checkpoint'] or (None if stdin else os.path.abspath(options['input']))
+        if options['resume'] and not checkpoint:
+            raise CommandError('--resume needs --checkpoint when reading stdin')
+
+        start = time.perf_counter()
+
+        def progress(totals):
+            rows = totals['users'] + totals['rides']
+            self.stdout.write(
+                f"\rline {totals['lines']}: {totals['users']} users, {totals['rides']} rides, "
+                f"{totals['error_count']} errors, {rows / (time.perf_counter() - start):.0f} rows/s",
+                ending=''
+            )
+            self.stdout.flush()
+
+        try:
+            source = nullcontext(sys.stdin) if stdin else open(options['input'], encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(str(exc))
+        with source as lines:
+            totals = run_import(
+                lines, batch_size=options['batch_size'], hash_workers=options['hash_workers'],
+                checkpoint=checkpoint, resume=options['resume'], progress=progress,
+            )
+
+        elapsed = time.perf_counter() - start
+        rows = totals['users'] + totals['rides']
+        self.stdout.write('')
+        for number, message in totals['errors'][:MAX_REPORTED_ERRORS]:
+            self.stderr.write(f"line {number}: {message}")
+        if totals['error_count'] > MAX_REPORTED_ERRORS:
+            self.stderr.write(f"... and {totals['error_count'] - MAX_REPORTED_ERRORS} more errors")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['users']} users and {totals['rides']} rides in {elapsed:.1f}s "
+            f"({rows / elapsed if elapsed else 0:.0f} rows/s), {totals['error_count']} rows skipped"
+        ))
@@ -0,0 +1,385 @@
+import json
+import logging
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from core.testing import url_names
+from rides import urls as rides_urls
+from rides.models import Ride, RideJoinRequest
+from rides.sync import encode_token
+from rides.synthetic import SYNTHETIC_PASSWORD
+from users import urls as users_urls
+from users.authentication import ClaimsRefreshToken
+
+User = get_user_model()
+
+
+class LoadContext:
+    """Users, tokens and rides the scenarios draw their requests from."""
+
+    def __init__(self, rng, prefix, sample_size):
+        self.rng = rng
+        self.lock = threading.Lock()
+
+        users = list(User.objects.filter(phone_number__startswith=prefix).order_by('?')[:sample_size])
+        if len(users) < 2:
+            raise CommandError(f"No synthetic users with prefix '{prefix}'. Run generate_campus_data first.")
+        self.users = users
+        self.tokens = {user.id: ClaimsRefreshToken.for_user(user) for user in users}
+
+        self.rides = list(
+            Ride.objects.filter(status=Ride.RideStatus.UPCOMING)
+            .order_by('?').values('id', 'owner_id', 'pickup_latitude', 'pickup_longitude',
+                                  'destination_latitude', 'destination_longitude', 'departure_datetime')[:sample_size]
+        )
+        if not self.rides:
+            raise CommandError("No upcoming rides. Run generate_campus_data first.")
+
+        # Pending requests are consumed by the accept/reject scenarios
+        self.pending = list(
+            RideJoinRequest.objects.filter(
+                status=RideJoinRequest.RequestStatus.PENDING, ride__status=Ride.RideStatus.UPCOMING
+            ).select_related('ride__owner').order_by('?')[:sample_size * 4]
+        )
+        self.owners = {}
+        for user in User.objects.filter(id__in={r['owner_id'] for r in self.rides}):
+            self.owners[user.id] = user
+            self.tokens.setdefault(user.id, ClaimsRefreshToken.for_user(user))
+        # The export is staff-only; the load test keeps a staff account of its own
+        self.staff, _ = User.objects.get_or_create(
+            phone_number=f'{prefix}staff', defaults={'full_name': 'Load Test Staff', 'is_staff': True}
+        )
+        self.tokens[self.staff.id] = ClaimsRefreshToken.for_user(self.staff)
+        self.counter = 0
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def ride(self):
+        return self.rng.choice(self.rides)
+
+    def auth(self, user):
+        return {'HTTP_AUTHORIZATION': f'Bearer {self.tokens[user.id].access_token}'}
+
+    def take_pending(self, count=1):
+        with self.lock:
+            taken, self.pending = self.pending[:count], self.pending[count:]
+        return taken
+
+    def next_id(self):
+        with self.lock:
+            self.counter += 1
+            return self.counter
+
+
+def _point(lat, lon):
+    return f'{lat:.6f},{lon:.6f}'
+
+
+# Each scenario returns (method, path, data, extra headers) for one request
+def fetch_rides(ctx):
+    user = ctx.user()
+    if ctx.rng.random() < 0.5:
+        return 'get', reverse('fetch-rides'), None, ctx.auth(user)
+    ride = ctx.ride()
+    params = {'near_pickup': _point(ride['pickup_latitude'], ride['pickup_longitude']), 'radius_km': 3}
+    return 'get', reverse('fetch-rides'), params, ctx.auth(user)
+
+
+def match_rides(ctx):
+    ride = ctx.ride()
+    return 'get', reverse('match-rides'), {
+        'origin': _point(ride['pickup_latitude'], ride['pickup_longitude']),
+        'destination': _point(ride['destination_latitude'], ride['destination_longitude']),
+        'departure': ride['departure_datetime'].isoformat(),
+    }, ctx.auth(ctx.user())
+
+
+def ride_details(ctx):
+    ride = ctx.ride()
+    viewer = ctx.owners[ride['owner_id']] if ctx.rng.random() < 0.3 else ctx.user()
+    return 'get', reverse('ride-details', args=[ride['id']]), None, ctx.auth(viewer)
+
+
+def ride_join_requests(ctx):
+    ride = ctx.ride()
+    return 'get', reverse('ride-join-requests', args=[ride['id']]), None, ctx.auth(ctx.owners[ride['owner_id']])
+
+
+def ride_create(ctx):
+    ride = ctx.ride()
+    return 'post', reverse('ride-create'), {
+        'pickup_latitude': ride['pickup_latitude'], 'pickup_longitude': ride['pickup_longitude'],
+        'destination_latitude': ride['destination_latitude'], 'destination_longitude': ride['destination_longitude'],
+        'total_seats': 4, 'total_cost': 400,
+        'departure_datetime': (timezone.now() + timedelta(days=1)).isoformat(),
+    }, ctx.auth(ctx.user())
+
+
+def ride_join_request(ctx):
+    return 'post', reverse('ride-join-request', args=[ctx.ride()['id']]), None, ctx.auth(ctx.user())
+
+
+def manage_ride_request(ctx):
+    taken = ctx.take_pending()
+    if not taken:
+        return None
+    join_request = taken[0]
+    action = 'accept' if ctx.rng.random() < 0.5 else 'reject'
+    owner = join_request.ride.owner
+    ctx.tokens.setdefault(owner.id, ClaimsRefreshToken.for_user(owner))
+    return 'put', reverse('manage-ride-request', args=[join_request.ride_id, join_request.id, action]), \
+        None, ctx.auth(owner)
+
+
+def bulk_manage_ride_requests(ctx):
+    taken = ctx.take_pending()
+    if not taken:
+        return None
+    ride = taken[0].ride
+    actions = [{'req_id': r.id, 'action': ctx.rng.choice(['accept', 'reject'])}
+               for r in RideJoinRequest.objects.filter(ride=ride, status=RideJoinRequest.RequestStatus.PENDING)]
+    ctx.tokens.setdefault(ride.owner.id, ClaimsRefreshToken.for_user(ride.owner))
+    return 'post', reverse('bulk-manage-ride-requests', args=[ride.id]), \
+        json.dumps({'actions': actions}), ctx.auth(ride.owner)
+
+
+def user_get(url_name):
+    def scenario(ctx):
+        return 'get', reverse(url_name), None, ctx.auth(ctx.user())
+    return scenario
+
+
+def ride_sync(ctx):
+    # Half first syncs, half returning clients whose last sync was an hour ago
+    params = None
+    if ctx.rng.random() < 0.5:
+        params = {'since': encode_token(timezone.now() - timedelta(hours=1))}
+    return 'get', reverse('ride-sync'), params, ctx.auth(ctx.user())
+
+
+def ride_export(ctx):
+    # A day of rides or join requests, in either format
+    day = ctx.ride()['departure_datetime'].date().isoformat()
+    return 'get', reverse('ride-export'), {
+        'kind': ctx.rng.choice(['rides', 'join_requests']), 'output': ctx.rng.choice(['ndjson', 'csv']),
+        'departed_after': day, 'departed_before': day,
+    }, ctx.auth(ctx.staff)
+
+
+def user_register(ctx):
+    n = ctx.next_id()
+    return 'post', reverse('user-register'), {
+        'phone_number': f'lt{time.time_ns() % 10**9:09d}{n:04d}'[:15], 'full_name': f'Load Test {n}',
+        'password': SYNTHETIC_PASSWORD,
+    }, {}
+
+
+def user_login(ctx):
+    return 'post', reverse('user-login'), {
+        'phone_number': ctx.user().phone_number, 'password': SYNTHETIC_PASSWORD
+    }, {}
+
+
+def token_refresh(ctx):
+    return 'post', reverse('token_refresh'), {'refresh': str(ctx.tokens[ctx.user().id])}, {}
+
+
+SCENARIOS = {
+    'fetch-rides': fetch_rides,
+    'match-rides': match_rides,
+    'ride-details': ride_details,
+    'requests-history': user_get('requests-history'),
+    'ride-create': ride_create,
+    'ride-join-request': ride_join_request,
+    'ride-join-requests': ride_join_requests,
+    'manage-ride-request': manage_ride_request,
+    'bulk-manage-ride-requests': bulk_manage_ride_requests,
+    'user-rides': user_get('user-rides'),
+    'get-created-requests': user_get('get-created-requests'),
+    'ride-history': user_get('ride-history'),
+    'ride-request-history': user_get('ride-request-history'),
+    'ride-events': user_get('ride-events'),
+    'ride-sync': ride_sync,
+    'ride-export': ride_export,
+    'user-register': user_register,
+    'user-login': user_login,
+    'token_refresh': token_refresh,
+    'get-user-data': user_get('get-user-data'),
+}
+
+
+# Streaming responses whose body is read to the end as part of the request;
+# the event stream never ends, so it is timed up to its headers
+STREAMED = {'ride-export'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive every endpoint in rides/urls.py and users/urls.py in-process with concurrent "
+        "clients and report latency percentiles, throughput and query counts. Run "
+        "generate_campus_data first. Write endpoints modify the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint.')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--endpoints', help='Comma-separated URL names; defaults to all.')
+        parser.add_argument('--prefix', default='syn', help='Phone prefix of the synthetic users.')
+        parser.add_argument('--sample', type=int, default=500, help='Users and rides sampled as request targets.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--compare', help='Baseline JSON from an earlier run to compare against.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative p95 slowdown that counts as a regression.')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        missing = url_names(rides_urls.urlpatterns) | url_names(users_urls.urlpatterns)
+        missing -= set(SCENARIOS)
+        if missing:
+            raise CommandError(f"No load scenario for: {sorted(missing)}")
+
+        names = options['endpoints'].split(',') if options['endpoints'] else list(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {sorted(unknown)}")
+
+        ctx = LoadContext(random.Random(options['seed']), options['prefix'], options['sample'])
+        results = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'revision': self.revision(),
+                'database': connection.vendor,
+                'requests_per_endpoint': options['requests'],
+                'concurrency': options['concurrency'],
+                'rides': Ride.objects.count(),
+                'users': User.objects.count(),
+            },
+            'endpoints': {},
+        }
+
+        # Per-request log lines would drown the report
+        quiet = [logging.getLogger(name) for name in ('django.request', 'core.instrumentation')]
+        levels = [logger.level for logger in quiet]
+        for logger in quiet:
+            logger.setLevel(logging.CRITICAL)
+
+        self.stdout.write(f"{'endpoint':<28}{'2xx':>6}{'4xx':>5}{'5xx':>5}{'p50 ms':>9}{'p95 ms':>9}"
+                          f"{'p99 ms':>9}{'req/s':>9}{'queries':>9}")
+        try:
+            for name in names:
+                results['endpoints'][name] = self.run_endpoint(ctx, name, options['requests'], options['concurrency'])
+                self.report(name, results['endpoints'][name])
+        finally:
+            for logger, level in zip(quiet, levels):
+                logger.setLevel(level)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options['compare']:
+            regressions = self.compare(results, options['compare'], options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['compare']}")
+
+    def report(self, name, stats):
+        if stats['count']:
+            self.stdout.write(
+                f"{name:<28}{stats['count'] - stats['client_errors'] - stats['errors']:>6}"
+                f"{stats['client_errors']:>5}{stats['errors']:>5}"
+                f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+                f"{stats['throughput_rps']:>9.1f}{stats['queries_mean']:>9.1f}"
+            )
+        else:
+            self.stdout.write(f"{name:<28} skipped (nothing left to act on)")
+
+    def run_endpoint(self, ctx, name, count, concurrency):
+        local = threading.local()
+
+        def one(_):
+            if not hasattr(local, 'client'):
+                local.client = Client(raise_request_exception=False)
+            built = SCENARIOS[name](ctx)
+            if built is None:
+                return None
+            method, path, data, headers = built
+            kwargs = {'content_type': 'application/json'} if isinstance(data, str) else {}
+
+            queries = [0]
+
+            def count_query(execute, sql, params, many, context):
+                queries[0] += 1
+                return execute(sql, params, many, context)
+
+            start = time.perf_counter()
+            with connection.execute_wrapper(count_query):
+                response = getattr(local.client, method)(path, data, **kwargs, **headers)
+                if name in STREAMED and response.streaming:
+                    # The rows are read while the body streams
+                    b''.join(response.streaming_content)
+            return time.perf_counter() - start, queries[0], response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = [s for s in pool.map(one, range(count)) if s is not None]
+        elapsed = time.perf_counter() - start
+
+        if not samples:
+            return {'count': 0, 'client_errors': 0, 'errors': 0}
+        latencies = np.array([s[0] for s in samples]) * 1000
+        queries = np.array([s[1] for s in samples])
+        return {
+            'count': len(samples),
+            'client_errors': sum(1 for s in samples if 400 <= s[2] < 500),
+            'errors': sum(1 for s in samples if s[2] >= 500),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+            'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+            'mean_ms': round(float(latencies.mean()), 2),
+            'throughput_rps': round(len(samples) / elapsed, 1),
+            'queries_mean': round(float(queries.mean()), 2),
+            'queries_max': int(queries.max()),
+        }
+
+    def compare(self, results, baseline_path, threshold):
+        with open(baseline_path) as f:
+            baseline = json.load(f)['endpoints']
+
+        regressions = []
+        for name, stats in results['endpoints'].items():
+            before = baseline.get(name)
+            if not before or not before.get('count') or not stats.get('count'):
+                continue
+            if stats['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append(f"{name}: p95 {before['p95_ms']} -> {stats['p95_ms']} ms")
+            if stats['queries_max'] > before['queries_max']:
+                regressions.append(f"{name}: queries {before['queries_max']} -> {stats['queries_max']}")
+
+        for line in regressions:
+            self.stdout.write(self.style.ERROR(f"REGRESSION {line}"))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {baseline_path}"))
+        return regressions
+
+    @staticmethod
+    def revision():
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
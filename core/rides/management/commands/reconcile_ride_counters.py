@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.counters import DEFAULT_BATCH_SIZE, reconcile_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every ride's pending_request_count and accepted_count from its join "
+        "requests and participants, and repair the ones that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        def progress(result):
+            self.stdout.write(f"\r{result['checked']} rides checked", ending='')
+            self.stdout.flush()
+
+        result = reconcile_counters(batch_size=options['batch_size'], progress=progress)
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {result['checked']} rides, repaired {result['repaired']}"
+        ))
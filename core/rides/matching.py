@@ -0,0 +1,77 @@
+import numpy as np
+
+from .geo import covering_cells, geohash_cell_filter, haversine_km
+from .models import Ride
+
+# Score weights: one unit of score is roughly "one extra km of detour"
+PICKUP_WEIGHT = 1.0            # per km between the rider's origin and the pickup
+DROPOFF_WEIGHT = 1.0           # per km between the drop-off and the rider's destination
+TIME_WEIGHT = 1.0 / 10         # per minute of departure-time mismatch
+COST_WEIGHT = 1.0 / 50         # per currency unit of cost_per_seat
+
+
+def match_rides(origin, destination, departure, window, max_pickup_km, max_dropoff_km, k, exclude_owner=None):
+    """
+    Rank UPCOMING rides by how well they fit a rider's trip and return the top
+    `k` as [(ride_id, details)], best first.
+
+    The candidate set is narrowed in the database by status, the departure
+    window and the pickup geohash cells around `origin`; scoring then runs as
+    array arithmetic over the candidates rather than per-object Python.
+    """
+    candidates = Ride.objects.all()
+    if exclude_owner is not None:
+        candidates = candidates.exclude(owner=exclude_owner)
+
+    rows = list(
+        candidates.filter(
+            geohash_cell_filter('pickup_geohash', covering_cells(*origin, max_pickup_km)),
+            status=Ride.RideStatus.UPCOMING,
+            seats_available__gt=0,
+            departure_datetime__gte=departure - window,
+            departure_datetime__lte=departure + window,
+        ).values_list(
+            'id', 'pickup_latitude', 'pickup_longitude',
+            'destination_latitude', 'destination_longitude',
+            'departure_datetime', 'cost_per_seat',
+        )
+    )
+    if not rows:
+        return []
+
+    ids, p_lat, p_lon, d_lat, d_lon, departures, costs = zip(*rows)
+    ids = np.asarray(ids)
+    pickup_km = haversine_km(*origin, p_lat, p_lon)
+    dropoff_km = haversine_km(*destination, d_lat, d_lon)
+    time_diff_min = np.abs(np.array([d.timestamp() for d in departures]) - departure.timestamp()) / 60
+    cost = np.asarray(costs, dtype=np.float64)
+
+    mask = (pickup_km <= max_pickup_km) & (dropoff_km <= max_dropoff_km)
+    if not mask.any():
+        return []
+    ids, pickup_km, dropoff_km, time_diff_min, cost = (
+        a[mask] for a in (ids, pickup_km, dropoff_km, time_diff_min, cost)
+    )
+
+    scores = (
+        PICKUP_WEIGHT * pickup_km
+        + DROPOFF_WEIGHT * dropoff_km
+        + TIME_WEIGHT * time_diff_min
+        + COST_WEIGHT * cost
+    )
+
+    if len(scores) > k:
+        top = np.argpartition(scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(scores[top], kind='stable')]
+
+    return [
+        (int(ids[i]), {
+            'score': round(float(scores[i]), 3),
+            'pickup_distance_km': round(float(pickup_km[i]), 3),
+            'dropoff_distance_km': round(float(dropoff_km[i]), 3),
+            'departure_diff_minutes': round(float(time_diff_min[i]), 1),
+        })
+        for i in top
+    ]
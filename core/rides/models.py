@@ -1,6 +1,7 @@
 from django.db import models
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from .geo import encode_geohash
 
 class Ride(models.Model):
     class RideStatus(models.TextChoices):
@@ -27,8 +28,15 @@ class Ride(models.Model):
     destination_latitude = models.FloatField()
     destination_longitude = models.FloatField()
 
+    # Geohash cells of the two endpoints, used as a spatial index for proximity search
+    pickup_geohash = models.CharField(max_length=12, db_index=True, editable=False, default='')
+    destination_geohash = models.CharField(max_length=12, db_index=True, editable=False, default='')
+
     total_seats = models.PositiveIntegerField(default=1)
     seats_available = models.PositiveIntegerField()
+    # Denormalized from the join requests and participants (see rides.counters)
+    pending_request_count = models.PositiveIntegerField(default=0, editable=False)
+    accepted_count = models.PositiveIntegerField(default=0, editable=False)
     total_cost = models.DecimalField(max_digits=10, decimal_places=2)
     cost_per_seat = models.DecimalField(max_digits=10, decimal_places=2, editable=False)
 
@@ -41,15 +49,39 @@ class Ride(models.Model):
     departure_datetime = models.DateTimeField()
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped by save() and set explicitly by queryset updates; drives ride-sync
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # fetch-upcoming-rides and match: UPCOMING rides in departure order
+            models.Index(
+                fields=['departure_datetime', 'id'],
+                condition=models.Q(status='UPCOMING'),
+                name='ride_upcoming_departure_idx',
+            ),
+            # get-user-rides: a user's created rides, newest first
+            models.Index(fields=['owner', '-created_at', '-id'], name='ride_owner_created_idx'),
+            # Status sweeps over the whole table (lifecycle, archival)
+            models.Index(fields=['status', 'departure_datetime'], name='ride_status_departure_idx'),
+            # ride-sync: a user's created rides changed since a token
+            models.Index(fields=['owner', 'updated_at'], name='ride_owner_updated_idx'),
+        ]
 
     def save(self, *args, **kwargs):
+        self.fill_derived_fields()
+        super().save(*args, **kwargs)
+
+    def fill_derived_fields(self):
+        """Set the fields derived from the ride's input, as save() does; bulk_create() skips save()."""
         if not self.pk:
             self.seats_available = max(self.total_seats - 1, 0)
         if self.total_seats > 0:
             self.cost_per_seat = self.total_cost / self.total_seats
         else:
             self.cost_per_seat = 0
-        super().save(*args, **kwargs)
+        self.pickup_geohash = encode_geohash(self.pickup_latitude, self.pickup_longitude)
+        self.destination_geohash = encode_geohash(self.destination_latitude, self.destination_longitude)
 
     def __str__(self):
         return f"{self.owner.full_name}'s ride on {self.departure_datetime.strftime('%Y-%m-%d %H:%M')}"
@@ -65,9 +97,117 @@ class RideJoinRequest(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ride_requests')
     status = models.CharField(max_length=10, choices=RequestStatus.choices, default=RequestStatus.PENDING)
     requested_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ['ride', 'user']
+        indexes = [
+            # get-user-rides accepted rides, requested state per user
+            models.Index(fields=['user', 'status'], name='joinrequest_user_status_idx'),
+            # get-created-requests: a user's requests, newest first
+            models.Index(fields=['user', '-requested_at', '-id'], name='joinrequest_user_requested_idx'),
+            # Pending requests of a ride
+            models.Index(fields=['ride', 'status'], name='joinrequest_ride_status_idx'),
+            # ride-sync: a user's requests changed since a token
+            models.Index(fields=['user', 'updated_at'], name='joinrequest_user_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.full_name} → {self.ride} ({self.status})"
+
+
+class ArchivedRide(models.Model):
+    """
+    A finished Ride moved out of the hot tables by rides.archive. Keeps the
+    original id and only the fields that still mean something once a ride is
+    over; participants are kept, join requests go to ArchivedRideJoinRequest.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_rides'
+    )
+    participants = models.ManyToManyField(
+        settings.AUTH_USER_MODEL,
+        related_name='archived_rides_joined',
+        blank=True
+    )
+
+    pickup_latitude = models.FloatField()
+    pickup_longitude = models.FloatField()
+    destination_latitude = models.FloatField()
+    destination_longitude = models.FloatField()
+
+    total_seats = models.PositiveIntegerField()
+    total_cost = models.DecimalField(max_digits=10, decimal_places=2)
+    cost_per_seat = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=10, choices=Ride.RideStatus.choices)
+    departure_datetime = models.DateTimeField()
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # ride-history: a user's archived rides, latest departure first
+            models.Index(fields=['owner', '-departure_datetime', '-id'], name='archivedride_owner_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived ride {self.id} on {self.departure_datetime.strftime('%Y-%m-%d %H:%M')}"
+
+
+class ArchivedRideJoinRequest(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    ride = models.ForeignKey(ArchivedRide, on_delete=models.CASCADE, related_name='join_requests')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_ride_requests')
+    status = models.CharField(max_length=10, choices=RideJoinRequest.RequestStatus.choices)
+    requested_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-requested_at', '-id'], name='archivedrequest_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} → archived ride {self.ride_id} ({self.status})"
+
+
+class SyncTombstone(models.Model):
+    """
+    Marks a ride or join request that left a user's ride-sync set (deleted or
+    archived), so a client syncing from an older token drops it. Kept for
+    rides.sync.TOMBSTONE_RETENTION; older sync tokens are refused.
+    """
+    class Kind(models.TextChoices):
+        RIDE = 'RIDE', 'Ride'
+        JOIN_REQUEST = 'JOIN_REQUEST', 'Join request'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sync_tombstones')
+    kind = models.CharField(max_length=12, choices=Kind.choices)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+            # Pruning
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} removed for {self.user_id}"
+
+
+class ImportProgress(models.Model):
+    """
+    Input lines done by rides.bulk_import under a checkpoint name, written in
+    the transaction of the batch it covers, so it never disagrees with the
+    imported rows.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    lines = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"{self.user.full_name} → {self.ride} ({self.status})"
\ No newline at end of file
+        return f"{self.name}: {self.lines} lines"
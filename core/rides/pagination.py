@@ -0,0 +1,87 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values):
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+    # Keys are datetimes (as ISO strings) and ids; anything else was not made by encode_cursor
+    if not all(isinstance(v, (str, int)) and not isinstance(v, bool) for v in values):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def parse_limit(query_params):
+    limit = int(query_params.get('limit', DEFAULT_PAGE_SIZE))
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def _after(ordering, values):
+    """
+    Q selecting rows strictly after `values` in `ordering`, i.e. the
+    expanded form of the row comparison (a, b) > (x, y).
+    """
+    q = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        clause = Q(**{f'{name}__{lookup}': values[i]})
+        for prev_field, prev_value in zip(ordering[:i], values[:i]):
+            clause &= Q(**{prev_field.lstrip('-'): prev_value})
+        q |= clause
+    return q
+
+
+def _page_queryset(queryset, ordering, cursor, limit):
+    if cursor:
+        try:
+            queryset = queryset.filter(_after(ordering, decode_cursor(cursor, len(ordering))))
+        except (ValidationError, TypeError):
+            # A value of the wrong kind for its field, e.g. an id for a datetime
+            raise ValueError('Invalid cursor')
+    return queryset.order_by(*ordering)[:limit + 1]
+
+
+def _split_page(objects, ordering, limit):
+    if len(objects) <= limit:
+        return objects, None
+
+    objects = objects[:limit]
+    last = objects[-1]
+    return objects, encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
+
+
+def keyset_paginate(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return (objects, next_cursor) for one page of `queryset` ordered by the
+    unique key `ordering`, e.g. ('departure_datetime', 'id'). The cursor
+    encodes the key of the last row, so each page is an index range scan
+    regardless of how deep into the result set it is.
+    """
+    page = _page_queryset(queryset, ordering, cursor, limit)
+    return _split_page(list(page), ordering, limit)
+
+
+async def akeyset_paginate(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """keyset_paginate() through the async ORM."""
+    page = _page_queryset(queryset, ordering, cursor, limit)
+    return _split_page([obj async for obj in page], ordering, limit)
@@ -0,0 +1,161 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import events
+from .cache import invalidate_join_requests, invalidate_rides
+from .counters import decrement
+from .models import Ride, RideJoinRequest
+
+
+class ReservationError(Exception):
+    """A join request could not be moved to the requested state."""
+
+
+class RequestAlreadyProcessed(ReservationError):
+    message = 'Request already processed.'
+
+
+class NoSeatsAvailable(ReservationError):
+    message = 'No seats available'
+
+
+def reserve_seat(ride_id, **changes):
+    """
+    Take one seat on a ride with a single conditional UPDATE. The database
+    checks and decrements `seats_available` atomically and row-locks the ride
+    until commit, so concurrent callers can never push it below zero.
+    `changes` are further field updates made by the same statement.
+    Returns False when the ride is full.
+    """
+    return Ride.objects.filter(pk=ride_id, seats_available__gt=0)\
+        .update(seats_available=F('seats_available') - 1, updated_at=timezone.now(), **changes) == 1
+
+
+def _claim(join_request, new_status):
+    claimed = RideJoinRequest.objects.filter(
+        pk=join_request.pk, status=RideJoinRequest.RequestStatus.PENDING
+    ).update(status=new_status, updated_at=timezone.now())
+    if not claimed:
+        raise RequestAlreadyProcessed()
+    # The queryset update bypasses post_save
+    invalidate_join_requests([(join_request.ride_id, join_request.user_id)])
+
+
+def accept_join_request(join_request):
+    """
+    Accept a pending request: mark it ACCEPTED, take a seat and add the user
+    to the ride's participants, all in one transaction. Every step is a
+    conditional write, so two owners' devices racing on the same request, or
+    many requests racing for the last seat, resolve in the database.
+    """
+    with transaction.atomic():
+        _claim(join_request, RideJoinRequest.RequestStatus.ACCEPTED)
+        if not reserve_seat(join_request.ride_id, pending_request_count=decrement('pending_request_count')):
+            raise NoSeatsAvailable()
+        # The queryset update bypasses post_save; add() fires m2m_changed, which
+        # counts the participant and invalidates the ride's cached fragment
+        Ride(pk=join_request.ride_id).participants.add(join_request.user_id)
+        # The ride row stays locked until commit, so this is the count clients end up with
+        seats_available = Ride.objects.values_list('seats_available', flat=True).get(pk=join_request.ride_id)
+        events.join_request_status_changed([
+            (join_request.pk, join_request.ride_id, join_request.user_id, RideJoinRequest.RequestStatus.ACCEPTED)
+        ])
+        events.seats_changed(join_request.ride_id, seats_available)
+    join_request.status = RideJoinRequest.RequestStatus.ACCEPTED
+
+
+def reject_join_request(join_request):
+    with transaction.atomic():
+        _claim(join_request, RideJoinRequest.RequestStatus.REJECTED)
+        Ride.objects.filter(pk=join_request.ride_id)\
+            .update(pending_request_count=decrement('pending_request_count'), updated_at=timezone.now())
+        invalidate_rides([join_request.ride_id])
+    join_request.status = RideJoinRequest.RequestStatus.REJECTED
+    events.join_request_status_changed([
+        (join_request.pk, join_request.ride_id, join_request.user_id, join_request.status)
+    ])
+
+
+def create_join_request(ride, user):
+    """
+    Return (join_request, created). Relies on the (ride, user) unique
+    constraint instead of an exists() check, so retries and double taps
+    cannot create duplicates.
+    """
+    try:
+        with transaction.atomic():
+            join_request = RideJoinRequest.objects.create(ride=ride, user=user)
+    except IntegrityError:
+        return RideJoinRequest.objects.get(ride=ride, user=user), False
+    events.join_request_created(join_request, ride.owner_id)
+    return join_request, True
+
+
+def bulk_process_join_requests(ride_id, actions):
+    """
+    Apply a batch of {'req_id', 'action'} items to one ride's join requests in
+    a single transaction with a constant number of queries. Items are taken in
+    order; accepts beyond the remaining seats fail individually. Returns
+    (results, seats_available) with one result per item.
+    """
+    req_ids = [item['req_id'] for item in actions]
+
+    with transaction.atomic():
+        ride = Ride.objects.select_for_update().only('id', 'seats_available').get(pk=ride_id)
+        join_requests = {
+            req.id: req for req in
+            RideJoinRequest.objects.select_for_update()
+                .filter(ride_id=ride_id, id__in=req_ids)
+                .only('id', 'user_id', 'status')
+        }
+
+        seats_left = ride.seats_available
+        accepted, rejected, results = [], [], []
+        for item in actions:
+            result = {'req_id': item['req_id'], 'action': item['action']}
+            join_request = join_requests.get(item['req_id'])
+
+            if join_request is None:
+                result['error'] = 'Request not found.'
+            elif join_request.status != RideJoinRequest.RequestStatus.PENDING:
+                result['error'] = RequestAlreadyProcessed.message
+            elif item['action'] == 'accept' and seats_left <= 0:
+                result['error'] = NoSeatsAvailable.message
+            elif item['action'] == 'accept':
+                seats_left -= 1
+                join_request.status = RideJoinRequest.RequestStatus.ACCEPTED
+                accepted.append(join_request)
+            else:
+                join_request.status = RideJoinRequest.RequestStatus.REJECTED
+                rejected.append(join_request)
+
+            result['success'] = 'error' not in result
+            results.append(result)
+
+        now = timezone.now()
+        if accepted:
+            RideJoinRequest.objects.filter(id__in=[req.id for req in accepted])\
+                .update(status=RideJoinRequest.RequestStatus.ACCEPTED, updated_at=now)
+        if rejected:
+            RideJoinRequest.objects.filter(id__in=[req.id for req in rejected])\
+                .update(status=RideJoinRequest.RequestStatus.REJECTED, updated_at=now)
+        if accepted or rejected:
+            # The ride row is locked, so the remaining seat count is exact
+            Ride.objects.filter(pk=ride_id).update(
+                seats_available=F('seats_available') - len(accepted),
+                pending_request_count=decrement('pending_request_count', len(accepted) + len(rejected)),
+                updated_at=now,
+            )
+            invalidate_rides([ride_id])
+        if accepted:
+            ride.participants.add(*[req.user_id for req in accepted])
+
+        invalidate_join_requests([(ride_id, req.user_id) for req in accepted + rejected])
+        events.join_request_status_changed([
+            (req.id, ride_id, req.user_id, req.status) for req in accepted + rejected
+        ])
+        if accepted:
+            events.seats_changed(ride_id, seats_left)
+
+    return results, seats_left
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Ride, RideJoinRequest
+from .models import ArchivedRide, ArchivedRideJoinRequest, Ride, RideJoinRequest
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -61,6 +61,7 @@ class RideSerializer(serializers.ModelSerializer):
             'pickup_latitude', 'pickup_longitude',
             'destination_latitude', 'destination_longitude',
             'total_seats', 'seats_available',
+            'pending_request_count', 'accepted_count',
             'total_cost', 'cost_per_seat',
             'status', 'departure_datetime', 'created_at',
             'is_user_owner', 'requested', 'requested_status'
@@ -156,4 +157,49 @@ class RideJoinRequestWithRideSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = RideJoinRequest
-        fields = ['id', 'status', 'requested_at', 'ride']
\ No newline at end of file
+        fields = ['id', 'status', 'requested_at', 'ride']
+
+
+class RideJoinRequestStateSerializer(serializers.ModelSerializer):
+    """A join request in ride-sync; the ride itself is synced separately."""
+    class Meta:
+        model = RideJoinRequest
+        fields = ['id', 'ride', 'status', 'requested_at', 'updated_at']
+
+
+class ArchivedRideSerializer(serializers.ModelSerializer):
+    owner = UserSummarySerializer(read_only=True)
+    participants = UserSummarySerializer(many=True, read_only=True)
+    is_user_owner = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedRide
+        fields = [
+            'id', 'owner', 'participants',
+            'pickup_latitude', 'pickup_longitude',
+            'destination_latitude', 'destination_longitude',
+            'total_seats', 'total_cost', 'cost_per_seat',
+            'status', 'departure_datetime', 'created_at', 'archived_at',
+            'is_user_owner',
+        ]
+
+    def get_is_user_owner(self, obj):
+        user = self.context.get('request').user
+        return user.is_authenticated and obj.owner_id == user.id
+
+
+class ArchivedRideJoinRequestSerializer(serializers.ModelSerializer):
+    ride = ArchivedRideSerializer(read_only=True)
+
+    class Meta:
+        model = ArchivedRideJoinRequest
+        fields = ['id', 'status', 'requested_at', 'ride']
+
+
+class JoinRequestActionSerializer(serializers.Serializer):
+    req_id = serializers.IntegerField()
+    action = serializers.ChoiceField(choices=['accept', 'reject'])
+
+
+class BulkJoinRequestActionSerializer(serializers.Serializer):
+    actions = JoinRequestActionSerializer(many=True, allow_empty=False, max_length=100)
@@ -0,0 +1,144 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F, Q, QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import sync
+from .cache import invalidate_join_requests, invalidate_ride, invalidate_rides
+from .counters import decrement
+from .models import Ride, RideJoinRequest
+
+User = get_user_model()
+
+# Fields whose change can move a ride in or out of the upcoming listing
+LISTING_FIELDS = {'status', 'departure_datetime'}
+# User fields rendered in the owner and participant summaries of a ride
+USER_SUMMARY_FIELDS = {'full_name', 'phone_number'}
+
+
+def _users_being_deleted(origin):
+    """Ids of the users whose deletion is cascading; they need no tombstones."""
+    if isinstance(origin, User):
+        return {origin.pk}
+    if isinstance(origin, QuerySet) and origin.model is User:
+        return set(origin.values_list('pk', flat=True))
+    return set()
+
+
+@receiver(post_save, sender=Ride)
+def ride_saved(sender, instance, created, update_fields=None, **kwargs):
+    listing = created or update_fields is None or bool(LISTING_FIELDS & set(update_fields))
+    invalidate_ride(instance.pk, listing=listing)
+
+
+@receiver(post_delete, sender=Ride)
+def ride_deleted(sender, instance, **kwargs):
+    invalidate_ride(instance.pk, listing=True)
+
+
+@receiver(pre_delete, sender=Ride)
+def ride_deleting(sender, instance, origin=None, **kwargs):
+    # Before the cascade, while the requesters can still be read
+    if sync.in_batch_removal():
+        return
+    requesters = set(instance.join_requests.values_list('user_id', flat=True))
+    users = (requesters | {instance.owner_id}) - _users_being_deleted(origin)
+    sync.record_tombstones(sync.ride_tombstones([(instance.pk, users)]))
+
+
+def _linked(instance, reverse, pk_set, using):
+    """Of `pk_set`, the ids actually linked to `instance` as rides joined or participants."""
+    related = instance.rides_joined if reverse else instance.participants
+    return set(related.using(using).filter(pk__in=pk_set).values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Ride.participants.through)
+def ride_participants_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action == 'pre_remove':
+        # `remove` passes the requested ids whether or not they are linked (`add`
+        # passes only the new ones), so note which are before the rows go
+        instance._removed_participants = _linked(instance, reverse, pk_set, using)
+        return
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if action == 'post_remove':
+        pk_set = instance.__dict__.pop('_removed_participants', pk_set)
+        if not pk_set:
+            return
+    if not reverse:
+        ride_ids = [instance.pk]
+    elif action == 'pre_clear':
+        # Cleared from the user side: `pk_set` is not provided, so look the rides up
+        ride_ids = list(instance.rides_joined.values_list('id', flat=True))
+    else:
+        ride_ids = pk_set
+
+    # From the ride side every ride changes by the number of users, from the user side by one
+    changed = 1 if reverse else len(pk_set or ())
+    if action == 'post_add':
+        accepted_count = F('accepted_count') + changed
+    elif action == 'post_remove' or reverse:
+        accepted_count = decrement('accepted_count', changed)
+    else:
+        accepted_count = 0
+    # Participants are part of the rendered ride, so the change is synced too
+    Ride.objects.filter(id__in=ride_ids).update(accepted_count=accepted_count, updated_at=timezone.now())
+    for ride_id in ride_ids:
+        invalidate_ride(ride_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # The user's summary is part of every ride they own or joined, so the change is synced too
+    if created or (update_fields is not None and not USER_SUMMARY_FIELDS & set(update_fields)):
+        return
+    ride_ids = list(
+        Ride.objects.filter(Q(owner=instance) | Q(participants=instance)).values_list('id', flat=True).distinct()
+    )
+    if ride_ids:
+        Ride.objects.filter(id__in=ride_ids).update(updated_at=timezone.now())
+        invalidate_rides(ride_ids)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # The cascade deletes the user's participant rows without sending m2m_changed
+    ride_ids = list(instance.rides_joined.values_list('id', flat=True))
+    if ride_ids:
+        Ride.objects.filter(id__in=ride_ids)\
+            .update(accepted_count=decrement('accepted_count'), updated_at=timezone.now())
+        invalidate_rides(ride_ids)
+
+
+# Of the join requests, cached fragments only hold the pending count (the
+# per-user fields are read from the DB on every request), so other changes
+# only drop version tokens. Queryset updates in reservations and lifecycle
+# do the same themselves.
+@receiver(post_save, sender=RideJoinRequest)
+@receiver(post_delete, sender=RideJoinRequest)
+def join_request_changed(sender, instance, **kwargs):
+    invalidate_join_requests([(instance.ride_id, instance.user_id)])
+
+
+@receiver(post_save, sender=RideJoinRequest)
+def join_request_saved(sender, instance, created, **kwargs):
+    # Status changes go through reservations and lifecycle, which count them
+    if created and instance.status == RideJoinRequest.RequestStatus.PENDING:
+        Ride.objects.filter(pk=instance.ride_id)\
+            .update(pending_request_count=F('pending_request_count') + 1, updated_at=timezone.now())
+        invalidate_ride(instance.ride_id)
+
+
+@receiver(post_delete, sender=RideJoinRequest)
+def join_request_deleted(sender, instance, origin=None, **kwargs):
+    if sync.in_batch_removal():
+        return
+    if instance.user_id not in _users_being_deleted(origin):
+        sync.record_tombstones(sync.join_request_tombstones([(instance.pk, instance.user_id)]))
+    # A ride being deleted takes its counters with it
+    ride_deletion = isinstance(origin, Ride) or (isinstance(origin, QuerySet) and origin.model is Ride)
+    if instance.status == RideJoinRequest.RequestStatus.PENDING and not ride_deletion:
+        Ride.objects.filter(pk=instance.ride_id)\
+            .update(pending_request_count=decrement('pending_request_count'), updated_at=timezone.now())
+        invalidate_ride(instance.ride_id)
@@ -0,0 +1,128 @@
+"""
+Delta sync of a user's rides and join requests.
+
+A user's sync set is the rides they created or asked to join and their join
+requests: what GetUserRides and MyRideJoinRequestsView list. A client sends
+the token of its last sync and gets back what was created or changed since,
+the ids that left the set, and a new token, so a returning user's refresh
+costs O(changes) instead of O(history).
+
+Changes are found by `updated_at`: save() sets it, and queryset updates of
+rendered fields set it themselves. Removals leave SyncTombstone rows; the
+signal receivers record them for single deletes, rides.archive for a whole
+batch at once.
+"""
+import contextvars
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Ride, RideJoinRequest, SyncTombstone
+from .pagination import decode_cursor, encode_cursor
+
+# A change stamped just before a token can commit just after it, and app
+# servers' clocks drift, so each sync re-reads this much before its token.
+# Replica lag is not bounded by it: RideSyncView reads from the primary.
+# Clients upsert by id, so seeing a change twice is harmless.
+SYNC_OVERLAP = timedelta(seconds=30)
+# Tombstones are pruned after this; older tokens need a full sync
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+_batch_removal = contextvars.ContextVar('sync_batch_removal', default=False)
+
+
+class TokenExpired(Exception):
+    """The token predates the retained tombstones."""
+
+
+def encode_token(moment):
+    return encode_cursor([moment])
+
+
+def decode_token(token, now=None):
+    """The moment a token was issued. Raises ValueError or TokenExpired."""
+    value = decode_cursor(token, 1)[0]
+    moment = parse_datetime(value) if isinstance(value, str) else None
+    if moment is None or timezone.is_naive(moment):
+        raise ValueError('Invalid sync token')
+    if moment < (now or timezone.now()) - TOMBSTONE_RETENTION:
+        raise TokenExpired()
+    return moment
+
+
+def ride_tombstones(rides):
+    """Tombstones for removed rides, `rides` being [(ride_id, user_ids)]."""
+    return [
+        SyncTombstone(user_id=user_id, kind=SyncTombstone.Kind.RIDE, object_id=ride_id)
+        for ride_id, user_ids in rides for user_id in user_ids
+    ]
+
+
+def join_request_tombstones(join_requests):
+    """Tombstones for removed join requests, `join_requests` being [(request_id, user_id)]."""
+    return [
+        SyncTombstone(user_id=user_id, kind=SyncTombstone.Kind.JOIN_REQUEST, object_id=request_id)
+        for request_id, user_id in join_requests
+    ]
+
+
+def record_tombstones(tombstones):
+    SyncTombstone.objects.bulk_create(tombstones)
+
+
+@contextmanager
+def batch_removal():
+    """
+    For deletes whose caller records the tombstones of the whole batch
+    itself; the per-object signal receivers stand down inside.
+    """
+    token = _batch_removal.set(True)
+    try:
+        yield
+    finally:
+        _batch_removal.reset(token)
+
+
+def in_batch_removal():
+    return _batch_removal.get()
+
+
+def prune_tombstones(now=None):
+    """Delete tombstones past TOMBSTONE_RETENTION; returns how many."""
+    cutoff = (now or timezone.now()) - TOMBSTONE_RETENTION
+    return SyncTombstone.objects.filter(deleted_at__lt=cutoff).delete()[0]
+
+
+def sync_changes(user, token=None, now=None):
+    """
+    What changed in `user`'s sync set since `token` (everything without one):
+    {'ride_ids', 'join_requests', 'deleted': {'rides', 'join_requests'}, 'token'}.
+    Raises ValueError for a malformed token and TokenExpired for an old one.
+    """
+    now = now or timezone.now()
+    since = decode_token(token, now) - SYNC_OVERLAP if token else None
+
+    created = Ride.objects.filter(owner=user)
+    requested = Ride.objects.filter(join_requests__user=user)
+    join_requests = RideJoinRequest.objects.filter(user=user)\
+        .only('id', 'ride_id', 'status', 'requested_at', 'updated_at')
+    deleted = {'rides': [], 'join_requests': []}
+
+    if since is not None:
+        created = created.filter(updated_at__gt=since)
+        requested = requested.filter(updated_at__gt=since)
+        join_requests = join_requests.filter(updated_at__gt=since)
+        kinds = {SyncTombstone.Kind.RIDE: 'rides', SyncTombstone.Kind.JOIN_REQUEST: 'join_requests'}
+        for kind, object_id in SyncTombstone.objects.filter(user=user, deleted_at__gt=since)\
+                .values_list('kind', 'object_id'):
+            deleted[kinds[kind]].append(object_id)
+
+    ride_ids = created.values_list('id', flat=True).union(requested.values_list('id', flat=True))
+    return {
+        'ride_ids': sorted(ride_ids),
+        'join_requests': list(join_requests.order_by('id')),
+        'deleted': {key: sorted(set(ids)) for key, ids in deleted.items()},
+        'token': encode_token(now),
+    }
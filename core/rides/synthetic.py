@@ -0,0 +1,136 @@
+"""
+Synthetic campus data for benchmarks and load tests.
+
+Everything is written with bulk_create in batches. Rides are built the way
+Ride.save() would build them (seats, cost per seat, geohashes), clustered
+around a handful of campus hubs, and their join requests cover every
+RequestStatus with seat counts and participants kept consistent.
+"""
+import math
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+
+from .models import Ride, RideJoinRequest
+
+User = get_user_model()
+
+SYNTHETIC_PASSWORD = 'campus-pass'
+DEFAULT_CENTER = (12.9716, 77.5946)
+HUB_SPREAD_KM = 8.0
+RIDE_SPREAD_KM = 0.5
+KM_PER_DEGREE = 111.32
+
+
+def generate_users(count, rng, prefix='syn', batch_size=2000):
+    """
+    Create `count` users sharing SYNTHETIC_PASSWORD. The password is hashed
+    once and the hash reused, so this costs one hash instead of `count`.
+    """
+    password = make_password(SYNTHETIC_PASSWORD)
+    users = []
+    for start in range(0, count, batch_size):
+        users += User.objects.bulk_create([
+            User(phone_number=f'{prefix}{i:0{15 - len(prefix)}d}', full_name=f'Student {i}', password=password)
+            for i in range(start, min(start + batch_size, count))
+        ])
+    return users
+
+
+def campus_hubs(rng, center, count):
+    """Pickup/drop-off hotspots (hostels, gates, stations) around `center`."""
+    return [_jitter(rng, center, HUB_SPREAD_KM) for _ in range(count)]
+
+
+def _jitter(rng, point, spread_km):
+    lat, lon = point
+    dlat = rng.gauss(0, spread_km / KM_PER_DEGREE)
+    dlon = rng.gauss(0, spread_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)))
+    return lat + dlat, lon + dlon
+
+
+def build_ride(rng, owner, hubs, now):
+    pickup_hub, destination_hub = rng.sample(hubs, 2)
+    pickup = _jitter(rng, pickup_hub, RIDE_SPREAD_KM)
+    destination = _jitter(rng, destination_hub, RIDE_SPREAD_KM)
+
+    # Roughly a third of the history is in the past
+    departure = now + timedelta(minutes=rng.randint(-60 * 24 * 14, 60 * 24 * 7))
+    if departure > now:
+        ride_status = Ride.RideStatus.UPCOMING
+    elif departure > now - timedelta(hours=1):
+        ride_status = Ride.RideStatus.ONGOING
+    else:
+        ride_status = Ride.RideStatus.ABORTED if rng.random() < 0.1 else Ride.RideStatus.COMPLETED
+
+    ride = Ride(
+        owner=owner,
+        pickup_latitude=pickup[0], pickup_longitude=pickup[1],
+        destination_latitude=destination[0], destination_longitude=destination[1],
+        total_seats=rng.randint(2, 6),
+        total_cost=Decimal(rng.randint(10, 90) * 10),
+        status=ride_status,
+        departure_datetime=departure,
+    )
+    ride.fill_derived_fields()
+    return ride
+
+
+def plan_requests(rng, ride, users, mean_requests):
+    """
+    [(user, status)] for one ride. Accepted requests never exceed the seats
+    left, and rides that already left have no PENDING requests.
+    """
+    count = min(int(rng.expovariate(1 / mean_requests)) if mean_requests else 0, len(users) - 1)
+    requesters = [u for u in rng.sample(users, count + 1) if u.id != ride.owner_id][:count]
+
+    planned = []
+    for user in requesters:
+        roll = rng.random()
+        if roll < 0.4 and ride.seats_available > 0:
+            status = RideJoinRequest.RequestStatus.ACCEPTED
+            ride.seats_available -= 1
+            ride.accepted_count += 1
+        elif roll < 0.7 or ride.status != Ride.RideStatus.UPCOMING:
+            status = RideJoinRequest.RequestStatus.REJECTED
+        else:
+            status = RideJoinRequest.RequestStatus.PENDING
+            ride.pending_request_count += 1
+        planned.append((user, status))
+    return planned
+
+
+def generate_rides(users, count, rng, center=DEFAULT_CENTER, hubs=12, mean_requests=3.0,
+                   batch_size=2000, progress=None):
+    """
+    Create `count` rides owned by random `users`, with their join requests,
+    the participants of accepted requests and matching ride counters. Returns the number of join requests.
+    """
+    hub_points = campus_hubs(rng, center, hubs)
+    through = Ride.participants.through
+    user_field = f'{Ride.participants.field.m2m_reverse_field_name()}_id'
+    now = timezone.now()
+    total_requests = 0
+
+    for start in range(0, count, batch_size):
+        rides = [build_ride(rng, rng.choice(users), hub_points, now)
+                 for _ in range(min(batch_size, count - start))]
+        plans = [plan_requests(rng, ride, users, mean_requests) for ride in rides]
+        rides = Ride.objects.bulk_create(rides)
+
+        join_requests, participants = [], []
+        for ride, plan in zip(rides, plans):
+            for user, status in plan:
+                join_requests.append(RideJoinRequest(ride_id=ride.id, user_id=user.id, status=status))
+                if status == RideJoinRequest.RequestStatus.ACCEPTED:
+                    participants.append(through(ride_id=ride.id, **{user_field: user.id}))
+        RideJoinRequest.objects.bulk_create(join_requests, batch_size=batch_size)
+        through.objects.bulk_create(participants, batch_size=batch_size)
+
+        total_requests += len(join_requests)
+        if progress:
+            progress(start + len(rides), count)
+    return total_requests
@@ -1,3 +1,1728 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Prefetch
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.connection import ConnectionDoesNotExist
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .geo import covering_cells, encode_geohash, haversine_km
+from . import bulk_import
+from .archive import archive_rides
+from .bulk_import import run_import
+from .management.commands.loadtest import SCENARIOS
+from .export import EXPORT_FIELDS, JOIN_REQUEST_EXPORT_FIELDS, astream_export, export_querysets, stream_export
+from .counters import reconcile_counters
+from .events import ride_group, user_group
+from .lifecycle import advance_ride_statuses
+from .matching import match_rides
+from core.async_cache import AsyncCache, aioredis
+from core.channels import SUBSCRIBER_QUEUE_SIZE, RedisChannelLayer, channel_layer
+from core.db_router import PrimaryReplicaRouter, ReplicaRoutingMiddleware, primary_pin_key
+from core.metrics import Registry, collect, render, run_directory
+from core.testing import QueryBudgetMixin, url_names
+from core.tiered_cache import InMemoryInvalidationBus, LocalCache, TieredCache, cache as tiered_cache
+from users import urls as users_urls
+from users.authentication import ACTIVE, ClaimsRefreshToken, user_state
+
+from . import urls as rides_urls
+from . import cache as rides_cache
+from .cache import (
+    UPCOMING_PAGE_KEY, generation_key, get_or_rebuild, get_ride_fragments, ride_fragment_key, render_rides,
+)
+from .models import ArchivedRide, Ride, RideJoinRequest, SyncTombstone
+from .reservations import (
+    NoSeatsAvailable, RequestAlreadyProcessed, accept_join_request, bulk_process_join_requests,
+    create_join_request, reject_join_request,
+)
+from .pagination import encode_cursor
+from .projections import project_rides
+from .serializers import RideDetailSerializer, RideSerializer
+from .views import GetRideDetail, GetUpcomingRidesView, GetUserRides, MyRideJoinRequestsView, RideSyncView
+from .synthetic import generate_rides, generate_users
+from .sync import SYNC_OVERLAP, TOMBSTONE_RETENTION, encode_token, prune_tombstones
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+
+def clear_caches():
+    # The in-process tier is not cleared along with the shared cache
+    cache.clear()
+    tiered_cache.clear_local()
+
+
+def make_ride(owner, pickup=(12.9716, 77.5946), destination=(12.9352, 77.6245), **kwargs):
+    kwargs.setdefault('total_seats', 4)
+    kwargs.setdefault('total_cost', 400)
+    kwargs.setdefault('departure_datetime', timezone.now() + timedelta(hours=2))
+    return Ride.objects.create(
+        owner=owner,
+        pickup_latitude=pickup[0], pickup_longitude=pickup[1],
+        destination_latitude=destination[0], destination_longitude=destination[1],
+        **kwargs
+    )
+
+
+class RideTestCase(TestCase):
+    """
+    A ride owner and RIDERS riders, created once per class; subclasses add
+    their rides in setUpTestData. Every test starts with empty caches and an
+    unauthenticated client.
+    """
+    RIDERS = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('9000000001', 'Owner', 'pass')
+        cls.riders = [User.objects.create_user(f'90000001{i:02}', f'Rider {i}', 'pass') for i in range(cls.RIDERS)]
+        cls.rider = cls.riders[0] if cls.riders else None
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+
+
+class GeoTests(TestCase):
+    def test_encode_geohash_known_value(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_covering_cells_contain_point(self):
+        cells = covering_cells(12.9716, 77.5946, 2)
+        self.assertIn(encode_geohash(12.9716, 77.5946, len(cells[0])), cells)
+        self.assertEqual(len(cells), 9)
+
+    def test_haversine(self):
+        distances = haversine_km(12.9716, 77.5946, [12.9716, 13.0827], [77.5946, 80.2707])
+        self.assertAlmostEqual(distances[0], 0)
+        self.assertAlmostEqual(distances[1], 290, delta=5)
+
+
+class UpcomingRidesProximityTests(RideTestCase):
+    RIDERS = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.near = make_ride(cls.owner, pickup=(12.9720, 77.5950))
+        cls.nearer = make_ride(cls.owner, pickup=(12.9716, 77.5946))
+        cls.far = make_ride(cls.owner, pickup=(13.0827, 80.2707))
+
+    def test_near_pickup_filters_and_sorts_by_distance(self):
+        response = self.client.get(reverse('fetch-rides'), {'near_pickup': '12.9716,77.5946', 'radius_km': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['id'] for r in response.data], [self.nearer.id, self.near.id])
+
+    def test_near_pickup_and_destination(self):
+        other = make_ride(self.owner, pickup=(12.9716, 77.5946), destination=(13.0827, 80.2707))
+        response = self.client.get(reverse('fetch-rides'), {
+            'near_pickup': '12.9716,77.5946', 'near_destination': '13.0827,80.2707'
+        })
+        self.assertEqual([r['id'] for r in response.data], [other.id])
+
+    def test_bad_point_is_rejected(self):
+        response = self.client.get(reverse('fetch-rides'), {'near_pickup': 'nowhere'})
+        self.assertEqual(response.status_code, 400)
+
+
+class KeysetPaginationTests(RideTestCase):
+    RIDERS = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        departure = timezone.now() + timedelta(days=1)
+        # Several rides share a departure time so the id tie-breaker matters
+        cls.rides = [
+            make_ride(cls.owner, departure_datetime=departure + timedelta(hours=i // 2), total_seats=2 + i % 3)
+            for i in range(7)
+        ]
+
+    def fetch_all(self, params):
+        ids, cursor = [], None
+        while True:
+            query = dict(params, limit=3)
+            if cursor:
+                query['cursor'] = cursor
+            response = self.client.get(reverse('fetch-rides'), query)
+            self.assertEqual(response.status_code, 200)
+            ids += [r['id'] for r in response.data]
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                return ids
+
+    def test_pages_cover_all_rides_in_order(self):
+        expected = [r.id for r in sorted(self.rides, key=lambda r: (r.departure_datetime, r.id))]
+        self.assertEqual(self.fetch_all({}), expected)
+
+    def test_min_seats_filter(self):
+        expected = [r.id for r in sorted(self.rides, key=lambda r: (r.departure_datetime, r.id))
+                    if r.seats_available >= 3]
+        self.assertEqual(self.fetch_all({'min_seats': 3}), expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('fetch-rides'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_tampered_cursor_values(self):
+        departure = self.rides[0].departure_datetime
+        for values in ([{'a': 1}, 1], [departure, [1]], [departure, True], [1, 1], [departure, 'x']):
+            with self.subTest(values=values):
+                response = self.client.get(reverse('fetch-rides'), {'cursor': encode_cursor(values)})
+                self.assertEqual(response.status_code, 400)
+
+    def test_user_rides_created_cursor(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(reverse('user-rides'), {'limit': 4})
+        self.assertEqual(len(response.data['created_rides']), 4)
+        response = self.client.get(reverse('user-rides'), {
+            'limit': 4, 'created_cursor': response.headers['X-Next-Cursor-Created']
+        })
+        self.assertEqual(len(response.data['created_rides']), 3)
+        self.assertNotIn('X-Next-Cursor-Created', response.headers)
+
+
+class RideFragmentCacheTests(RideTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.rides = [make_ride(cls.owner), make_ride(cls.owner)]
+        cls.rides[0].participants.add(cls.rider)
+        RideJoinRequest.objects.create(ride=cls.rides[0], user=cls.rider)
+
+    def assert_matches_serializer(self, user):
+        request = APIRequestFactory().get('/')
+        request.user = user
+        rides = Ride.objects.filter(id__in=[r.id for r in self.rides]).order_by('id')\
+            .prefetch_related(Prefetch(
+                'join_requests', queryset=RideJoinRequest.objects.filter(user=user), to_attr='user_join_requests'
+            ))
+        expected = RideSerializer(rides, many=True, context={'request': request}).data
+        self.assertEqual(render_rides([r.id for r in self.rides], user), [dict(item) for item in expected])
+
+    def test_projection_renders_identical_json(self):
+        request = APIRequestFactory().get('/')
+        request.user = self.rider
+        rides = Ride.objects.order_by('id')
+        expected = RideSerializer(
+            rides.prefetch_related(Prefetch(
+                'join_requests', queryset=RideJoinRequest.objects.filter(user=self.rider), to_attr='user_join_requests'
+            )),
+            many=True, context={'request': request}
+        ).data
+        self.assertEqual(JSONRenderer().render(project_rides(rides, self.rider)), JSONRenderer().render(expected))
+
+    def test_overlay_matches_ride_serializer(self):
+        self.assert_matches_serializer(self.rider)
+        self.assert_matches_serializer(self.owner)
+
+    def test_detail_matches_detail_serializer(self):
+        for user in (self.owner, self.rider, None):
+            rides = Ride.objects.select_related('owner').prefetch_related(
+                'participants',
+                Prefetch('join_requests', queryset=RideJoinRequest.objects.select_related('user')),
+                Prefetch('join_requests', queryset=RideJoinRequest.objects.filter(user=user), to_attr='user_join_requests'),
+            )
+            request = APIRequestFactory().get('/')
+            force_authenticate(request, user)
+            response = GetRideDetail.as_view()(request, ride_id=self.rides[0].id)
+            request.user = user or AnonymousUser()
+            expected = RideDetailSerializer(rides.get(pk=self.rides[0].id), context={'request': request}).data
+            self.assertEqual(JSONRenderer().render(response.data), JSONRenderer().render(expected))
+
+    def test_fragments_are_shared_and_multi_fetched(self):
+        ids = [r.id for r in self.rides]
+        get_ride_fragments(ids)
+        self.assertIsNotNone(cache.get(ride_fragment_key(ids[0])))
+        with self.assertNumQueries(0):
+            get_ride_fragments(ids)
+
+    def test_fill_racing_an_invalidation_is_not_served(self):
+        ride = self.rides[1]
+        render = rides_cache.render_ride_fragments
+
+        def render_then_write(rides):
+            # The ride changes and its invalidation runs after the fill read the DB
+            rendered = render(rides)
+            with self.captureOnCommitCallbacks(execute=True):
+                Ride.objects.get(pk=ride.pk).participants.add(self.rider)
+            return rendered
+
+        with mock.patch('rides.cache.render_ride_fragments', side_effect=render_then_write):
+            self.assertEqual(get_ride_fragments([ride.id])[ride.id]['participants'], [])
+        self.assertEqual(len(get_ride_fragments([ride.id])[ride.id]['participants']), 1)
+
+    def test_only_replaced_entries_are_published(self):
+        ride_ids = [ride.id for ride in self.rides]
+        with mock.patch.object(tiered_cache.bus, 'publish') as publish:
+            get_ride_fragments(ride_ids)
+            publish.assert_not_called()
+            tiered_cache.delete(generation_key(ride_fragment_key(ride_ids[0])))
+            publish.reset_mock()
+            get_ride_fragments(ride_ids)
+        publish.assert_called_once_with([ride_fragment_key(ride_ids[0])])
+
+
+class CacheInvalidationTests(RideTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ride = make_ride(cls.owner)
+        cls.other = make_ride(cls.owner)
+
+    def setUp(self):
+        super().setUp()
+        # Warm the shared page and both fragments
+        self.client.get(reverse('fetch-rides'))
+        self.all_keys = [UPCOMING_PAGE_KEY, ride_fragment_key(self.ride.id), ride_fragment_key(self.other.id)]
+
+    def cached_keys(self):
+        return [key for key in self.all_keys if cache.get(key) is not None]
+
+    def test_warm(self):
+        self.assertEqual(self.cached_keys(), self.all_keys)
+
+    def test_create_ride_busts_only_listing(self):
+        self.client.force_authenticate(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('ride-create'), {
+                'pickup_latitude': 1, 'pickup_longitude': 1,
+                'destination_latitude': 2, 'destination_longitude': 2,
+                'total_seats': 3, 'total_cost': 90,
+                'departure_datetime': (timezone.now() + timedelta(days=1)).isoformat(),
+            })
+        self.assertEqual(self.cached_keys(), self.all_keys[1:])
+
+    def test_join_request_busts_only_that_ride(self):
+        # The fragment carries the pending request count
+        self.client.force_authenticate(self.rider)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('ride-join-request', args=[self.ride.id]))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.cached_keys(), [UPCOMING_PAGE_KEY, ride_fragment_key(self.other.id)])
+
+    def test_accept_busts_only_that_ride(self):
+        join_request = RideJoinRequest.objects.create(ride=self.ride, user=self.rider)
+        self.client.force_authenticate(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                reverse('manage-ride-request', args=[self.ride.id, join_request.id, 'accept'])
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(ride_fragment_key(self.ride.id), self.cached_keys())
+        self.assertIn(ride_fragment_key(self.other.id), self.cached_keys())
+
+        # The next read reflects the new seat count
+        data = {r['id']: r for r in self.client.get(reverse('fetch-rides')).data}
+        self.assertEqual(data[self.ride.id]['seats_available'], self.ride.seats_available - 1)
+        self.assertEqual(data[self.ride.id]['participants'][0]['id'], self.rider.id)
+
+    def test_participant_removed_from_user_side(self):
+        self.ride.participants.add(self.rider)
+        self.client.get(reverse('fetch-rides'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rider.rides_joined.clear()
+        self.assertEqual(self.cached_keys(), [UPCOMING_PAGE_KEY, ride_fragment_key(self.other.id)])
+
+    def test_renaming_a_participant_busts_their_rides(self):
+        self.ride.participants.add(self.rider)
+        self.client.get(reverse('fetch-rides'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rider.save(update_fields=['last_login'])
+        self.assertEqual(self.cached_keys(), self.all_keys)
+
+        self.rider.full_name = 'Renamed Rider'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rider.save()
+        self.assertEqual(self.cached_keys(), [UPCOMING_PAGE_KEY, ride_fragment_key(self.other.id)])
+        data = {r['id']: r for r in self.client.get(reverse('fetch-rides')).data}
+        self.assertEqual(data[self.ride.id]['participants'][0]['full_name'], 'Renamed Rider')
+
+        self.owner.phone_number = '9000000999'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.owner.save(update_fields=['phone_number'])
+        self.assertEqual(self.cached_keys(), [UPCOMING_PAGE_KEY])
+
+    def test_delete_ride_busts_listing_and_fragment(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.delete()
+        self.assertEqual(self.cached_keys(), [ride_fragment_key(self.ride.id)])
+
+
+class RideCounterTests(RideTestCase):
+    RIDERS = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ride = make_ride(cls.owner, total_seats=4)
+        cls.requests = [create_join_request(cls.ride, rider)[0] for rider in cls.riders]
+
+    def assert_counts(self, pending, accepted):
+        self.ride.refresh_from_db()
+        self.assertEqual((self.ride.pending_request_count, self.ride.accepted_count), (pending, accepted))
+        self.assertEqual(reconcile_counters(), {'checked': 1, 'repaired': 0})
+
+    def test_writes_keep_counters_in_step(self):
+        self.assert_counts(4, 0)
+        accept_join_request(self.requests[0])
+        self.assert_counts(3, 1)
+        reject_join_request(self.requests[1])
+        self.assert_counts(2, 1)
+        bulk_process_join_requests(self.ride.id, [
+            {'req_id': self.requests[2].id, 'action': 'accept'},
+            {'req_id': self.requests[3].id, 'action': 'reject'},
+        ])
+        self.assert_counts(0, 2)
+        self.ride.participants.remove(self.riders[0])
+        self.assert_counts(0, 1)
+        self.riders[2].rides_joined.clear()
+        self.assert_counts(0, 0)
+
+    def test_removing_non_members_changes_nothing(self):
+        accept_join_request(self.requests[0])
+        accept_join_request(self.requests[1])
+        self.ride.participants.remove(self.riders[0], self.riders[2])
+        self.assert_counts(2, 1)
+        self.ride.participants.remove(self.riders[2])
+        self.riders[3].rides_joined.remove(self.ride)
+        self.assert_counts(2, 1)
+
+    def test_deletes_and_lifecycle(self):
+        self.requests[0].delete()
+        self.assert_counts(3, 0)
+        accept_join_request(self.requests[1])
+        self.riders[1].delete()
+        self.assert_counts(2, 0)
+        Ride.objects.filter(pk=self.ride.pk).update(departure_datetime=timezone.now() - timedelta(minutes=1))
+        advance_ride_statuses()
+        self.assert_counts(0, 0)
+
+    def test_listing_shows_counts(self):
+        accept_join_request(self.requests[0])
+        data = APIClient().get(reverse('fetch-rides')).data
+        self.assertEqual((data[0]['pending_request_count'], data[0]['accepted_count']), (3, 1))
+
+    def test_reconcile_repairs_drift(self):
+        Ride.objects.filter(pk=self.ride.pk).update(pending_request_count=9, accepted_count=5)
+        self.ride.participants.add(self.riders[0])
+        self.assertEqual(reconcile_counters(batch_size=1), {'checked': 1, 'repaired': 1})
+        self.assert_counts(4, 1)
+
+
+class ConditionalGetTests(RideTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ride = make_ride(cls.owner)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.rider)
+
+    def revalidate(self, url):
+        """(first response, status of the conditional request that follows it)."""
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        self.assertIn('Authorization', first['Vary'])
+        return first, self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code
+
+    def test_unchanged_resources_are_not_modified(self):
+        for url in (reverse('fetch-rides'), reverse('fetch-rides') + '?limit=1',
+                    reverse('fetch-rides') + '?near_pickup=12.97,77.59', reverse('ride-details', args=[self.ride.id])):
+            self.assertEqual(self.revalidate(url)[1], 304, url)
+
+    def test_cached_listing_revalidates_without_queries(self):
+        first, _ = self.revalidate(reverse('fetch-rides'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('fetch-rides'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_etag_is_per_user(self):
+        first, _ = self.revalidate(reverse('ride-details', args=[self.ride.id]))
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(reverse('ride-details', args=[self.ride.id]), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def assert_changed_by(self, write):
+        urls = [reverse('fetch-rides'), reverse('ride-details', args=[self.ride.id])]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200, url)
+
+    def test_join_request_changes_etag(self):
+        self.assert_changed_by(lambda: self.client.post(reverse('ride-join-request', args=[self.ride.id])))
+
+    def test_accept_changes_etag(self):
+        join_request = RideJoinRequest.objects.create(ride=self.ride, user=self.rider)
+        self.assert_changed_by(lambda: accept_join_request(join_request))
+
+    def test_ride_save_changes_etag(self):
+        self.ride.total_cost = 200
+        self.assert_changed_by(lambda: self.ride.save(update_fields=['total_cost']))
+
+    def test_evicted_version_never_matches(self):
+        first = self.client.get(reverse('ride-details', args=[self.ride.id]))
+        clear_caches()
+        response = self.client.get(reverse('ride-details', args=[self.ride.id]), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+class StampedeProtectionTests(SimpleTestCase):
+    def setUp(self):
+        clear_caches()
+        self.rebuilds = 0
+
+    def slow_rebuild(self):
+        self.rebuilds += 1
+        time.sleep(0.2)
+        return self.rebuilds
+
+    def hammer(self, threads=20):
+        results = []
+        workers = [
+            threading.Thread(target=lambda: results.append(get_or_rebuild('hot', self.slow_rebuild, 60)))
+            for _ in range(threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def test_cold_key_is_rebuilt_once(self):
+        results = self.hammer()
+        self.assertEqual(self.rebuilds, 1)
+        self.assertEqual(results, [1] * 20)
+
+    def test_expired_key_serves_stale_while_one_worker_rebuilds(self):
+        get_or_rebuild('hot', lambda: 'stale', 60)
+        with mock.patch('rides.cache.time.time', return_value=time.time() + 61):
+            results = self.hammer()
+        self.assertEqual(self.rebuilds, 1)
+        self.assertEqual(results.count('stale'), 19)
+        self.assertIn(1, results)
+
+    def test_fresh_key_is_not_rebuilt(self):
+        get_or_rebuild('hot', lambda: 'fresh', 60)
+        self.hammer()
+        self.assertEqual(self.rebuilds, 0)
+
+    def test_overrunning_rebuild_keeps_the_next_lock(self):
+        def slow_rebuild():
+            # The lock expired and another worker took it
+            cache.set('hot:lock', 'other', 30)
+            return 'value'
+
+        get_or_rebuild('hot', slow_rebuild, 60)
+        self.assertEqual(cache.get('hot:lock'), 'other')
+
+    def test_redis_rebuild_lock_is_released_by_compare_and_delete(self):
+        lock = mock.Mock()
+        lock.acquire.return_value = True
+        with mock.patch.object(rides_cache, 'uses_redis', return_value=True), \
+                mock.patch.object(cache, 'lock', create=True, return_value=lock) as take:
+            self.assertEqual(get_or_rebuild('hot', lambda: 'value', 60), 'value')
+        take.assert_called_once_with('hot:lock', timeout=rides_cache.REBUILD_LOCK_TIMEOUT)
+        lock.release.assert_called_once_with()
+
+    def test_rebuild_racing_an_invalidation_is_not_served(self):
+        def rebuild_then_invalidate():
+            # The page changes and its invalidation (on commit, see invalidate_rides) runs
+            # after the rebuild read it
+            tiered_cache.delete_many([UPCOMING_PAGE_KEY, generation_key(UPCOMING_PAGE_KEY)])
+            return 'old'
+
+        get_or_rebuild(UPCOMING_PAGE_KEY, rebuild_then_invalidate, 60)
+        self.assertEqual(get_or_rebuild(UPCOMING_PAGE_KEY, lambda: 'new', 60), 'new')
+
+
+class AsyncCacheTests(SimpleTestCase):
+    @override_settings(CACHES={'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+        'OPTIONS': {'PASSWORD': 'secret', 'SOCKET_TIMEOUT': 2, 'CONNECTION_POOL_KWARGS': {'max_connections': 7}},
+    }})
+    def test_redis_client_follows_options_and_closes_with_its_loop(self):
+        async_cache = AsyncCache('redis')
+
+        async def connect():
+            connection, _ = await async_cache._redis()
+            self.assertIs((await async_cache._redis())[0], connection)
+            return connection
+
+        with mock.patch.object(aioredis.Redis, 'aclose', autospec=True) as aclose:
+            connection = asyncio.run(connect())
+            aclose.assert_called_once_with(connection)
+        pool = connection.connection_pool
+        self.assertEqual(pool.max_connections, 7)
+        self.assertEqual(
+            (pool.connection_kwargs['password'], pool.connection_kwargs['socket_timeout']), ('secret', 2)
+        )
+        # Another loop gets its own client
+        self.assertIsNot(asyncio.run(connect()), connection)
+
+
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.bus = InMemoryInvalidationBus()
+        self.workers = [TieredCache(local=LocalCache(), bus=self.bus) for _ in range(2)]
+
+    def test_local_hits_skip_the_backend(self):
+        worker = self.workers[0]
+        worker.set('k', 'v', 60)
+        self.assertEqual(worker.get('k'), 'v')
+        with mock.patch.object(worker.backend, 'get_many', side_effect=AssertionError):
+            self.assertEqual(worker.get('k'), 'v')
+        self.assertEqual(worker.stats()['hits'], 1)
+
+    def test_writes_invalidate_every_worker(self):
+        first, second = self.workers
+        first.set('k', 1, 60)
+        self.assertEqual(second.get('k'), 1)
+        first.set('k', 2, 60)
+        self.assertEqual(second.get('k'), 2)
+        first.delete('k')
+        self.assertIsNone(second.get('k'))
+        self.assertEqual(second.stats()['invalidations'], 2)
+
+    def test_fills_are_not_published(self):
+        first, second = self.workers
+        self.assertIsNone(second.get('k'))
+        with mock.patch.object(self.bus, 'publish', side_effect=AssertionError):
+            first.fill_many({'k': 1}, 60)
+        with mock.patch.object(first.backend, 'get_many', side_effect=AssertionError):
+            self.assertEqual(first.get('k'), 1)
+        self.assertEqual(second.get('k'), 1)
+
+    def test_fill_racing_an_invalidation_is_discarded(self):
+        local = LocalCache()
+        generations = local.generations(['k', 'other'])
+        local.invalidate(['k'])
+        local.fill({'k': 'old', 'other': 'kept'}, generations)
+        self.assertEqual(local.get_many(['k', 'other']), {'other': 'kept'})
+        self.assertEqual(local.stats()['discarded_fills'], 1)
+
+        generations = local.generations(['other'])
+        local.clear()
+        local.fill({'other': 'old'}, generations)
+        self.assertEqual(local.get_many(['other']), {})
+
+    def test_evicts_least_recently_used_within_limits(self):
+        local = LocalCache(max_entries=2)
+        local.fill({'a': 1, 'b': 2}, local.generations(['a', 'b']))
+        local.get_many(['a'])
+        local.fill({'c': 3}, local.generations(['c']))
+        self.assertEqual(local.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+
+        local = LocalCache(max_bytes=1000)
+        local.fill({'a': 'x' * 400, 'b': 'x' * 400}, local.generations(['a', 'b']))
+        local.fill({'c': 'x' * 400}, local.generations(['c']))
+        self.assertEqual(set(local.get_many(['a', 'b', 'c'])), {'b', 'c'})
+        self.assertLessEqual(local.stats()['bytes'], 1000)
+        self.assertEqual(local.stats()['evictions'], 1)
+
+    def test_entries_expire(self):
+        local = LocalCache(ttl=10)
+        local.fill({'k': 'v'}, local.generations(['k']))
+        with mock.patch('core.tiered_cache.time.monotonic', return_value=time.monotonic() + 11):
+            self.assertEqual(local.get_many(['k']), {})
+        self.assertEqual(local.stats()['expirations'], 1)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], PRIMARY_STICKINESS_SECONDS=5)
+class ReplicaRoutingTests(TransactionTestCase):
+    # Not TestCase: its wrapping transaction would keep every read on the primary
+    def setUp(self):
+        clear_caches()
+        self.router = PrimaryReplicaRouter()
+        self.users = [User.objects.create_user(f'90000000{i:02}', f'User {i}', 'pass') for i in range(2)]
+
+    def route(self, method='get', user=None, write=False, atomic=False):
+        """Where a request's reads go: before and after it writes (if it does)."""
+        seen = {}
+
+        def view(request):
+            with transaction.atomic() if atomic else nullcontext():
+                seen['read'] = self.router.db_for_read(Ride)
+            if write:
+                self.router.db_for_write(Ride)
+                seen['after_write'] = self.router.db_for_read(Ride)
+            return HttpResponse()
+
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'} if user else {}
+        ReplicaRoutingMiddleware(view)(getattr(RequestFactory(), method)('/', **headers))
+        return seen
+
+    def test_safe_requests_read_from_replica(self):
+        self.assertEqual(self.route()['read'], 'replica')
+        self.assertEqual(self.route('post')['read'], 'default')
+        self.assertEqual(self.route(atomic=True)['read'], 'default')
+        self.assertEqual(self.router.db_for_read(Ride), 'default')  # outside a request
+
+    def test_writer_reads_own_writes(self):
+        self.assertEqual(self.route('post', self.users[0], write=True)['after_write'], 'default')
+        self.assertEqual(self.route(user=self.users[0])['read'], 'default')
+        self.assertEqual(self.route(user=self.users[1])['read'], 'replica')
+        self.assertEqual(self.route()['read'], 'replica')
+
+        # The pin lapses after the stickiness window
+        cache.delete(primary_pin_key(self.users[0].id))
+        self.assertEqual(self.route(user=self.users[0])['read'], 'replica')
+
+    def test_reads_stay_on_primary_without_replicas(self):
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.route()['read'], 'default')
+            self.route('post', self.users[0], write=True)
+        self.assertIsNone(cache.get(primary_pin_key(self.users[0].id)))
+
+    def test_replicas_are_not_migrated(self):
+        self.assertTrue(self.router.allow_migrate('default', 'rides'))
+        self.assertFalse(self.router.allow_migrate('replica', 'rides'))
+
+    def test_cache_fills_read_from_primary(self):
+        # The replica lags behind everything: any read that reaches it fails
+        ride = make_ride(self.users[0])
+        view = ReplicaRoutingMiddleware(GetUpcomingRidesView.as_view())
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {ClaimsRefreshToken.for_user(self.users[1]).access_token}'}
+        response = view(RequestFactory().get(reverse('fetch-rides'), **headers))
+        self.assertEqual([item['id'] for item in response.data], [ride.id])
+        self.assertEqual(user_state(self.users[1].id), ACTIVE)
+
+        with self.assertRaises(ConnectionDoesNotExist):
+            view(RequestFactory().get(reverse('fetch-rides'), {'limit': 5}))
+        # Served from what the first request cached
+        self.assertEqual(view(RequestFactory().get(reverse('fetch-rides'))).data[0]['id'], ride.id)
+
+    def test_sync_reads_from_primary(self):
+        # Its token is stamped with the primary's time, which a lagging replica may be behind
+        ride = make_ride(self.users[0])
+        view = ReplicaRoutingMiddleware(RideSyncView.as_view())
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {ClaimsRefreshToken.for_user(self.users[0]).access_token}'}
+        response = view(RequestFactory().get(reverse('ride-sync'), **headers))
+        self.assertEqual([item['id'] for item in response.data['rides']], [ride.id])
+
+
+class SeatReservationTests(RideTestCase):
+    RIDERS = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ride = make_ride(cls.owner, total_seats=2)  # one seat left for riders
+        cls.requests = [RideJoinRequest.objects.create(ride=cls.ride, user=u) for u in cls.riders]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.owner)
+
+    def manage(self, join_request, action):
+        return self.client.put(reverse('manage-ride-request', args=[self.ride.id, join_request.id, action]))
+
+    def test_accept_beyond_capacity_is_rolled_back(self):
+        self.assertEqual(self.manage(self.requests[0], 'accept').status_code, 200)
+        response = self.manage(self.requests[1], 'accept')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'No seats available')
+
+        self.requests[1].refresh_from_db()
+        self.ride.refresh_from_db()
+        self.assertEqual(self.requests[1].status, RideJoinRequest.RequestStatus.PENDING)
+        self.assertEqual(self.ride.seats_available, 0)
+        self.assertEqual(list(self.ride.participants.all()), [self.riders[0]])
+
+    def test_request_cannot_be_processed_twice(self):
+        accept_join_request(self.requests[0])
+        with self.assertRaises(RequestAlreadyProcessed):
+            accept_join_request(RideJoinRequest.objects.get(pk=self.requests[0].pk))
+        self.assertEqual(self.manage(self.requests[0], 'reject').status_code, 400)
+
+
+class SeatReservationStressTests(TransactionTestCase):
+    THREADS = 16
+    SEATS = 5
+
+    def test_concurrent_accepts_never_oversell(self):
+        owner = User.objects.create_user('9000000001', 'Owner', 'pass')
+        ride = make_ride(owner, total_seats=self.SEATS + 1)
+        join_requests = [
+            RideJoinRequest.objects.create(
+                ride=ride, user=User.objects.create_user(f'91{i:08}', f'Rider {i}', 'pass')
+            )
+            for i in range(self.THREADS * 2)
+        ]
+
+        outcomes = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker(batch):
+            barrier.wait()
+            try:
+                for join_request in batch:
+                    while True:
+                        try:
+                            accept_join_request(join_request)
+                            outcomes.append('accepted')
+                        except NoSeatsAvailable:
+                            outcomes.append('full')
+                        except OperationalError:
+                            # SQLite reports lock contention instead of blocking; retry
+                            continue
+                        break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(join_requests[i::self.THREADS],))
+                   for i in range(self.THREADS)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        ride.refresh_from_db()
+        self.assertEqual(outcomes.count('accepted'), self.SEATS)
+        self.assertEqual(outcomes.count('full'), len(join_requests) - self.SEATS)
+        self.assertEqual(ride.seats_available, 0)
+        self.assertEqual(ride.participants.count(), self.SEATS)
+        self.assertEqual(
+            RideJoinRequest.objects.filter(ride=ride, status=RideJoinRequest.RequestStatus.ACCEPTED).count(),
+            self.SEATS
+        )
+        logger.info(
+            "seat reservation: %d accept attempts from %d threads on one ride in %.3fs (%.0f ops/s)",
+            len(outcomes), self.THREADS, elapsed, len(outcomes) / elapsed
+        )
+
+
+class BulkManageJoinRequestsTests(RideTestCase):
+    RIDERS = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ride = make_ride(cls.owner, total_seats=3)  # two seats for riders
+        cls.requests = [RideJoinRequest.objects.create(ride=cls.ride, user=rider) for rider in cls.riders]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.owner)
+        self.url = reverse('bulk-manage-ride-requests', args=[self.ride.id])
+
+    def test_bulk_respects_seat_limit_and_reports_each_item(self):
+        actions = [{'req_id': r.id, 'action': 'accept'} for r in self.requests[:3]]
+        actions += [{'req_id': self.requests[3].id, 'action': 'reject'}, {'req_id': 999999, 'action': 'accept'}]
+
+        response = self.client.post(self.url, {'actions': actions}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['success'] for r in response.data['results']], [True, True, False, True, False])
+        self.assertEqual(response.data['results'][2]['error'], 'No seats available')
+        self.assertEqual(response.data['seats_available'], 0)
+
+        self.ride.refresh_from_db()
+        self.assertEqual(self.ride.seats_available, 0)
+        self.assertEqual(self.ride.participants.count(), 2)
+        statuses = [RideJoinRequest.objects.get(pk=r.pk).status for r in self.requests]
+        self.assertEqual(statuses, ['ACCEPTED', 'ACCEPTED', 'PENDING', 'REJECTED', 'PENDING'])
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        def count_queries(batch):
+            actions = [{'req_id': r.id, 'action': 'reject'} for r in batch[:-1]]
+            actions.append({'req_id': batch[-1].id, 'action': 'accept'})
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(self.url, {'actions': actions}, format='json')
+            return len(queries)
+
+        self.assertEqual(count_queries(self.requests[:2]), count_queries(self.requests[2:]))
+
+    def test_only_owner(self):
+        self.client.force_authenticate(self.requests[0].user)
+        response = self.client.post(self.url, {'actions': [{'req_id': 1, 'action': 'accept'}]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_payload(self):
+        response = self.client.post(self.url, {'actions': [{'req_id': 1, 'action': 'maybe'}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class RouteMatchingTests(RideTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.departure = timezone.now() + timedelta(hours=3)
+        origin, destination = (12.9716, 77.5946), (12.9352, 77.6245)
+        cls.exact = make_ride(cls.owner, pickup=origin, destination=destination,
+                              departure_datetime=cls.departure)
+        cls.later = make_ride(cls.owner, pickup=origin, destination=destination,
+                              departure_datetime=cls.departure + timedelta(minutes=50))
+        cls.detour = make_ride(cls.owner, pickup=(12.9800, 77.5946), destination=destination,
+                               departure_datetime=cls.departure)
+        make_ride(cls.owner, pickup=origin, destination=(13.0827, 80.2707), departure_datetime=cls.departure)
+        make_ride(cls.owner, pickup=origin, destination=destination,
+                  departure_datetime=cls.departure + timedelta(hours=5))
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.rider)
+        self.params = {
+            'origin': '12.9716,77.5946', 'destination': '12.9352,77.6245',
+            'departure': self.departure.isoformat(),
+        }
+
+    def test_ranks_by_detour_and_time(self):
+        response = self.client.get(reverse('match-rides'), self.params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['id'] for r in response.data], [self.exact.id, self.detour.id, self.later.id])
+        self.assertEqual(response.data[0]['match']['pickup_distance_km'], 0)
+        self.assertAlmostEqual(response.data[1]['match']['pickup_distance_km'], 0.93, delta=0.05)
+
+    def test_ride_deleted_after_matching(self):
+        clear_caches()
+
+        def match_then_delete(*args, **kwargs):
+            matches = match_rides(*args, **kwargs)
+            Ride.objects.filter(pk=self.exact.pk).delete()
+            return matches
+
+        with mock.patch('rides.views.match_rides', side_effect=match_then_delete):
+            response = self.client.get(reverse('match-rides'), self.params)
+        self.assertEqual([r['id'] for r in response.data], [self.detour.id, self.later.id])
+        self.assertAlmostEqual(response.data[0]['match']['pickup_distance_km'], 0.93, delta=0.05)
+        self.assertEqual(response.data[1]['match']['pickup_distance_km'], 0)
+
+    def test_top_k(self):
+        response = self.client.get(reverse('match-rides'), dict(self.params, k=1))
+        self.assertEqual([r['id'] for r in response.data], [self.exact.id])
+
+    def test_own_rides_excluded(self):
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.client.get(reverse('match-rides'), self.params).data, [])
+
+    def test_origin_required(self):
+        response = self.client.get(reverse('match-rides'), {'destination': '1,1'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RideLifecycleTests(RideTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        cls.future = make_ride(cls.owner, departure_datetime=now + timedelta(hours=1))
+        cls.departed = make_ride(cls.owner, departure_datetime=now - timedelta(minutes=10))
+        cls.finished = make_ride(cls.owner, departure_datetime=now - timedelta(hours=3))
+        cls.aborted = make_ride(cls.owner, departure_datetime=now - timedelta(hours=3),
+                                status=Ride.RideStatus.ABORTED)
+        cls.pending = RideJoinRequest.objects.create(ride=cls.departed, user=cls.rider)
+        cls.waiting = RideJoinRequest.objects.create(ride=cls.future, user=cls.rider)
+
+    def statuses(self):
+        return dict(Ride.objects.values_list('id', 'status'))
+
+    def test_advances_in_batches(self):
+        counts = advance_ride_statuses(batch_size=1)
+        self.assertEqual(counts, {'started': 2, 'completed': 1, 'rejected_requests': 1})
+        self.assertEqual(self.statuses(), {
+            self.future.id: Ride.RideStatus.UPCOMING,
+            self.departed.id: Ride.RideStatus.ONGOING,
+            self.finished.id: Ride.RideStatus.COMPLETED,
+            self.aborted.id: Ride.RideStatus.ABORTED,
+        })
+        self.pending.refresh_from_db()
+        self.waiting.refresh_from_db()
+        self.assertEqual(self.pending.status, RideJoinRequest.RequestStatus.REJECTED)
+        self.assertEqual(self.waiting.status, RideJoinRequest.RequestStatus.PENDING)
+
+        self.assertEqual(advance_ride_statuses(), {'started': 0, 'completed': 0, 'rejected_requests': 0})
+
+    def test_departed_rides_leave_cached_listing(self):
+        client = APIClient()
+        client.force_authenticate(self.rider)
+        with self.captureOnCommitCallbacks(execute=True):
+            clear_caches()
+            self.assertEqual(len(client.get(reverse('fetch-rides')).data), 3)
+            advance_ride_statuses()
+        self.assertEqual([r['id'] for r in client.get(reverse('fetch-rides')).data], [self.future.id])
+
+
+class ArchiveTests(RideTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        now = timezone.now()
+        cls.old = [
+            make_ride(cls.owner, departure_datetime=now - timedelta(days=40 + i), status=status)
+            for i, status in enumerate([Ride.RideStatus.COMPLETED, Ride.RideStatus.ABORTED, Ride.RideStatus.COMPLETED])
+        ]
+        cls.old[0].participants.add(cls.rider)
+        RideJoinRequest.objects.create(ride=cls.old[0], user=cls.rider, status=RideJoinRequest.RequestStatus.ACCEPTED)
+        cls.recent = make_ride(cls.owner, departure_datetime=now - timedelta(days=2), status=Ride.RideStatus.COMPLETED)
+        cls.upcoming = make_ride(cls.owner)
+
+    def test_moves_old_finished_rides(self):
+        archived = archive_rides(older_than=timedelta(days=30), batch_size=2)
+        self.assertEqual(archived, {'rides': 3, 'join_requests': 1})
+        self.assertEqual(set(Ride.objects.values_list('id', flat=True)), {self.recent.id, self.upcoming.id})
+        self.assertFalse(RideJoinRequest.objects.exists())
+
+        cold = ArchivedRide.objects.get(id=self.old[0].id)
+        self.assertEqual(cold.owner, self.owner)
+        self.assertEqual(cold.cost_per_seat, self.old[0].cost_per_seat)
+        self.assertEqual(list(cold.participants.all()), [self.rider])
+        self.assertEqual(cold.join_requests.get().status, RideJoinRequest.RequestStatus.ACCEPTED)
+
+        self.assertEqual(archive_rides(older_than=timedelta(days=30)), {'rides': 0, 'join_requests': 0})
+
+    def test_history_is_paginated_for_owner_and_participant(self):
+        archive_rides(older_than=timedelta(days=30))
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(reverse('ride-history'), {'limit': 2})
+        self.assertEqual([r['id'] for r in response.data], [self.old[0].id, self.old[1].id])
+        self.assertTrue(response.data[0]['is_user_owner'])
+        response = self.client.get(reverse('ride-history'), {'cursor': response['X-Next-Cursor']})
+        self.assertEqual([r['id'] for r in response.data], [self.old[2].id])
+        self.assertNotIn('X-Next-Cursor', response)
+
+        self.client.force_authenticate(self.rider)
+        response = self.client.get(reverse('ride-history'))
+        self.assertEqual([r['id'] for r in response.data], [self.old[0].id])
+        self.assertEqual(response.data[0]['participants'][0]['id'], self.rider.id)
+
+    def test_request_history_keeps_every_status(self):
+        rejected = RideJoinRequest.objects.create(
+            ride=self.old[1], user=self.rider, status=RideJoinRequest.RequestStatus.REJECTED
+        )
+        pending = RideJoinRequest.objects.create(ride=self.old[2], user=self.rider)
+        archive_rides(older_than=timedelta(days=30))
+
+        self.client.force_authenticate(self.rider)
+        response = self.client.get(reverse('ride-request-history'), {'limit': 2})
+        self.assertEqual([(r['id'], r['status']) for r in response.data], [
+            (pending.id, RideJoinRequest.RequestStatus.PENDING),
+            (rejected.id, RideJoinRequest.RequestStatus.REJECTED),
+        ])
+        self.assertEqual(response.data[0]['ride']['id'], self.old[2].id)
+        self.assertFalse(response.data[0]['ride']['is_user_owner'])
+        response = self.client.get(reverse('ride-request-history'), {'cursor': response['X-Next-Cursor']})
+        self.assertEqual([r['ride']['id'] for r in response.data], [self.old[0].id])
+
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.client.get(reverse('ride-request-history')).data, [])
+
+
+class RideSyncTests(RideTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ride = make_ride(cls.owner)
+        cls.other = make_ride(cls.owner)
+        cls.join_request = RideJoinRequest.objects.create(ride=cls.ride, user=cls.rider)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.rider)
+
+    def sync(self, since=None):
+        response = self.client.get(reverse('ride-sync'), {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def token_after_overlap(self):
+        """A token old enough that the overlap no longer covers the setUp writes."""
+        return encode_token(timezone.now() + SYNC_OVERLAP)
+
+    def test_first_sync_returns_everything(self):
+        data = self.sync()
+        self.assertEqual([r['id'] for r in data['rides']], [self.ride.id])
+        self.assertEqual([(r['id'], r['status']) for r in data['join_requests']],
+                         [(self.join_request.id, RideJoinRequest.RequestStatus.PENDING)])
+        self.assertEqual(data['deleted'], {'rides': [], 'join_requests': []})
+
+        self.client.force_authenticate(self.owner)
+        self.assertEqual([r['id'] for r in self.sync()['rides']], [self.ride.id, self.other.id])
+
+    def test_only_changes_since_token(self):
+        token = self.token_after_overlap()
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + SYNC_OVERLAP * 2):
+            self.assertEqual(self.sync(token)['rides'], [])
+            with self.captureOnCommitCallbacks(execute=True):
+                accept_join_request(self.join_request)
+            data = self.sync(token)
+        self.assertEqual([(r['id'], r['seats_available']) for r in data['rides']],
+                         [(self.ride.id, self.ride.seats_available - 1)])
+        self.assertEqual([r['status'] for r in data['join_requests']], [RideJoinRequest.RequestStatus.ACCEPTED])
+
+    def test_deleted_and_archived_rides_leave_tombstones(self):
+        token = self.token_after_overlap()
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + SYNC_OVERLAP * 2):
+            ride_id = self.ride.id
+            self.ride.delete()
+            data = self.sync(token)
+            self.assertEqual(data['deleted'], {'rides': [ride_id], 'join_requests': [self.join_request.id]})
+            self.assertEqual(data['rides'], [])
+
+            old = make_ride(self.owner, status=Ride.RideStatus.COMPLETED,
+                            departure_datetime=timezone.now() - timedelta(days=60))
+            old_request = RideJoinRequest.objects.create(ride=old, user=self.rider)
+            archive_rides()
+            data = self.sync(token)
+        self.assertEqual(data['deleted'], {'rides': sorted([ride_id, old.id]),
+                                           'join_requests': sorted([self.join_request.id, old_request.id])})
+        self.assertEqual(SyncTombstone.objects.filter(user=self.owner, object_id=old.id).count(), 1)
+
+    def test_invalid_and_expired_tokens(self):
+        response = self.client.get(reverse('ride-sync'), {'since': 'bad'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('ride-sync'), {
+            'since': encode_token(timezone.now() - TOMBSTONE_RETENTION - timedelta(days=1))
+        })
+        self.assertEqual(response.status_code, 410)
+
+    def test_prune_tombstones(self):
+        self.ride.delete()
+        self.assertEqual(prune_tombstones(now=timezone.now() + TOMBSTONE_RETENTION + timedelta(days=1)), 3)
+        self.assertFalse(SyncTombstone.objects.exists())
+
+    def test_deleted_users_leave_no_tombstones(self):
+        self.rider.delete()
+        self.assertFalse(SyncTombstone.objects.exists())
+
+        other_rider = User.objects.create_user('9000009999', 'Other rider', 'pass')
+        RideJoinRequest.objects.create(ride=self.other, user=other_rider)
+        self.owner.delete()
+        self.assertEqual(set(SyncTombstone.objects.values_list('user_id', 'kind')),
+                         {(other_rider.id, SyncTombstone.Kind.RIDE), (other_rider.id, SyncTombstone.Kind.JOIN_REQUEST)})
+
+
+class AsyncReadViewTests(RideTestCase):
+    """The async views routed in urls.py answer exactly like the sync views."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.rides = [make_ride(cls.owner, departure_datetime=timezone.now() + timedelta(hours=i + 1))
+                     for i in range(3)]
+        cls.rides[0].participants.add(cls.rider)
+        RideJoinRequest.objects.create(ride=cls.rides[0], user=cls.rider, status=RideJoinRequest.RequestStatus.ACCEPTED)
+        RideJoinRequest.objects.create(ride=cls.rides[1], user=cls.rider)
+
+    def assert_same(self, url_name, sync_view, user, args=(), params=None):
+        clear_caches()
+        self.client.force_authenticate(user)
+        async_response = self.client.get(reverse(url_name, args=args), params)
+
+        clear_caches()
+        request = APIRequestFactory().get(reverse(url_name, args=args), params)
+        if user is not None:
+            force_authenticate(request, user)
+        sync_response = sync_view.as_view()(request, *args).render()
+
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.content, sync_response.content)
+        for header in ('X-Next-Cursor', 'X-Next-Cursor-Created', 'X-Next-Cursor-Accepted'):
+            self.assertEqual(async_response.get(header), sync_response.get(header))
+
+    def test_responses_match_sync_views(self):
+        for user in (self.owner, self.rider):
+            self.assert_same('fetch-rides', GetUpcomingRidesView, user)
+            self.assert_same('fetch-rides', GetUpcomingRidesView, user, params={'limit': 2})
+            self.assert_same('fetch-rides', GetUpcomingRidesView, user, params={'near_pickup': '12.97,77.59'})
+            self.assert_same('ride-details', GetRideDetail, user, args=(self.rides[0].id,))
+            self.assert_same('user-rides', GetUserRides, user, params={'limit': 1})
+            self.assert_same('get-created-requests', MyRideJoinRequestsView, user, params={'limit': 1})
+        self.assert_same('fetch-rides', GetUpcomingRidesView, None)
+        self.assert_same('ride-details', GetRideDetail, None, args=(0,))
+        self.assert_same('user-rides', GetUserRides, None)
+        self.assert_same('fetch-rides', GetUpcomingRidesView, self.rider, params={'cursor': 'bad'})
+
+    def test_jwt_authentication(self):
+        token = AccessToken.for_user(self.rider)
+        response = self.client.get(reverse('user-rides'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['id'] for r in response.data['accepted_rides']], [self.rides[0].id])
+
+        response = self.client.get(reverse('user-rides'), HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_not_valid')
+
+
+class RideEventsTests(RideTestCase):
+    RIDERS = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ride = make_ride(cls.owner, total_seats=2)  # one seat left for riders
+        cls.requests = [RideJoinRequest.objects.create(ride=cls.ride, user=u) for u in cls.riders]
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def subscribe(self, *groups):
+        subscription = channel_layer.subscribe(groups, loop=self.loop)
+        self.addCleanup(subscription.close)
+        return subscription
+
+    def received(self, subscription):
+        # Run the deliveries scheduled with call_soon_threadsafe
+        self.loop.run_until_complete(asyncio.sleep(0))
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+        return events
+
+    def test_accept_notifies_requester_and_ride(self):
+        rider, ride_watcher = self.subscribe(user_group(self.riders[0].id)), self.subscribe(ride_group(self.ride.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            accept_join_request(self.requests[0])
+        self.assertEqual(self.received(rider), [{
+            'type': 'join_request.status', 'ride_id': self.ride.id,
+            'request_id': self.requests[0].id, 'status': 'ACCEPTED',
+        }])
+        self.assertEqual(self.received(ride_watcher), [
+            {'type': 'ride.seats', 'ride_id': self.ride.id, 'seats_available': 0},
+        ])
+
+    def test_rolled_back_accept_publishes_nothing(self):
+        accept_join_request(self.requests[0])
+        subscription = self.subscribe(user_group(self.riders[1].id), ride_group(self.ride.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(NoSeatsAvailable):
+                accept_join_request(self.requests[1])
+        self.assertEqual(self.received(subscription), [])
+
+    def test_new_request_notifies_owner(self):
+        owner = self.subscribe(user_group(self.owner.id))
+        rider = User.objects.create_user('9000000200', 'Late Rider', 'pass')
+        client = APIClient()
+        client.force_authenticate(rider)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('ride-join-request', args=[self.ride.id]))
+        self.assertEqual(self.received(owner), [{
+            'type': 'join_request.created', 'ride_id': self.ride.id,
+            'request_id': response.data['id'], 'user_id': rider.id,
+        }])
+
+    def test_slow_subscriber_gets_resync(self):
+        subscription = self.subscribe('user:slow')
+        for i in range(SUBSCRIBER_QUEUE_SIZE + 1):
+            channel_layer.group_send('user:slow', {'type': 'test', 'n': i})
+        self.assertEqual(self.received(subscription), [{'type': 'resync'}])
+
+    async def test_event_stream(self):
+        token = AccessToken.for_user(self.riders[0])
+        response = await self.async_client.get(
+            reverse('ride-events'), {'rides': str(self.ride.id)}, headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'event: ready\ndata: {}\n\n')
+
+        channel_layer.group_send(ride_group(self.ride.id), {'type': 'ride.seats', 'ride_id': self.ride.id,
+                                                            'seats_available': 3})
+        self.assertEqual(await anext(stream),
+                         f'event: ride.seats\ndata: {{"ride_id":{self.ride.id},"seats_available":3}}\n\n'.encode())
+        await stream.aclose()
+
+    def test_invalid_rides_parameter(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        self.assertEqual(client.get(reverse('ride-events'), {'rides': 'x'}).status_code, 400)
+
+
+class PubSubStandIn:
+    """Redis pub/sub between processes: a publisher does not get its own messages back."""
+
+    class Endpoint(InMemoryInvalidationBus):
+        def __init__(self, pubsub):
+            super().__init__()
+            self.pubsub = pubsub
+            self.on_reconnect = []
+
+        def subscribe(self, callback, on_reconnect=None):
+            super().subscribe(callback)
+            self.on_reconnect.append(on_reconnect)
+
+        def reconnect(self):
+            for callback in self.on_reconnect:
+                callback()
+
+        def publish(self, messages):
+            for endpoint in self.pubsub.endpoints:
+                if endpoint is not self:
+                    InMemoryInvalidationBus.publish(endpoint, json.loads(json.dumps(messages)))
+
+    def __init__(self):
+        self.endpoints = []
+
+    def endpoint(self):
+        self.endpoints.append(self.Endpoint(self))
+        return self.endpoints[-1]
+
+
+class RedisChannelLayerTests(SimpleTestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        pubsub = PubSubStandIn()
+        # Two web workers and the lifecycle command
+        self.workers = [RedisChannelLayer(bus=pubsub.endpoint()) for _ in range(2)]
+        self.command = RedisChannelLayer(bus=pubsub.endpoint())
+
+    def received(self, subscription):
+        self.loop.run_until_complete(asyncio.sleep(0))
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+        return events
+
+    def test_events_reach_subscribers_of_every_process_once(self):
+        first = self.workers[0].subscribe(['ride:1'], loop=self.loop)
+        second = self.workers[1].subscribe(['ride:1', 'user:2'], loop=self.loop)
+        self.command.group_send('ride:1', {'type': 'ride.status', 'ride_id': 1, 'status': 'ONGOING'})
+        self.workers[0].group_send('user:2', {'type': 'join_request.status', 'request_id': 5})
+
+        self.assertEqual(self.received(first), [{'type': 'ride.status', 'ride_id': 1, 'status': 'ONGOING'}])
+        self.assertEqual(self.received(second), [
+            {'type': 'ride.status', 'ride_id': 1, 'status': 'ONGOING'},
+            {'type': 'join_request.status', 'request_id': 5},
+        ])
+
+    def test_reconnect_resyncs_subscribers(self):
+        subscription = self.workers[0].subscribe(['ride:1'], loop=self.loop)
+        self.workers[0].bus.reconnect()
+        self.assertEqual(self.received(subscription), [{'type': 'resync'}])
+
+
+class RideExportTests(RideTestCase):
+    RIDERS = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.staff = User.objects.create_user('9000000000', 'Ops', 'pass', is_staff=True)
+        day = timezone.make_aware(timezone.datetime(2025, 3, 10, 9, 0))
+        cls.rides = [
+            make_ride(cls.owner, departure_datetime=day, status=Ride.RideStatus.COMPLETED),
+            make_ride(cls.owner, departure_datetime=day + timedelta(days=1), status=Ride.RideStatus.ABORTED),
+            make_ride(cls.owner, departure_datetime=day + timedelta(days=5), status=Ride.RideStatus.COMPLETED),
+        ]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.staff)
+
+    def export(self, **params):
+        response = self.client.get(reverse('ride-export'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.is_async)
+        return b''.join(response.streaming_content).decode()
+
+    @staticmethod
+    async def chunks(stream):
+        return [chunk async for chunk in stream]
+
+    def test_ndjson_filtered_by_date_and_status(self):
+        lines = self.export(departed_after='2025-03-10', departed_before='2025-03-11').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.rides[0].id, self.rides[1].id])
+        row = json.loads(lines[0])
+        self.assertEqual((row['status'], row['total_cost'], row['seats_available']), ('COMPLETED', '400.00', 3))
+
+        lines = self.export(status='COMPLETED').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.rides[0].id, self.rides[2].id])
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export(output='csv', status='ABORTED'))))
+        self.assertEqual(tuple(rows[0]), EXPORT_FIELDS)
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.rides[1].id)])
+
+    def test_streams_batches_of_lines(self):
+        stream = astream_export(export_querysets(), 'rides', 'csv', chunk_size=2)
+        chunks = async_to_sync(self.chunks)(stream)
+        self.assertEqual([len(chunk.splitlines()) for chunk in chunks], [1, 2, 1])
+        self.assertEqual(''.join(chunks), ''.join(stream_export(export_querysets(), 'rides', 'csv')))
+
+    async def test_asgi_streams_an_async_iterator(self):
+        token = ClaimsRefreshToken.for_user(self.staff).access_token
+        response = await self.async_client.get(
+            reverse('ride-export'), {'output': 'csv'}, headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertTrue(response.is_async)
+        chunks = await self.chunks(response.streaming_content)
+        self.assertEqual(len(b''.join(chunks).decode().splitlines()), 1 + len(self.rides))
+
+    def test_join_requests_and_archived_rows(self):
+        accepted = RideJoinRequest.objects.create(ride=self.rides[0], user=self.staff,
+                                                  status=RideJoinRequest.RequestStatus.ACCEPTED)
+        RideJoinRequest.objects.create(ride=self.rides[1], user=self.staff)
+        live_ride = make_ride(self.owner, departure_datetime=self.rides[0].departure_datetime)
+        archive_rides()
+
+        lines = self.export(departed_after='2025-03-10', departed_before='2025-03-10').splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([(row['id'], row['archived']) for row in rows],
+                         [(live_ride.id, False), (self.rides[0].id, True)])
+        self.assertEqual((rows[1]['seats_available'], rows[1]['total_cost']), (None, '400.00'))
+
+        rows = list(csv.reader(io.StringIO(self.export(kind='join_requests', output='csv', status='ACCEPTED'))))
+        self.assertEqual(tuple(rows[0]), JOIN_REQUEST_EXPORT_FIELDS)
+        self.assertEqual([(row[0], row[-1]) for row in rows[1:]], [(str(accepted.id), 'True')])
+
+    def test_staff_only_and_validated(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        self.assertEqual(client.get(reverse('ride-export')).status_code, 403)
+        for params in ({'output': 'xml'}, {'kind': 'users'}, {'status': 'LOST'},
+                       {'kind': 'join_requests', 'status': 'COMPLETED'}, {'departed_after': 'yesterday'}):
+            self.assertEqual(self.client.get(reverse('ride-export'), params).status_code, 400)
+
+    def test_command_streams_to_file(self):
+        with tempfile.NamedTemporaryFile(suffix='.csv') as output:
+            call_command('export_rides', format='csv', status=['COMPLETED'], output=output.name,
+                         chunk_size=1, stderr=io.StringIO())
+            rows = list(csv.reader(open(output.name, newline='')))
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.rides[0].id), str(self.rides[2].id)])
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        User.objects.create_user('9000000000', 'Existing', 'pass')
+        self.ride_fields = {
+            'pickup_latitude': 12.9716, 'pickup_longitude': 77.5946,
+            'destination_latitude': 12.9352, 'destination_longitude': 77.6245,
+            'total_seats': 3, 'total_cost': '100', 'departure_datetime': '2025-03-10T09:00:00Z',
+        }
+
+    def write_input(self, records):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False)
+        with handle:
+            for record in records:
+                handle.write(record if isinstance(record, str) else json.dumps(record))
+                handle.write('\n')
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def records(self, users=4):
+        return (
+            [{'type': 'user', 'phone_number': f'91000000{i:02}', 'full_name': f'New {i}', 'password': 'secret'}
+             for i in range(users)]
+            + [{'type': 'ride', 'owner': f'91000000{i:02}', **self.ride_fields} for i in range(users)]
+        )
+
+    def test_imports_and_reports_bad_rows(self):
+        path = self.write_input(self.records(2) + [
+            '{not json',
+            {'type': 'user', 'phone_number': '9000000000', 'full_name': 'Taken'},
+            {'type': 'ride', 'owner': '9999999999', **self.ride_fields},
+            {'type': 'ride', 'owner': '9100000000', **self.ride_fields, 'total_seats': 'many'},
+            {'type': 'ride', 'owner': '9100000000', **self.ride_fields, 'status': 'LOST'},
+        ])
+        with open(path) as lines:
+            totals = run_import(lines, batch_size=3, hash_workers=2)
+
+        self.assertEqual((totals['users'], totals['rides']), (2, 2))
+        self.assertEqual([number for number, _ in totals['errors']], [5, 6, 7, 8, 9])
+        self.assertEqual(totals['error_count'], 5)
+        user = User.objects.get(phone_number='9100000001')
+        self.assertTrue(user.check_password('secret'))
+
+        imported = Ride.objects.filter(owner=user).get()
+        saved = make_ride(user, pickup=(12.9716, 77.5946), destination=(12.9352, 77.6245),
+                          total_seats=3, total_cost=Decimal('100'))
+        saved.refresh_from_db()
+        for field in ('seats_available', 'cost_per_seat', 'pickup_geohash', 'destination_geohash', 'status'):
+            self.assertEqual(getattr(imported, field), getattr(saved, field), field)
+
+    def test_stored_errors_are_capped(self):
+        path = self.write_input(['{not json'] * 7)
+        with open(path) as lines, mock.patch.object(bulk_import, 'MAX_STORED_ERRORS', 4):
+            totals = run_import(lines, batch_size=3)
+        self.assertEqual([number for number, _ in totals['errors']], [1, 2, 3, 4])
+        self.assertEqual(totals['error_count'], 7)
+
+    def test_resumes_from_checkpoint(self):
+        path = self.write_input(self.records())
+
+        real_write_checkpoint = bulk_import.write_checkpoint
+        calls = []
+
+        def failing_write_checkpoint(name, lines):
+            # The third batch is written, then the connection drops before its commit
+            calls.append(lines)
+            if len(calls) == 3:
+                raise OperationalError('connection lost')
+            real_write_checkpoint(name, lines)
+
+        with open(path) as lines, mock.patch('rides.bulk_import.write_checkpoint', failing_write_checkpoint):
+            with self.assertRaises(OperationalError):
+                run_import(lines, batch_size=3, checkpoint=path)
+        self.assertEqual(bulk_import.read_checkpoint(path), 6)
+        self.assertEqual(Ride.objects.count(), 2)
+
+        with open(path) as lines:
+            totals = run_import(lines, batch_size=3, checkpoint=path, resume=True)
+        self.assertEqual((totals['lines'], totals['errors']), (8, []))
+        self.assertEqual(User.objects.filter(phone_number__startswith='91').count(), 4)
+        self.assertEqual(Ride.objects.count(), 4)
+
+    def test_command(self):
+        path = self.write_input(self.records(1))
+        stdout = io.StringIO()
+        call_command('import_campus_data', path, batch_size=10, stdout=stdout, stderr=io.StringIO())
+        self.assertIn('Imported 1 users and 1 rides', stdout.getvalue())
+
+
+class MetricsTests(RideTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        make_ride(cls.owner)
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        metrics_settings = self.settings(METRICS_DIR=self.directory, METRICS_TOKEN='scrape-token')
+        metrics_settings.enable()
+        self.addCleanup(metrics_settings.disable)
+
+    def scrape(self, **headers):
+        return self.client.get(reverse('metrics'), headers=headers)
+
+    def test_sums_the_files_of_all_workers(self):
+        labels = {'view': 'fetch-rides', 'method': 'GET'}
+        for i in range(2):
+            worker = Registry(self.directory, process_id=f'worker-{i}')
+            worker.inc('http_requests_total', {**labels, 'status': '200'}, i + 1)
+            worker.observe('http_request_duration_seconds', labels, 0.02 * (i + 1))
+            worker.flush()
+
+        text = render(*collect(self.directory))
+        self.assertIn('http_requests_total{method="GET",status="200",view="fetch-rides"} 3.0', text)
+        for le, count in (('0.01', 0), ('0.025', 1), ('0.05', 2), ('+Inf', 2)):
+            self.assertIn(f'http_request_duration_seconds_bucket{{method="GET",view="fetch-rides",le="{le}"}} '
+                          f'{float(count)}', text)
+        self.assertIn('http_request_duration_seconds_count{method="GET",view="fetch-rides"} 2.0', text)
+
+    def test_scrape_reports_requests_cache_and_auth(self):
+        token = ClaimsRefreshToken.for_user(self.rider).access_token
+        for _ in range(2):
+            self.client.get(reverse('fetch-rides'), HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        response = self.scrape(Authorization='Bearer scrape-token')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        for sample in (
+            r'http_requests_total\{method="GET",status="200",view="fetch-rides"\} [1-9]',
+            r'http_request_duration_seconds_count\{method="GET",view="fetch-rides"\} [1-9]',
+            r'db_queries_total\{view="fetch-rides"\} [1-9]',
+            r'cache_requests_total\{cache="upcoming_rides",result="hit"\} [1-9]',
+            r'cache_requests_total\{cache="upcoming_rides",result="miss"\} [1-9]',
+            r'jwt_auth_lookups_total\{source="state_cache"\} [1-9]',
+            r'local_cache_events_total\{event="hits"\} [1-9]',
+        ):
+            self.assertRegex(text, sample)
+
+    def test_scrapes_need_the_token_or_staff(self):
+        self.assertEqual(self.scrape().status_code, 403)
+        self.assertEqual(self.scrape(Authorization='Bearer wrong').status_code, 403)
+        self.client.force_login(self.rider)
+        self.assertEqual(self.scrape().status_code, 403)
+        self.client.force_login(User.objects.create_user('9000000000', 'Ops', 'pass', is_staff=True))
+        self.assertEqual(self.scrape().status_code, 200)
+
+    def test_first_flush_removes_finished_runs(self):
+        finished = subprocess.Popen([sys.executable, '-c', ''], start_new_session=True)
+        finished.wait()
+        stale = Registry(self.directory, process_id='stale')
+        stale.inc('http_requests_total', {'view': 'fetch-rides', 'method': 'GET', 'status': '200'})
+        with mock.patch('os.getpgrp', return_value=finished.pid):
+            stale.flush()
+        self.assertTrue(run_directory(self.directory).with_name(f'run-{finished.pid}').exists())
+
+        Registry(self.directory, process_id='worker').flush()
+        self.assertEqual([path.name for path in Path(self.directory).iterdir()], [run_directory(self.directory).name])
+        self.assertEqual(collect(self.directory)[0], {})
+
+
+class LoadScenarioTests(SimpleTestCase):
+    def test_every_url_has_a_load_scenario(self):
+        names = url_names(rides_urls.urlpatterns) | url_names(users_urls.urlpatterns)
+        self.assertEqual(names - set(SCENARIOS), set())
+
+
+class QueryBudgetTests(QueryBudgetMixin, RideTestCase):
+    RIDERS = 3
+
+    urlpatterns = rides_urls.urlpatterns
+    # Requests are force-authenticated, so budgets exclude the auth lookup
+    query_budgets = {
+        'fetch-rides': 4,
+        'match-rides': 4,
+        'ride-details': 4,
+        'requests-history': 1,
+        'ride-create': 1,
+        'ride-join-request': 6,
+        'ride-join-requests': 2,
+        'manage-ride-request': 10,
+        'bulk-manage-ride-requests': 10,
+        'user-rides': 5,
+        'get-created-requests': 2,
+        'ride-history': 2,
+        'ride-request-history': 2,
+        'ride-events': 0,
+        'ride-sync': 6,
+        'ride-export': 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ride = make_ride(cls.owner)
+
+    def setUp(self):
+        super().setUp()
+        self.grow()
+
+    def grow(self):
+        for _ in range(3):
+            ride = make_ride(self.owner)
+            ride.participants.add(*self.riders[:2])
+            for rider in self.riders:
+                RideJoinRequest.objects.create(ride=ride, user=rider)
+        self.ride.participants.add(User.objects.create_user(f'92{Ride.objects.count():08}', 'Extra', 'pass'))
+        RideJoinRequest.objects.create(ride=self.ride, user=self.ride.participants.last())
+
+    def get(self, url_name, user=None, args=(), params=None):
+        def make_request():
+            clear_caches()
+            self.client.force_authenticate(user)
+            return self.client.get(reverse(url_name, args=args), params)
+        return make_request
+
+    def test_listings_do_not_scale(self):
+        rider = self.riders[0]
+        self.assertQueriesDoNotScale('fetch-rides', self.get('fetch-rides', rider), self.grow)
+        self.assertQueriesDoNotScale('match-rides', self.get('match-rides', rider, params={
+            'origin': '12.9716,77.5946', 'destination': '12.9352,77.6245',
+            'departure': (timezone.now() + timedelta(hours=2)).isoformat(),
+        }), self.grow)
+        self.assertQueriesDoNotScale('ride-details', self.get('ride-details', self.owner, args=[self.ride.id]), self.grow)
+        self.assertQueriesDoNotScale('requests-history', self.get('requests-history', rider), self.grow)
+        self.assertQueriesDoNotScale('ride-join-requests',
+                                     self.get('ride-join-requests', self.owner, args=[self.ride.id]), self.grow)
+        self.assertQueriesDoNotScale('user-rides', self.get('user-rides', self.owner), self.grow)
+        self.assertQueriesDoNotScale('user-rides', self.get('user-rides', rider), self.grow)
+        self.assertQueriesDoNotScale('get-created-requests', self.get('get-created-requests', rider), self.grow)
+
+        def grow_archive():
+            for _ in range(3):
+                ride = make_ride(self.owner, status=Ride.RideStatus.COMPLETED,
+                                 departure_datetime=timezone.now() - timedelta(days=60))
+                ride.participants.add(*self.riders[:2])
+                RideJoinRequest.objects.create(
+                    ride=ride, user=self.riders[2], status=RideJoinRequest.RequestStatus.REJECTED
+                )
+            archive_rides()
+        grow_archive()
+        self.assertQueriesDoNotScale('ride-history', self.get('ride-history', rider), grow_archive)
+        self.assertQueriesDoNotScale('ride-history', self.get('ride-history', self.owner), grow_archive)
+        self.assertQueriesDoNotScale(
+            'ride-request-history', self.get('ride-request-history', self.riders[2]), grow_archive
+        )
+        self.assertQueriesDoNotScale('ride-sync', self.get('ride-sync', rider), self.grow)
+        self.assertQueriesDoNotScale('ride-sync', self.get('ride-sync', self.owner, params={
+            'since': encode_token(timezone.now() - timedelta(hours=1)),
+        }), self.grow)
+        # Opening the event stream costs nothing beyond authentication
+        self.assertWithinBudget('ride-events', self.get('ride-events', rider, params={'rides': self.ride.id}))
+        # Export rows are read while the response streams, not during the request
+        staff = User.objects.create_user('9300000001', 'Ops', 'pass', is_staff=True)
+        self.assertWithinBudget('ride-export', self.get('ride-export', staff))
+
+    def test_writes_within_budget(self):
+        rider = User.objects.create_user('9300000000', 'New Rider', 'pass')
+
+        def post(url_name, user, args=(), data=None):
+            def make_request():
+                self.client.force_authenticate(user)
+                return self.client.post(reverse(url_name, args=args), data, format='json')
+            return make_request
+
+        self.assertWithinBudget('ride-create', post('ride-create', self.owner, data={
+            'pickup_latitude': 1, 'pickup_longitude': 1, 'destination_latitude': 2, 'destination_longitude': 2,
+            'total_seats': 3, 'total_cost': 90, 'departure_datetime': (timezone.now() + timedelta(days=1)).isoformat(),
+        }))
+        self.assertWithinBudget('ride-join-request', post('ride-join-request', rider, args=[self.ride.id]))
+
+        join_request = RideJoinRequest.objects.get(ride=self.ride, user=rider)
+        self.client.force_authenticate(self.owner)
+        self.assertWithinBudget('manage-ride-request', lambda: self.client.put(
+            reverse('manage-ride-request', args=[self.ride.id, join_request.id, 'accept'])
+        ))
+        pending = RideJoinRequest.objects.filter(status=RideJoinRequest.RequestStatus.PENDING)
+        self.assertWithinBudget('bulk-manage-ride-requests', post(
+            'bulk-manage-ride-requests', self.owner, args=[pending[0].ride_id],
+            data={'actions': [{'req_id': r.id, 'action': 'reject'}
+                              for r in pending.filter(ride_id=pending[0].ride_id)]}
+        ))
+
+
+class SyntheticDataTests(TestCase):
+    def test_generated_rides_are_consistent(self):
+        rng = random.Random(1)
+        users = generate_users(30, rng)
+        requests = generate_rides(users, 60, rng, batch_size=25)
+
+        self.assertEqual(Ride.objects.count(), 60)
+        self.assertEqual(RideJoinRequest.objects.count(), requests)
+        self.assertEqual(
+            set(RideJoinRequest.objects.values_list('status', flat=True)),
+            set(RideJoinRequest.RequestStatus.values)
+        )
+        for ride in Ride.objects.prefetch_related('participants', 'join_requests'):
+            accepted = {r.user_id for r in ride.join_requests.all() if r.status == 'ACCEPTED'}
+            self.assertEqual({u.id for u in ride.participants.all()}, accepted)
+            self.assertEqual(ride.seats_available, ride.total_seats - 1 - len(accepted))
+            self.assertEqual(ride.cost_per_seat, round(ride.total_cost / ride.total_seats, 2))
+            self.assertEqual(ride.pickup_geohash, encode_geohash(ride.pickup_latitude, ride.pickup_longitude))
+            if ride.status != Ride.RideStatus.UPCOMING:
+                self.assertNotIn('PENDING', {r.status for r in ride.join_requests.all()})
@@ -4,20 +4,34 @@ from .views import (
     RequestToJoinRide,
     GetRequestsForRide,
     ManageRideJoinRequests,
-    GetUpcomingRidesView,
-    GetRideDetail,
+    BulkManageRideJoinRequests,
+    MatchRidesView,
     GetRidesRequestByUser,
     # GetCreatedRides,
-    GetUserRides,
-    MyRideJoinRequestsView
+    RideHistoryView,
+    RideRequestHistoryView,
+    RideSyncView,
+    RideExportView,
+)
+from .async_views import (
+    AsyncGetRideDetail,
+    AsyncGetUpcomingRidesView,
+    AsyncGetUserRides,
+    AsyncMyRideJoinRequestsView,
+    RideEventsView,
 )
 
 urlpatterns = [
+    # The read-heavy views are served by their async versions (see async_views.py)
+
     # Fetch all rides
-    path('fetch-upcoming-rides/', GetUpcomingRidesView.as_view(), name='fetch-rides'),
+    path('fetch-upcoming-rides/', AsyncGetUpcomingRidesView.as_view(), name='fetch-rides'),
     
+    # Rank upcoming rides by how well they fit a trip
+    path('match/', MatchRidesView.as_view(), name='match-rides'),
+
     # Fetch ride details
-    path('ride-details/<int:ride_id>/', GetRideDetail.as_view(), name='ride-details'),
+    path('ride-details/<int:ride_id>/', AsyncGetRideDetail.as_view(), name='ride-details'),
 
     # Fetch requests created by a user
     path('requests/history/', GetRidesRequestByUser.as_view(), name='requests-history'),
@@ -34,9 +48,27 @@ urlpatterns = [
     # Accept or reject a ride request (owner only)
     path('<int:ride_id>/requests/<int:req_id>/<str:action>/', ManageRideJoinRequests.as_view(), name='manage-ride-request'),
 
+    # Accept or reject several requests in one call (owner only)
+    path('<int:ride_id>/requests/bulk/', BulkManageRideJoinRequests.as_view(), name='bulk-manage-ride-requests'),
+
     # Fetch created rides
     # path('get-created-rides/', GetCreatedRides.as_view(), name='get-created-rides')
-    path('get-user-rides/', GetUserRides.as_view(), name='user-rides'),
+    path('get-user-rides/', AsyncGetUserRides.as_view(), name='user-rides'),
+
+    path('get-created-requests/', AsyncMyRideJoinRequestsView.as_view(), name='get-created-requests'),
+
+    # Archived rides the user owned or joined
+    path('history/', RideHistoryView.as_view(), name='ride-history'),
+
+    # Join requests the user made on archived rides, any status
+    path('history/requests/', RideRequestHistoryView.as_view(), name='ride-request-history'),
+
+    # Changes to the user's rides and join requests since a sync token
+    path('sync/', RideSyncView.as_view(), name='ride-sync'),
+
+    # Streaming NDJSON/CSV dump of rides (staff only)
+    path('export/', RideExportView.as_view(), name='ride-export'),
 
-    path('get-created-requests/', MyRideJoinRequestsView.as_view(), name='get-created-requests')
+    # Server-sent events: join-request and seat/status changes for the user
+    path('events/', RideEventsView.as_view(), name='ride-events'),
 ]
@@ -1,16 +1,43 @@
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
-from .models import Ride, RideJoinRequest
-from .serializers import RideJoinRequestWithRideSerializer, RideCreateSerializer, RideSerializer, RideJoinRequestSerializer, RideDetailSerializer
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from .models import ArchivedRide, ArchivedRideJoinRequest, Ride, RideJoinRequest
+from .serializers import ArchivedRideJoinRequestSerializer, ArchivedRideSerializer, RideJoinRequestStateSerializer, RideJoinRequestWithRideSerializer, RideCreateSerializer, RideSerializer, RideJoinRequestSerializer, BulkJoinRequestActionSerializer
 from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import Prefetch
+from django.db import DEFAULT_DB_ALIAS, router
+from django.db.models import Q
 from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
+from core.db_router import read_from_primary
+from .geo import parse_point, rides_within
+from .matching import match_rides
+from .filters import ride_filters
+from .pagination import keyset_paginate, parse_limit
+from .reservations import (
+    ReservationError, accept_join_request, bulk_process_join_requests, create_join_request, reject_join_request
+)
+from .cache import UPCOMING_PAGE_KEY, UPCOMING_PAGE_TIMEOUT, get_or_rebuild, render_rides
+from .conditional import etag_matches, listing_etag, not_modified, ride_etag, with_etag
+from .sync import TokenExpired, sync_changes
+from .export import (
+    CONTENT_TYPES, EXPORT_FORMATS, EXPORTS, astream_export, export_querysets, parse_bound, stream_export,
+)
 
 User = get_user_model()
 
+
+def invalid_listing_params():
+    return Response(
+        {'error': 'Invalid cursor, limit or filter parameters.'},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
 class RideCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -24,32 +51,137 @@ class RideCreateView(APIView):
 
 
 class GetUpcomingRidesView(APIView):
+    DEFAULT_RADIUS_KM = 5.0
+    MAX_RADIUS_KM = 100.0
+
     def get(self, request):
         user = request.user if request.user.is_authenticated else None
-        user_id = user.id if user else "anonymous"
-
-        cache_key = f"upcoming_rides:{user_id}"
-        cached_data = cache.get(cache_key)
-
-        if cached_data:
-            return Response(cached_data, status=status.HTTP_200_OK)
 
-        # Fetch the rides from DB
-        user_join_requests = RideJoinRequest.objects.filter(user=user) if user else RideJoinRequest.objects.none()
-
-        rides = Ride.objects.filter(status=Ride.RideStatus.UPCOMING)\
-            .select_related("owner")\
-            .prefetch_related("participants")\
-            .prefetch_related(
-                Prefetch("join_requests", queryset=user_join_requests, to_attr="user_join_requests")
+        if self.is_nearby_search(request.query_params):
+            try:
+                page = {'ride_ids': self.nearby_ride_ids(request.query_params), 'next_cursor': None}
+            except ValueError as exc:
+                return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        # Only the default first page is cached; filtered and deeper pages go to the DB
+        elif not request.query_params:
+            page = get_or_rebuild(
+                UPCOMING_PAGE_KEY, lambda: self.build_page({}, using=DEFAULT_DB_ALIAS), UPCOMING_PAGE_TIMEOUT
             )
+        else:
+            try:
+                page = self.build_page(request.query_params)
+            except ValueError:
+                return invalid_listing_params()
+
+        # Taken before rendering, so the body is never older than the ETag
+        etag = listing_etag(page, user)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        response = with_etag(Response(render_rides(page['ride_ids'], user), status=status.HTTP_200_OK), etag)
+        if page['next_cursor']:
+            response['X-Next-Cursor'] = page['next_cursor']
+        return response
+
+    @staticmethod
+    def is_nearby_search(query_params):
+        return bool(query_params.get('near_pickup') or query_params.get('near_destination'))
+
+    @staticmethod
+    def page_queryset(query_params):
+        return Ride.objects.filter(status=Ride.RideStatus.UPCOMING)\
+            .filter(ride_filters(query_params))\
+            .only('id', 'departure_datetime')
+
+    @classmethod
+    def build_page(cls, query_params, using=None):
+        rides, next_cursor = keyset_paginate(
+            cls.page_queryset(query_params).using(using),
+            ('departure_datetime', 'id'),
+            cursor=query_params.get('cursor'),
+            limit=parse_limit(query_params),
+        )
+        return {'ride_ids': [ride.id for ride in rides], 'next_cursor': next_cursor}
+
+    @classmethod
+    def nearby_ride_ids(cls, query_params):
+        """
+        Ids of UPCOMING rides near the near_pickup and/or near_destination
+        points, closest first. Raises ValueError with the message for the client.
+        """
+        near_pickup = query_params.get('near_pickup')
+        near_destination = query_params.get('near_destination')
+        try:
+            radius_km = float(query_params.get('radius_km', cls.DEFAULT_RADIUS_KM))
+            pickup = parse_point(near_pickup) if near_pickup else None
+            destination = parse_point(near_destination) if near_destination else None
+            filters = ride_filters(query_params)
+            limit = parse_limit(query_params)
+        except ValueError:
+            raise ValueError('Use near_pickup/near_destination=<lat>,<lon> and a numeric radius_km.')
+        if not 0 < radius_km <= cls.MAX_RADIUS_KM:
+            raise ValueError(f'radius_km must be between 0 and {cls.MAX_RADIUS_KM:g}.')
+
+        upcoming = Ride.objects.filter(status=Ride.RideStatus.UPCOMING).filter(filters)
+        distances = None
+        for point, lat_field, lon_field, geohash_field in (
+            (pickup, 'pickup_latitude', 'pickup_longitude', 'pickup_geohash'),
+            (destination, 'destination_latitude', 'destination_longitude', 'destination_geohash'),
+        ):
+            if point is None:
+                continue
+            found = rides_within(upcoming, lat_field, lon_field, geohash_field, point, radius_km)
+            if distances is None:
+                distances = found
+            else:
+                # Both endpoints given: keep rides near both, ranked by combined distance
+                distances = {ride_id: distances[ride_id] + d for ride_id, d in found.items() if ride_id in distances}
+
+        return sorted(distances, key=distances.get)[:limit]
+
+
+class MatchRidesView(APIView):
+    DEFAULT_WINDOW_MINUTES = 60
+    MAX_WINDOW_MINUTES = 24 * 60
+    DEFAULT_MAX_DISTANCE_KM = 3.0
+    MAX_DISTANCE_KM = 50.0
+    DEFAULT_K = 10
+    MAX_K = 50
 
-        serializer = RideSerializer(rides, many=True, context={"request": request})
-        data = serializer.data
+    def get(self, request):
+        params = request.query_params
+        try:
+            origin = parse_point(params['origin'])
+            destination = parse_point(params['destination'])
+            departure = parse_datetime(params['departure']) if 'departure' in params else timezone.now()
+            if departure is None:
+                raise ValueError('Invalid departure')
+            if timezone.is_naive(departure):
+                departure = timezone.make_aware(departure)
+            window = timedelta(minutes=min(int(params.get('window_minutes', self.DEFAULT_WINDOW_MINUTES)),
+                                           self.MAX_WINDOW_MINUTES))
+            max_pickup_km = min(float(params.get('max_pickup_km', self.DEFAULT_MAX_DISTANCE_KM)), self.MAX_DISTANCE_KM)
+            max_dropoff_km = min(float(params.get('max_dropoff_km', self.DEFAULT_MAX_DISTANCE_KM)), self.MAX_DISTANCE_KM)
+            k = min(int(params.get('k', self.DEFAULT_K)), self.MAX_K)
+            if k < 1 or max_pickup_km <= 0 or max_dropoff_km <= 0 or window.total_seconds() < 0:
+                raise ValueError('Out of range')
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'origin and destination (<lat>,<lon>) are required; departure, window_minutes, '
+                          'max_pickup_km, max_dropoff_km and k must be valid if given.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        # Store in cache for 60 seconds
-        cache.set(cache_key, data, timeout=60)  # 60 seconds
+        user = request.user if request.user.is_authenticated else None
+        matches = match_rides(
+            origin, destination, departure, window, max_pickup_km, max_dropoff_km, k, exclude_owner=user
+        )
 
+        # Rides deleted since they were matched are not rendered
+        data = render_rides([ride_id for ride_id, _ in matches], user)
+        details = dict(matches)
+        for item in data:
+            item['match'] = details[item['id']]
         return Response(data, status=status.HTTP_200_OK)
 
 
@@ -62,16 +194,21 @@ class RequestToJoinRide(APIView):
         except Ride.DoesNotExist:
             return Response({'error': 'Ride not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        if ride.owner == request.user:
+        if ride.owner_id == request.user.id:
             return Response({'error': 'You cannot join your own ride'}, status=status.HTTP_400_BAD_REQUEST)
 
         if RideJoinRequest.objects.filter(ride=ride, user=request.user).exists():
             return Response({'message': 'Join request already exists'}, status=status.HTTP_200_OK)
 
+        # Advisory only: the seat is taken when the owner accepts the request
         if ride.seats_available <= 0:
             return Response({'error': 'No seats available'}, status=status.HTTP_400_BAD_REQUEST)
 
-        join_request = RideJoinRequest.objects.create(ride=ride, user=request.user)
+        join_request, created = create_join_request(ride, request.user)
+        if not created:
+            # Lost a race with a concurrent request from the same user
+            return Response({'message': 'Join request already exists'}, status=status.HTTP_200_OK)
+
         serializer = RideJoinRequestSerializer(join_request)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -82,10 +219,10 @@ class GetRequestsForRide(APIView):
     def get(self, request, ride_id):
         ride = get_object_or_404(Ride, pk=ride_id)
 
-        if ride.owner != request.user:
+        if ride.owner_id != request.user.id:
             return Response({"error": "You are not authorized to view these requests."}, status=status.HTTP_403_FORBIDDEN)
 
-        requests = RideJoinRequest.objects.filter(ride=ride)
+        requests = RideJoinRequest.objects.filter(ride=ride).select_related('user')
         serializer = RideJoinRequestSerializer(requests, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -96,47 +233,74 @@ class ManageRideJoinRequests(APIView):
     def put(self, request, ride_id, req_id, action):
         ride = get_object_or_404(Ride, pk=ride_id)
 
-        if ride.owner != request.user:
+        if ride.owner_id != request.user.id:
             return Response({'error': 'Unauthorized. Only ride owner can manage requests.'}, status=status.HTTP_403_FORBIDDEN)
 
         join_request = get_object_or_404(RideJoinRequest, pk=req_id, ride=ride)
 
-        if join_request.status != RideJoinRequest.RequestStatus.PENDING:
-            return Response({'error': 'Request already processed.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            if action == 'accept':
+                accept_join_request(join_request)
+                return Response({'message': 'Request accepted.'}, status=status.HTTP_200_OK)
 
-        if action == 'accept':
-            if ride.seats_available <= 0:
-                return Response({'error': 'No seats available'}, status=status.HTTP_400_BAD_REQUEST)
+            elif action == 'reject':
+                reject_join_request(join_request)
+                return Response({'message': 'Request rejected.'}, status=status.HTTP_200_OK)
+        except ReservationError as e:
+            return Response({'error': e.message}, status=status.HTTP_400_BAD_REQUEST)
 
-            join_request.status = RideJoinRequest.RequestStatus.ACCEPTED
-            join_request.save()
+        return Response({'error': 'Invalid action. Use "accept" or "reject".'}, status=status.HTTP_400_BAD_REQUEST)
 
-            ride.participants.add(join_request.user)
-            ride.seats_available = max(ride.seats_available - 1, 0)
-            ride.save()
 
-            return Response({'message': 'Request accepted.'}, status=status.HTTP_200_OK)
+class BulkManageRideJoinRequests(APIView):
+    permission_classes = [IsAuthenticated]
 
-        elif action == 'reject':
-            join_request.status = RideJoinRequest.RequestStatus.REJECTED
-            join_request.save()
-            return Response({'message': 'Request rejected.'}, status=status.HTTP_200_OK)
+    def post(self, request, ride_id):
+        ride = get_object_or_404(Ride.objects.only('id', 'owner_id'), pk=ride_id)
 
-        return Response({'error': 'Invalid action. Use "accept" or "reject".'}, status=status.HTTP_400_BAD_REQUEST)
+        if ride.owner_id != request.user.id:
+            return Response({'error': 'Unauthorized. Only ride owner can manage requests.'}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = BulkJoinRequestActionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        results, seats_available = bulk_process_join_requests(ride.id, serializer.validated_data['actions'])
+        return Response({'results': results, 'seats_available': seats_available}, status=status.HTTP_200_OK)
 
 
 class GetRideDetail(APIView):
     def get(self, request, ride_id):
-        ride = get_object_or_404(Ride, pk=ride_id)
-        serializer = RideDetailSerializer(ride, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        user = request.user if request.user.is_authenticated else None
+        etag = ride_etag(ride_id, user)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        # The ride itself comes from the shared fragment cache; only the
+        # owner's view adds a query, for the join requests
+        rendered = render_rides([ride_id], user)
+        if not rendered:
+            raise Http404
+        join_requests = None
+        if rendered[0]['is_user_owner']:
+            join_requests = RideJoinRequestSerializer(self.join_requests_queryset(ride_id), many=True).data
+        return with_etag(Response(self.build_detail(rendered[0], join_requests), status=status.HTTP_200_OK), etag)
+
+    @staticmethod
+    def join_requests_queryset(ride_id):
+        return RideJoinRequest.objects.filter(ride_id=ride_id).select_related('user')
+
+    @staticmethod
+    def build_detail(ride, join_requests):
+        """RideDetailSerializer output: the rendered ride plus its join requests (owner only)."""
+        return {**ride, 'join_requests': join_requests}
 
 
 class GetRidesRequestByUser(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        join_requests = RideJoinRequest.objects.filter(user=request.user)
+        join_requests = RideJoinRequest.objects.filter(user=request.user).select_related('user')
         serializer = RideJoinRequestSerializer(join_requests, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -146,49 +310,49 @@ class GetUserRides(APIView):
     def get(self, request):
         user = request.user
 
-        # Prefetch join requests for this user only
-        user_join_requests = RideJoinRequest.objects.filter(user=user)
+        try:
+            created, accepted = self.ride_queries(user, request.query_params)
+            created_rides, created_next = keyset_paginate(*created)
+            accepted_rides, accepted_next = keyset_paginate(*accepted)
+        except ValueError:
+            return invalid_listing_params()
+
+        # Render both lists in one pass
+        rendered = render_rides([ride.id for ride in created_rides + accepted_rides], user)
+        return self.build_response(rendered, created_rides, created_next, accepted_rides, accepted_next)
+
+    @staticmethod
+    def ride_queries(user, query_params):
+        """keyset_paginate() arguments for the created and the accepted rides of `user`."""
+        # Only the page keys are read here; the rides are rendered from projections
+        rides = Ride.objects.only('id', 'created_at').filter(ride_filters(query_params))
+        limit = parse_limit(query_params)
+        ordering = ('-created_at', '-id')
 
         # Rides created by the user
-        created_rides = Ride.objects.filter(owner=user)\
-            .select_related("owner")\
-            .prefetch_related("participants")\
-            .prefetch_related(Prefetch("join_requests", queryset=user_join_requests, to_attr="user_join_requests"))\
-            .order_by('-created_at')
-
+        created = rides.filter(owner=user)
         # Rides the user was accepted into
-        accepted_requests = RideJoinRequest.objects.filter(
-            user=user,
-            status=RideJoinRequest.RequestStatus.ACCEPTED
-        ).select_related('ride')
-
-        accepted_rides = [
-            req.ride for req in accepted_requests
-        ]
-
-        # Optimize accepted_rides queryset
-        # (Important: bulk fetch rides if accepted_rides is not empty)
-        if accepted_rides:
-            accepted_rides_ids = [r.id for r in accepted_rides]
-            accepted_rides_queryset = Ride.objects.filter(id__in=accepted_rides_ids)\
-                .select_related("owner")\
-                .prefetch_related("participants")\
-                .prefetch_related(Prefetch("join_requests", queryset=user_join_requests, to_attr="user_join_requests"))
-        else:
-            accepted_rides_queryset = Ride.objects.none()
-
-        # Serialize both
-        created_rides_serialized = RideSerializer(
-            created_rides, many=True, context={'request': request}
+        accepted = rides.filter(
+            join_requests__user=user,
+            join_requests__status=RideJoinRequest.RequestStatus.ACCEPTED
         )
-        accepted_rides_serialized = RideSerializer(
-            accepted_rides_queryset, many=True, context={'request': request}
+        return (
+            (created, ordering, query_params.get('created_cursor'), limit),
+            (accepted, ordering, query_params.get('accepted_cursor'), limit),
         )
 
-        return Response({
-            "created_rides": created_rides_serialized.data,
-            "accepted_rides": accepted_rides_serialized.data
+    @staticmethod
+    def build_response(rendered, created_rides, created_next, accepted_rides, accepted_next):
+        rendered = {item['id']: item for item in rendered}
+        response = Response({
+            "created_rides": [rendered[ride.id] for ride in created_rides if ride.id in rendered],
+            "accepted_rides": [rendered[ride.id] for ride in accepted_rides if ride.id in rendered]
         }, status=status.HTTP_200_OK)
+        if created_next:
+            response['X-Next-Cursor-Created'] = created_next
+        if accepted_next:
+            response['X-Next-Cursor-Accepted'] = accepted_next
+        return response
 
 
 
@@ -198,10 +362,161 @@ class MyRideJoinRequestsView(APIView):
     def get(self, request):
         user = request.user
 
-        # Fetch all ride join requests made by the user
+        try:
+            join_requests, next_cursor = keyset_paginate(*self.page_query(user, request.query_params))
+        except ValueError:
+            return invalid_listing_params()
+
+        serializer = RideJoinRequestWithRideSerializer(join_requests, many=True, context={'request': request})
+        response = Response(serializer.data, status=status.HTTP_200_OK)
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return response
+
+    @staticmethod
+    def page_query(user, query_params):
+        """keyset_paginate() arguments for the join requests made by `user`, newest first."""
         join_requests = RideJoinRequest.objects.filter(user=user)\
+            .select_related('ride__owner')\
+            .prefetch_related('ride__participants')\
+            .filter(ride_filters(query_params, prefix='ride__'))
+        return join_requests, ('-requested_at', '-id'), query_params.get('cursor'), parse_limit(query_params)
+
+
+class RideHistoryView(APIView):
+    """
+    A user's archived rides, owned or joined, latest departure first. Rides
+    still in the hot tables are served by GetUserRides.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+
+        rides = ArchivedRide.objects.filter(
+            Q(owner=user) | Q(id__in=user.archived_rides_joined.values('id'))
+        ).select_related('owner').prefetch_related('participants')
+
+        try:
+            rides, next_cursor = keyset_paginate(
+                rides,
+                ('-departure_datetime', '-id'),
+                cursor=request.query_params.get('cursor'),
+                limit=parse_limit(request.query_params),
+            )
+        except ValueError:
+            return invalid_listing_params()
+
+        serializer = ArchivedRideSerializer(rides, many=True, context={'request': request})
+        response = Response(serializer.data, status=status.HTTP_200_OK)
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return response
+
+
+class RideRequestHistoryView(APIView):
+    """
+    The join requests a user made on rides that have since been archived,
+    whatever their status, newest first. Requests on rides still in the hot
+    tables are served by MyRideJoinRequestsView.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        join_requests = ArchivedRideJoinRequest.objects.filter(user=request.user)\
             .select_related('ride__owner')\
             .prefetch_related('ride__participants')
 
-        serializer = RideJoinRequestWithRideSerializer(join_requests, many=True, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+        try:
+            join_requests, next_cursor = keyset_paginate(
+                join_requests,
+                ('-requested_at', '-id'),
+                cursor=request.query_params.get('cursor'),
+                limit=parse_limit(request.query_params),
+            )
+        except ValueError:
+            return invalid_listing_params()
+
+        serializer = ArchivedRideJoinRequestSerializer(join_requests, many=True, context={'request': request})
+        response = Response(serializer.data, status=status.HTTP_200_OK)
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return response
+
+
+class RideSyncView(APIView):
+    """
+    Delta sync of the user's rides and join requests (see rides.sync). Pass
+    the `token` of the previous response as `since`; without it everything is
+    returned, as for a first sync. Reads go to the primary.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+        # The token is stamped with the primary's time; a lagging replica could
+        # miss changes from before it for longer than SYNC_OVERLAP re-reads
+        read_from_primary()
+        try:
+            changes = sync_changes(user, request.query_params.get('since'))
+        except TokenExpired:
+            return Response(
+                {'error': 'Sync token expired. Sync again without since.'},
+                status=status.HTTP_410_GONE
+            )
+        except ValueError:
+            return Response({'error': 'Invalid sync token.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'rides': render_rides(changes['ride_ids'], user),
+            'join_requests': RideJoinRequestStateSerializer(changes['join_requests'], many=True).data,
+            'deleted': changes['deleted'],
+            'token': changes['token'],
+        }, status=status.HTTP_200_OK)
+
+
+class RideExportView(APIView):
+    """
+    Staff-only streaming dump of rides (default) or join requests, live and
+    archived, as NDJSON (default) or CSV:
+    ?kind=join_requests&output=csv&departed_after=2025-01-01&departed_before=2025-01-31&status=ACCEPTED
+    Dates are inclusive and apply to the ride's departure; see rides.export.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        kind = params.get('kind', 'rides')
+        export_format = params.get('output', 'ndjson')
+        if kind not in EXPORTS:
+            return Response(
+                {'error': f"kind must be one of: {', '.join(EXPORTS)}."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"output must be one of: {', '.join(EXPORT_FORMATS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            querysets = export_querysets(
+                kind,
+                departed_after=parse_bound(params['departed_after']) if params.get('departed_after') else None,
+                departed_before=(
+                    parse_bound(params['departed_before'], end=True) if params.get('departed_before') else None
+                ),
+                statuses=[value for value in params.get('status', '').split(',') if value],
+            )
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Rows are read while the response streams, after the request's DB
+        # routing has ended, so pick the database now
+        querysets = [queryset.using(router.db_for_read(queryset.model)) for queryset in querysets]
+        # Each server gets the iterator it can stream without buffering
+        if isinstance(request._request, ASGIRequest):
+            lines = astream_export(querysets, kind, export_format)
+        else:
+            lines = stream_export(querysets, kind, export_format)
+        response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{export_format}"'
+        return response
@@ -0,0 +1,13 @@
+from rest_framework.permissions import IsAuthenticated
+
+from core.async_views import AsyncAPIView
+
+from .serializers import UserSerializer
+
+
+class AsyncGetUserData(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+
+    async def get(self, request):
+        # The user was loaded by authentication; nothing else to fetch
+        return self.respond(UserSerializer(request.user).data)
@@ -0,0 +1,172 @@
+"""
+Stateless JWT authentication.
+
+Tokens carry the user's full_name and phone_number next to the id (see
+ClaimsRefreshToken), so ClaimsJWTAuthentication resolves a request to a
+CustomUser built from the claims instead of loading the row by id. Only
+whether the user is still active is looked up, through a cache entry that
+lives USER_STATE_TTL seconds and is dropped when the user is saved, so a
+deactivation takes effect right away where the cache is shared and within
+the TTL otherwise. Fields not carried in the token (is_staff, password, ...)
+are deferred and load from the DB on first access.
+"""
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, router
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core.async_cache import cache as async_cache
+from core.metrics import record_auth_lookup
+
+User = get_user_model()
+
+USER_CLAIMS = ('full_name', 'phone_number')
+USER_STATE_TTL = 60
+
+ACTIVE, INACTIVE, MISSING = 'active', 'inactive', 'missing'
+
+
+def user_state_key(user_id):
+    return f"user_state:{user_id}"
+
+
+def _state(is_active):
+    return MISSING if is_active is None else ACTIVE if is_active else INACTIVE
+
+
+def remember_user_state(user):
+    """Prime the state cache from a user that was just loaded anyway."""
+    cache.set(user_state_key(user.pk), _state(user.is_active), USER_STATE_TTL)
+
+
+def forget_user_state(user_id):
+    cache.delete(user_state_key(user_id))
+
+
+def _load_state(user_id):
+    # Cached for everyone: a lagging replica could bring back a deactivated user
+    return User.objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id).values_list('is_active', flat=True).first()
+
+
+def user_state(user_id):
+    """ACTIVE, INACTIVE or MISSING, cached for USER_STATE_TTL seconds."""
+    key = user_state_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        record_auth_lookup('state_db')
+        state = _state(_load_state(user_id))
+        cache.set(key, state, USER_STATE_TTL)
+    else:
+        record_auth_lookup('state_cache')
+    return state
+
+
+async def auser_state(user_id):
+    key = user_state_key(user_id)
+    state = await async_cache.get(key)
+    if state is None:
+        record_auth_lookup('state_db')
+        state = _state(await User.objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id).values_list('is_active', flat=True).afirst())
+        await async_cache.set_many({key: state}, timeout=USER_STATE_TTL)
+    else:
+        record_auth_lookup('state_cache')
+    return state
+
+
+def add_user_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """Refresh token with the user claims; access tokens made from it copy them."""
+
+    @classmethod
+    def for_user(cls, user):
+        return add_user_claims(super().for_user(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    TokenRefreshSerializer that writes the user's current claims into the new
+    access token, so profile changes reach clients on their next refresh.
+    """
+    token_class = ClaimsRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = User.objects.filter(**{jwt_settings.USER_ID_FIELD: refresh.get(jwt_settings.USER_ID_CLAIM)}).first()
+        if user is None or not jwt_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        remember_user_state(user)
+        add_user_claims(refresh, user)
+
+        data = {'access': str(refresh.access_token)}
+        if jwt_settings.ROTATE_REFRESH_TOKENS:
+            if jwt_settings.BLACKLIST_AFTER_ROTATION:
+                try:
+                    refresh.blacklist()
+                except AttributeError:
+                    # The blacklist app is not installed
+                    pass
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data['refresh'] = str(refresh)
+        return data
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication resolving the user from the token claims. Tokens
+    without the claims (issued before they were added) and CHECK_REVOKE_TOKEN,
+    which needs the password hash, fall back to the DB lookup.
+    """
+
+    def is_stateless(self, validated_token):
+        return (
+            not jwt_settings.CHECK_REVOKE_TOKEN
+            and jwt_settings.USER_ID_FIELD == User._meta.pk.attname
+            and all(claim in validated_token for claim in USER_CLAIMS)
+        )
+
+    def get_user(self, validated_token):
+        if not self.is_stateless(validated_token):
+            record_auth_lookup('user_db')
+            return super().get_user(validated_token)
+        user_id = self.user_id(validated_token)
+        state = user_state(user_id)
+        self.check_state(state)
+        return self.claims_user(user_id, validated_token, state)
+
+    @staticmethod
+    def user_id(validated_token):
+        try:
+            return User._meta.pk.to_python(validated_token[jwt_settings.USER_ID_CLAIM])
+        except (KeyError, ValidationError):
+            raise InvalidToken('Token contained no recognizable user identification')
+
+    @staticmethod
+    def check_state(state):
+        # Same errors as JWTAuthentication.get_user
+        if state == MISSING:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if jwt_settings.CHECK_USER_IS_ACTIVE and state == INACTIVE:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+
+    @staticmethod
+    def claims_user(user_id, validated_token, state):
+        """A CustomUser with the claimed fields and `state`; the others are deferred."""
+        # Inactive users get here when CHECK_USER_IS_ACTIVE is off
+        values = {User._meta.pk.attname: user_id, 'is_active': state == ACTIVE}
+        values.update((claim, validated_token[claim]) for claim in USER_CLAIMS)
+        # from_db() takes the values in field order
+        names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+        return User.from_db(router.db_for_read(User), names, [values[name] for name in names])
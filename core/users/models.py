@@ -5,9 +5,7 @@ from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, Permis
 from django.db import models
 
 class CustomUserManager(BaseUserManager):
-    print("in CustomUserManager class")
     def create_user(self, phone_number, full_name, password=None, **extra_fields):
-        print("in CustomUserManager/create_user method")
         if not phone_number:
             raise ValueError('The phone number must be set')
         user = self.model(phone_number=phone_number, full_name=full_name, **extra_fields)
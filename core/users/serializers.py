@@ -1,7 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from django.contrib.auth import authenticate
-from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import ClaimsRefreshToken, remember_user_state
 
 User = get_user_model()
 
@@ -13,7 +14,6 @@ class UserSerializer(serializers.ModelSerializer):
         extra_kwargs = {'password': {'write_only': True}}
 
     def create(self, validated_data):
-        print("in UserSerializer/create method")
         password = validated_data.pop('password')
         user = User(**validated_data)
         user.set_password(password)  # Hash password
@@ -21,6 +21,16 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
+class UserImportSerializer(serializers.Serializer):
+    """
+    A user row of a bulk import (rides.bulk_import). Phone number uniqueness
+    is checked by the importer for the whole batch at once.
+    """
+    phone_number = serializers.CharField(max_length=15)
+    full_name = serializers.CharField(max_length=255)
+    password = serializers.CharField(required=False, allow_null=True)
+
+
 class UserLoginSerializer(serializers.Serializer):
     phone_number = serializers.CharField()
     password = serializers.CharField(write_only=True)
@@ -40,10 +50,9 @@ class UserLoginSerializer(serializers.Serializer):
         else:
             raise serializers.ValidationError("Both phone number and password are required", code='authorization')
 
-        # Generate tokens
-        refresh = RefreshToken.for_user(user)
-        print(refresh.access_token.check_exp)
-        print("REFESH: ", refresh)
+        # Generate tokens; they carry the user claims for stateless authentication
+        refresh = ClaimsRefreshToken.for_user(user)
+        remember_user_state(user)
         return {
             'access': str(refresh.access_token),
             'refresh': str(refresh),
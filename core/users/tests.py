@@ -1,3 +1,137 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.testing import QueryBudgetMixin
+
+from . import urls as users_urls
+from .authentication import ClaimsJWTAuthentication, ClaimsRefreshToken
+
+User = get_user_model()
+
+
+class GetUserDataTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('9000000001', 'Existing User', 'pass')
+
+    def test_requires_authentication(self):
+        response = self.client.get(reverse('get-user-data'))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'].code, 'not_authenticated')
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+
+    def test_returns_user(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse('get-user-data'))
+        self.assertEqual(response.data, {'id': self.user.id, 'full_name': 'Existing User', 'phone_number': '9000000001'})
+        self.assertEqual(self.client.post(reverse('get-user-data')).status_code, 405)
+
+
+class StatelessAuthenticationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('9000000001', 'Existing User', 'pass')
+        cache.clear()
+
+    def log_in(self):
+        response = self.client.post(reverse('user-login'), {'phone_number': '9000000001', 'password': 'pass'})
+        return response.data
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return ClaimsJWTAuthentication().authenticate(request)[0]
+
+    def test_user_comes_from_the_claims(self):
+        access = self.log_in()['access']
+        with self.assertNumQueries(0):
+            user = self.authenticate(access)
+        self.assertEqual((user, user.full_name, user.phone_number), (self.user, 'Existing User', '9000000001'))
+        # Fields outside the token still load on demand
+        self.assertFalse(user.is_staff)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('get-user-data'))
+        self.assertEqual(response.data, {'id': self.user.id, 'full_name': 'Existing User', 'phone_number': '9000000001'})
+
+    def test_active_state_is_cached_and_revoked_on_save(self):
+        access = ClaimsRefreshToken.for_user(self.user).access_token
+        with self.assertNumQueries(1):
+            self.authenticate(access)
+        with self.assertNumQueries(0):
+            self.authenticate(access)
+
+        self.user.is_active = False
+        self.user.save()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        response = self.client.get(reverse('get-user-data'))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'user_inactive')
+
+        self.user.delete()
+        self.assertEqual(self.client.get(reverse('get-user-data')).data['code'], 'user_not_found')
+
+    def test_inactive_user_is_not_claimed_active(self):
+        self.user.is_active = False
+        self.user.save()
+        access = ClaimsRefreshToken.for_user(self.user).access_token
+        with mock.patch.object(jwt_settings, 'CHECK_USER_IS_ACTIVE', False):
+            self.assertFalse(self.authenticate(access).is_active)
+
+    def test_tokens_without_claims_load_the_user(self):
+        with self.assertNumQueries(1):
+            user = self.authenticate(AccessToken.for_user(self.user))
+        self.assertEqual(user.full_name, 'Existing User')
+
+    def test_refresh_carries_current_claims(self):
+        refresh = self.log_in()['refresh']
+        self.user.full_name = 'Renamed User'
+        self.user.save()
+        access = self.client.post(reverse('token_refresh'), {'refresh': refresh}).data['access']
+        self.assertEqual(AccessToken(access)['full_name'], 'Renamed User')
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post(reverse('token_refresh'), {'refresh': refresh})
+        self.assertEqual(response.status_code, 401)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    urlpatterns = users_urls.urlpatterns
+    query_budgets = {
+        'user-register': 2,
+        'user-login': 2,
+        'token_refresh': 1,
+        # Stateless authentication: the login primed the user's state
+        'get-user-data': 0,
+    }
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('9000000001', 'Existing User', 'pass')
+
+    def test_endpoints_within_budget(self):
+        self.assertWithinBudget('user-register', lambda: self.client.post(reverse('user-register'), {
+            'phone_number': '9000000002', 'full_name': 'New User', 'password': 'secret'
+        }))
+
+        login = {}
+        def log_in():
+            response = self.client.post(reverse('user-login'), {'phone_number': '9000000001', 'password': 'pass'})
+            login.update(response.data)
+            return response
+        self.assertWithinBudget('user-login', log_in)
+
+        self.assertWithinBudget('token_refresh', lambda: self.client.post(
+            reverse('token_refresh'), {'refresh': login['refresh']}
+        ))
 
-# Create your tests here.
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {login['access']}")
+        self.assertWithinBudget('get-user-data', lambda: self.client.get(reverse('get-user-data')))
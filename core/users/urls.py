@@ -1,5 +1,6 @@
 from django.urls import path
-from .views import UserCreateView, UserLoginView, GetUserData
+from .views import UserCreateView, UserLoginView
+from .async_views import AsyncGetUserData
 from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns = [
@@ -7,5 +8,5 @@ urlpatterns = [
     path('login/', UserLoginView.as_view(), name='user-login'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     
-    path('get-user-data/', GetUserData.as_view(), name='get-user-data')
+    path('get-user-data/', AsyncGetUserData.as_view(), name='get-user-data')
 ]
\ No newline at end of file